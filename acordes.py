@@ -0,0 +1,185 @@
+"""
+Modelo de acordes: se parsean una sola vez y se transportan con aritmética
+entera sobre la clase de altura (Do=0 ... Si=11).
+
+- parsear_acorde(texto): Acorde inmutable, memoizado
+- Acorde.transportar(semitonos): suma módulo 12 + render a notación latina memoizado
+- transportar_acorde / convertir_a_latex: misma API y misma salida de siempre
+- es_linea_acordes(linea): clasifica una línea entera con una sola regex
+"""
+import re
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Optional
+
+notas = ['C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#', 'A', 'A#', 'B']
+equivalencias_latinas = {
+    'Do': 'C', 'Do#': 'C#', 'Re': 'D', 'Re#': 'D#', 'Mi': 'E', 'Fa': 'F',
+    'Fa#': 'F#', 'Sol': 'G', 'Sol#': 'G#', 'La': 'A', 'La#': 'A#', 'Si': 'B'
+}
+
+_INDICE_NOTA = {nota: i for i, nota in enumerate(notas)}
+
+# Bemoles latinos que se pasan a sostenido antes de transportar
+# (Solb no se convierte a Fa# para mantener consistencia con el mapa de bemoles)
+_BEMOLES_LATINOS = {'reb': 'Do#', 'mib': 'Re#', 'lab': 'Sol#', 'sib': 'La#'}
+
+# Prefijo latino -> nota americana. Los sostenidos no hacen falta: 'Do#' ya
+# entra por 'Do' y el '#' queda pegado a la nota americana.
+_LATINAS_A_AMERICANAS = {'do': 'C', 're': 'D', 'mi': 'E', 'fa': 'F', 'la': 'A', 'si': 'B'}
+
+_PREFIJOS_LATINOS = ('do', 're', 'mi', 'fa', 'sol', 'la', 'si')
+
+_MAPA_LATINO = {
+    'C': 'Do', 'C#': 'Do#', 'D': 'Re', 'D#': 'Re#', 'E': 'Mi', 'F': 'Fa',
+    'F#': 'Fa#', 'G': 'Sol', 'G#': 'Sol#', 'A': 'La', 'A#': 'La#', 'B': 'Si',
+    'Cm': 'Dom', 'C#m': 'Do#m', 'Dm': 'Rem', 'D#m': 'Re#m', 'Em': 'Mim',
+    'Fm': 'Fam', 'F#m': 'Fa#m', 'Gm': 'Solm', 'G#m': 'Sol#m',
+    'Am': 'Lam', 'A#m': 'La#m', 'Bm': 'Sim'
+}
+
+# Conversión de sostenidos a bemoles (SOLO para La#)
+_BEMOLES_EXCEPCION = {'La#': 'Sib', 'La#m': 'Sibm'}
+
+_RE_NOTA = re.compile(r'^([A-Ga-g][#b]?)(.*)$')
+_RE_RAIZ = re.compile(r'^([A-Ga-g][#b]?m?)(.*)$')
+
+
+def _normalizar_bemoles_ingleses(acorde):
+    acorde = acorde.replace('Bb', 'A#').replace('bb', 'a#')
+    return acorde.replace('Gb', 'F#').replace('gb', 'f#')
+
+
+@dataclass(frozen=True, slots=True)
+class Acorde:
+    """
+    Acorde ya parseado.
+    - raiz: clase de altura 0-11, o None si no se reconoce (se deja tal cual)
+    - sufijo: calidad/extensión ('m7', 'sus4'...); si raiz es None, el texto completo
+    - minuscula: la nota venía en minúscula americana ('c', 'f#'...)
+    - bajo: acorde del bajo en acordes con barra (D/F#)
+    - original: texto tal como venía en la línea de acordes
+    """
+    raiz: Optional[int]
+    sufijo: str
+    minuscula: bool = False
+    bajo: Optional["Acorde"] = None
+    original: str = ""
+
+    def transportar(self, semitonos):
+        """Texto del acorde transportado, en notación latina."""
+        if self.raiz is None:
+            texto = self.sufijo
+        else:
+            texto = _renderizar((self.raiz + semitonos) % 12, self.minuscula, self.sufijo)
+        if self.bajo is not None:
+            return f"{texto}/{self.bajo.transportar(semitonos)}"
+        return texto
+
+
+def _parsear_simple(acorde):
+    """Parsea un acorde sin barra."""
+    acorde = _normalizar_bemoles_ingleses(acorde.strip())
+
+    # Bemoles latinos -> sostenidos
+    sostenido = _BEMOLES_LATINOS.get(acorde.lower()[:3])
+    if sostenido is not None:
+        acorde = sostenido + acorde[3:]
+
+    # Latina -> americana
+    minusculas = acorde.lower()
+    if minusculas.startswith('sol'):
+        acorde = 'G' + acorde[3:]
+    else:
+        americana = _LATINAS_A_AMERICANAS.get(minusculas[:2])
+        if americana is not None:
+            acorde = americana + acorde[2:]
+
+    match = _RE_NOTA.match(acorde)
+    if not match:
+        return Acorde(None, acorde)
+    nota, sufijo = match.groups()
+    idx = _INDICE_NOTA.get(nota.upper())
+    if idx is None:
+        # Ebm, Ab, E#...: no se transportan, se dejan tal cual
+        return Acorde(None, acorde)
+    return Acorde(idx, sufijo, nota[0].islower())
+
+
+@lru_cache(maxsize=4096)
+def parsear_acorde(texto):
+    """
+    Texto de un acorde (latino o americano, con o sin bajo) -> Acorde.
+    Lanza ValueError si tiene más de una barra, igual que siempre.
+    """
+    acorde = _normalizar_bemoles_ingleses(texto.strip())
+    if '/' in acorde:
+        parte_superior, bajo = acorde.split('/')
+        superior = _parsear_simple(parte_superior)
+        return Acorde(
+            superior.raiz, superior.sufijo, superior.minuscula,
+            _parsear_simple(bajo), texto
+        )
+    simple = _parsear_simple(acorde)
+    return Acorde(simple.raiz, simple.sufijo, simple.minuscula, None, texto)
+
+
+@lru_cache(maxsize=4096)
+def _renderizar(raiz, minuscula, sufijo):
+    nota = notas[raiz]
+    if minuscula:
+        nota = nota.lower()
+    return convertir_a_latex(nota + sufijo)
+
+
+def transportar_acorde(acorde, semitonos):
+    return parsear_acorde(acorde).transportar(semitonos)
+
+
+def convertir_a_latex(acorde):
+    acorde = _normalizar_bemoles_ingleses(acorde.strip())
+    acorde = acorde.replace('F#', 'FA#').replace('f#', 'fa#')
+    acorde = acorde.replace('C#', 'DO#').replace('c#', 'do#')
+
+    if acorde.lower().startswith(_PREFIJOS_LATINOS):
+        return acorde
+
+    # Manejar acordes con bajo (por ejemplo D/F#)
+    if '/' in acorde:
+        parte_superior, bajo = acorde.split('/')
+        return f"{convertir_a_latex(parte_superior)}/{convertir_a_latex(bajo)}"
+
+    match = _RE_RAIZ.match(acorde)
+    if match:
+        raiz, extension = match.groups()
+        raiz_mayus = raiz[0].upper() + raiz[1:]
+        raiz_convertida = _MAPA_LATINO.get(raiz_mayus, raiz)
+        # Convertir SÓLO La# a Sib
+        raiz_convertida = _BEMOLES_EXCEPCION.get(raiz_convertida, raiz_convertida)
+        return raiz_convertida + extension
+
+    return acorde
+
+
+# =========================
+# LÍNEAS DE ACORDES
+# =========================
+# Un token es acorde si empieza por una nota (latina o americana) seguida de
+# fin de token o de un sufijo conocido. La regex se aplica a la línea en
+# minúsculas; \S*+ es posesivo, así que nunca retrocede dentro de un token
+# y la clasificación es lineal en el largo de la línea.
+_SUFIJO_COMUN = r'(?!\S)|[m79/]|dim|aug|sus|add|11|13'
+_TOKEN_ACORDE = (
+    r'(?:(?:(?:do|re|fa|sol|la)#?|mi|si|reb|mib|lab|sib)(?:' + _SUFIJO_COMUN + r')'
+    r'|[a-g](?:' + _SUFIJO_COMUN + r'|[#b]))\S*+'
+)
+_RE_LINEA_ACORDES = re.compile(
+    r'\s*' + _TOKEN_ACORDE + r'(?:\s+' + _TOKEN_ACORDE + r')*\s*'
+)
+
+
+def es_linea_acordes(linea):
+    # Si la línea tiene guiones bajos, NO es acorde
+    if '_' in linea:
+        return False
+    return _RE_LINEA_ACORDES.fullmatch(linea.lower()) is not None
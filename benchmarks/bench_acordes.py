@@ -0,0 +1,118 @@
+"""
+Verifica y mide el modelo de acordes (acordes.py).
+
+    python benchmarks/bench_acordes.py [-n 100000]
+
+1. Compara transportar_acorde y convertir_a_latex con la implementación
+   original sobre todo el vocabulario (raíces latinas/americanas, bemoles,
+   sufijos, bajos y transposiciones de -13 a +13). Cualquier diferencia
+   aborta el benchmark.
+2. Mide el rendimiento transportando N tokens de acordes.
+"""
+import argparse
+import itertools
+import os
+import random
+import sys
+import time
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+import acordes  # noqa: E402
+from referencia import convertir_a_latex_original, transportar_acorde_original  # noqa: E402
+
+RAICES = [
+    'Do', 'do', 'DO', 'Do#', 'do#', 'Re', 're', 'Re#', 'Mi', 'mi', 'Fa', 'fa',
+    'Fa#', 'fa#', 'Sol', 'sol', 'Sol#', 'La', 'la', 'La#', 'Si', 'si',
+    'Reb', 'reb', 'Mib', 'Lab', 'Sib', 'sib', 'Solb', 'Dob', 'Fab',
+    'C', 'c', 'C#', 'c#', 'D', 'd', 'D#', 'E', 'e', 'F', 'f', 'F#', 'f#',
+    'G', 'g', 'G#', 'A', 'a', 'A#', 'a#', 'B', 'b',
+    'Cb', 'Db', 'Eb', 'eb', 'Fb', 'Gb', 'gb', 'Ab', 'Bb', 'bb', 'E#', 'B#',
+    'H', 'X', '',
+]
+SUFIJOS = [
+    '', 'm', 'm7', '7', 'maj7', 'Maj7', 'M7', 'sus4', 'sus2', '7sus4', 'add9',
+    'aug', 'dim', 'dim7', '6', '9', '11', '13', 'm7b5', '7#9', 'b9', '+', '°',
+    'min', 'bb', 'Gb', 'F#', 'o', 'a', '#',
+]
+BAJOS = [None, 'E', 'F#', 'Bb', 'Mi', 'Solb', 'c#', 'Sol#', 'X', '']
+
+
+def vocabulario():
+    for raiz, sufijo, bajo in itertools.product(RAICES, SUFIJOS, BAJOS):
+        yield raiz + sufijo + ('' if bajo is None else '/' + bajo)
+    yield from ('C/E/G', 'A//B', '/', 'Do / Mi')
+
+
+def _resultado(funcion, *args):
+    try:
+        return funcion(*args)
+    except Exception as e:
+        return ('excepción', type(e).__name__)
+
+
+def verificar():
+    casos = 0
+    for acorde in vocabulario():
+        esperado = _resultado(convertir_a_latex_original, acorde)
+        obtenido = _resultado(acordes.convertir_a_latex, acorde)
+        if esperado != obtenido:
+            sys.exit(f"convertir_a_latex({acorde!r}): {obtenido!r} != {esperado!r}")
+        for semitonos in range(-13, 14):
+            esperado = _resultado(transportar_acorde_original, acorde, semitonos)
+            obtenido = _resultado(acordes.transportar_acorde, acorde, semitonos)
+            if esperado != obtenido:
+                sys.exit(
+                    f"transportar_acorde({acorde!r}, {semitonos}): "
+                    f"{obtenido!r} != {esperado!r}"
+                )
+            casos += 1
+    return casos
+
+
+def tokens_realistas(n, semilla=0):
+    """Tokens como los de un cancionero: pocas raíces y sufijos, muy repetidos."""
+    rnd = random.Random(semilla)
+    raices = ['Do', 'Re', 'Mi', 'Fa', 'Sol', 'La', 'Si', 'Sib', 'Mib', 'Fa#',
+              'C', 'D', 'E', 'F', 'G', 'A', 'B', 'Bb', 'F#', 'C#']
+    sufijos = ['', '', '', 'm', 'm', '7', 'm7', 'maj7', 'sus4', 'add9']
+    tokens = []
+    for _ in range(n):
+        acorde = rnd.choice(raices) + rnd.choice(sufijos)
+        if rnd.random() < 0.1:
+            acorde += '/' + rnd.choice(raices)
+        tokens.append((acorde, rnd.randint(-5, 5)))
+    return tokens
+
+
+def medir(funcion, tokens):
+    inicio = time.perf_counter()
+    for acorde, semitonos in tokens:
+        funcion(acorde, semitonos)
+    return time.perf_counter() - inicio
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("-n", "--tokens", type=int, default=100_000)
+    opciones = parser.parse_args()
+
+    casos = verificar()
+    print(f"Salida idéntica a la implementación original en {casos} casos")
+
+    tokens = tokens_realistas(opciones.tokens)
+    acordes.parsear_acorde.cache_clear()
+    acordes._renderizar.cache_clear()
+    original = medir(transportar_acorde_original, tokens)
+    nuevo = medir(acordes.transportar_acorde, tokens)
+
+    print(f"{len(tokens)} tokens de acordes")
+    print(f"  original: {original:.3f} s ({len(tokens) / original:,.0f} acordes/s)")
+    print(f"  modelo:   {nuevo:.3f} s ({len(tokens) / nuevo:,.0f} acordes/s)")
+    print(f"  aceleración: x{original / nuevo:.1f}")
+    print(f"  caché de parseo: {acordes.parsear_acorde.cache_info()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""
+Verifica y mide el árbol intermedio (songpro.py + latex_cancionero.py).
+
+    python benchmarks/bench_ast.py [--canciones 2000]
+
+1. El render LaTeX del árbol es idéntico al parser original en un
+   cancionero sintético (cualquier diferencia aborta).
+2. Tiempos: parser original, parseo al árbol, render del árbol, y render
+   con el árbol tomado de CacheAST (lo que cuesta re-renderizar el mismo texto).
+"""
+import argparse
+import os
+import sys
+import time
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+import latex_cancionero  # noqa: E402
+from generador import generar_cancionero  # noqa: E402
+from referencia import convertir_songpro_original  # noqa: E402
+from songpro import CacheAST, parsear_cancionero  # noqa: E402
+
+
+def cronometrar(funcion, *args):
+    inicio = time.perf_counter()
+    resultado = funcion(*args)
+    return resultado, time.perf_counter() - inicio
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--canciones", type=int, default=2000)
+    opciones = parser.parse_args()
+
+    texto = generar_cancionero(opciones.canciones)
+
+    esperado, original = cronometrar(convertir_songpro_original, texto)
+    cancionero, parseo = cronometrar(parsear_cancionero, texto)
+    # Sin las entradas de titleidx, que el parser original no emitía
+    obtenido, render = cronometrar(latex_cancionero.renderizar, cancionero, False)
+    if obtenido != esperado:
+        sys.exit("El render del árbol difiere del parser original")
+    print(f"Salida idéntica al parser original ({opciones.canciones} canciones)")
+
+    cache = CacheAST(4)
+    cache.parsear(texto)
+    inicio = time.perf_counter()
+    latex_cancionero.renderizar(cache.parsear(texto)[0])
+    cacheado = time.perf_counter() - inicio
+
+    print(f"  original:          {original:.3f} s")
+    print(f"  parseo al árbol:   {parseo:.3f} s")
+    print(f"  render LaTeX:      {render:.3f} s")
+    print(f"  render con caché:  {cacheado:.3f} s (x{original / cacheado:.1f} frente al original)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+Mide cuánto tiempo por pasada de pdflatex ahorra el formato precompilado.
+
+    python benchmarks/bench_formato.py [cancionero.txt] [-n 5]
+
+Compila el mismo .tex una pasada a la vez, con y sin -fmt, y muestra
+media y mínimo por pasada. Sin argumento usa 1.txt (un cancionero casi
+vacío, o sea, prácticamente sólo el costo de arranque).
+"""
+import argparse
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+os.chdir(RAIZ)
+sys.path.insert(0, RAIZ)
+
+import formato_tex  # noqa: E402
+from convert import convertir_songpro, registro_plantillas  # noqa: E402
+
+plantilla = registro_plantillas.obtener()
+
+
+def generar_tex(texto):
+    return plantilla.documento(convertir_songpro(texto))
+
+
+def medir(tex, repeticiones, args, env):
+    tiempos = []
+    with tempfile.TemporaryDirectory() as tmp:
+        with open(os.path.join(tmp, "bench.tex"), "w", encoding="utf-8") as f:
+            f.write(tex)
+        for _ in range(repeticiones):
+            inicio = time.perf_counter()
+            r = subprocess.run(
+                ["pdflatex", "-interaction=nonstopmode", *args, "bench.tex"],
+                capture_output=True, text=True, cwd=tmp, env=env
+            )
+            tiempos.append(time.perf_counter() - inicio)
+            if r.returncode != 0:
+                sys.exit("pdflatex falló:\n" + r.stdout[-2000:])
+    return tiempos
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("entrada", nargs="?", default="1.txt")
+    parser.add_argument("-n", "--repeticiones", type=int, default=5)
+    opciones = parser.parse_args()
+
+    if shutil.which("pdflatex") is None:
+        sys.exit("pdflatex no está instalado.")
+
+    with open(opciones.entrada, encoding="utf-8") as f:
+        tex = generar_tex(f.read())
+
+    inicio = time.perf_counter()
+    args, env = formato_tex.argumentos_pdflatex(plantilla)
+    construccion = time.perf_counter() - inicio
+    if not args:
+        sys.exit("No se pudo generar el formato precompilado.")
+
+    # Una pasada de calentamiento para que el caché de disco no sesgue la primera medida
+    medir(tex, 1, [], None)
+    sin_formato = medir(tex, opciones.repeticiones, [], None)
+    con_formato = medir(tex, opciones.repeticiones, args, env)
+
+    media_sin = statistics.mean(sin_formato)
+    media_con = statistics.mean(con_formato)
+    print(f"Formato: {args[0]} (obtenido en {construccion:.2f} s)")
+    print(f"{'':14}{'media':>10}{'mínimo':>10}")
+    print(f"{'sin formato':14}{media_sin:>9.3f}s{min(sin_formato):>9.3f}s")
+    print(f"{'con formato':14}{media_con:>9.3f}s{min(con_formato):>9.3f}s")
+    print(
+        f"Ahorro por pasada: {media_sin - media_con:.3f} s "
+        f"({100 * (media_sin - media_con) / media_sin:.0f}%)"
+    )
+
+
+if __name__ == "__main__":
+    main()
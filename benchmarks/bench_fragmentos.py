@@ -0,0 +1,73 @@
+"""
+Mide la caché de fragmentos por canción (cache_fragmentos.py).
+
+    python benchmarks/bench_fragmentos.py [--canciones 300] [-n 20]
+
+Simula a quien corrige una canción y reenvía el libro entero: cada vuelta
+cambia una línea de una canción distinta y convierte el texto completo.
+Compara la conversión en frío (parsear + renderizar todo) con la que usa
+los fragmentos ya guardados, y verifica que la salida sea idéntica
+(cualquier diferencia aborta).
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+import latex_cancionero  # noqa: E402
+from cache_fragmentos import CacheFragmentos  # noqa: E402
+from generador import generar_cancionero  # noqa: E402
+from songpro import parsear_cancionero  # noqa: E402
+
+
+def en_frio(texto):
+    return list(latex_cancionero.renderizar_stream(parsear_cancionero(texto)))
+
+
+def editar(lineas, inicios, vuelta):
+    """El texto con el título de una canción cambiado (una distinta en cada vuelta)."""
+    editadas = list(lineas)
+    i = inicios[vuelta % len(inicios)]
+    editadas[i] = f"{editadas[i]} v{vuelta}"
+    return '\n'.join(editadas)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--canciones", type=int, default=300)
+    parser.add_argument("-n", "--repeticiones", type=int, default=20)
+    opciones = parser.parse_args()
+
+    lineas = generar_cancionero(opciones.canciones).split('\n')
+    inicios = [i for i, linea in enumerate(lineas) if linea.startswith('O ')]
+    cache = CacheFragmentos(4 * opciones.canciones)
+    cache.renderizar_stream('\n'.join(lineas))
+
+    frio, caliente = [], []
+    for vuelta in range(opciones.repeticiones):
+        texto = editar(lineas, inicios, vuelta)
+
+        inicio = time.perf_counter()
+        esperado = en_frio(texto)
+        frio.append(time.perf_counter() - inicio)
+
+        inicio = time.perf_counter()
+        obtenido = list(cache.renderizar_stream(texto))
+        caliente.append(time.perf_counter() - inicio)
+
+        if obtenido != esperado:
+            sys.exit(f"Vuelta {vuelta}: la salida con fragmentos difiere de la conversión en frío")
+
+    print(f"Salida idéntica en {opciones.repeticiones} ediciones ({opciones.canciones} canciones)")
+    print(f"  en frío:          {statistics.median(frio) * 1000:.1f} ms")
+    print(f"  con fragmentos:   {statistics.median(caliente) * 1000:.1f} ms "
+          f"(x{statistics.median(frio) / statistics.median(caliente):.1f})")
+    print(f"  caché: {cache.estadisticas()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+Verifica y mide la clasificación de líneas de acordes (es_linea_acordes).
+
+    python benchmarks/bench_lineas.py [--canciones 10000]
+
+1. Corpus dorado (corpus/lineas_acordes.tsv): cada decisión debe coincidir.
+2. Cancionero sintético: la regex compilada decide igual que la
+   implementación original en todas las líneas.
+3. Tiempo de clasificación tal como la hace convertir_songpro: antes cada
+   línea se clasificaba y, en las de letra, se volvía a clasificar la
+   anterior; ahora se clasifica cada línea una sola vez.
+"""
+import argparse
+import os
+import sys
+import time
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+from acordes import es_linea_acordes  # noqa: E402
+from generador import generar_cancionero  # noqa: E402
+from referencia import es_linea_acordes_original  # noqa: E402
+
+CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "corpus", "lineas_acordes.tsv")
+
+
+def leer_corpus():
+    with open(CORPUS, encoding="utf-8") as f:
+        for linea in f:
+            linea = linea.rstrip('\n')
+            if linea.startswith('#'):
+                continue
+            decision, texto = linea.split('\t', 1)
+            yield texto, decision == '1'
+
+
+def clasificar_original(lineas):
+    """Patrón de llamadas del parser original (línea + línea anterior en la letra)."""
+    for i, linea in enumerate(lineas):
+        linea = linea.strip()
+        if linea in ('V', 'CH', 'M', 'N') or linea.startswith(('S ', 'O ')):
+            continue
+        if es_linea_acordes_original(linea):
+            continue
+        if i > 0:
+            es_linea_acordes_original(lineas[i - 1])
+
+
+def clasificar_nuevo(lineas):
+    return [es_linea_acordes(l) for l in lineas]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--canciones", type=int, default=10_000)
+    opciones = parser.parse_args()
+
+    corpus = list(leer_corpus())
+    for texto, esperado in corpus:
+        if es_linea_acordes(texto) != esperado:
+            sys.exit(f"Corpus dorado: {texto!r} debería ser {esperado}")
+    print(f"Corpus dorado: {len(corpus)} líneas con decisiones idénticas")
+
+    lineas = [l.rstrip() for l in generar_cancionero(opciones.canciones).split('\n')]
+    for linea in lineas:
+        if es_linea_acordes(linea) != es_linea_acordes_original(linea):
+            sys.exit(f"Diferencia en {linea!r}")
+    print(f"Cancionero sintético: {opciones.canciones} canciones, {len(lineas)} líneas idénticas")
+
+    inicio = time.perf_counter()
+    clasificar_original(lineas)
+    original = time.perf_counter() - inicio
+
+    inicio = time.perf_counter()
+    clasificar_nuevo(lineas)
+    nuevo = time.perf_counter() - inicio
+
+    print(f"  original: {original:.3f} s")
+    print(f"  regex:    {nuevo:.3f} s")
+    print(f"  aceleración: x{original / nuevo:.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""
+Mide la vista previa sin LaTeX (vista_previa.py).
+
+    python benchmarks/bench_preview.py [--canciones 200] [-n 20]
+
+Tiempo de /preview para un cancionero de N canciones, por el mismo camino
+que el endpoint (validación con CacheValidacion, árbol de CacheAST sobre
+CacheFragmentos, render HTML):
+- en frío: un texto que el proceso nunca vio (cachés vacías)
+- editado: el editor reenvía el libro con una canción cambiada; sólo esa
+  se valida y se parsea, el resto sale de las cachés
+- sin cambios: el mismo texto otra vez (árbol tomado de CacheAST)
+
+El objetivo de 50 ms es para lo que hace el editor en cada cambio
+(editado y sin cambios). El frío es la primera carga de un libro: es
+parsear las N canciones y queda informado aparte.
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+import vista_previa  # noqa: E402
+from bench_fragmentos import editar  # noqa: E402
+from cache_fragmentos import CacheFragmentos  # noqa: E402
+from generador import generar_cancionero  # noqa: E402
+from songpro import CacheAST, parsear_cancionero  # noqa: E402
+from validador import CacheValidacion, validar, validar_o_lanzar  # noqa: E402
+
+OBJETIVO_MS = 50
+
+
+def mediana_ms(funcion, repeticiones):
+    tiempos = []
+    for vuelta in range(repeticiones):
+        inicio = time.perf_counter()
+        funcion(vuelta)
+        tiempos.append(time.perf_counter() - inicio)
+    return statistics.median(tiempos) * 1000
+
+
+class Preview:
+    """Las cachés de un proceso y lo que hace /preview con cada texto."""
+
+    def __init__(self, canciones):
+        self.validacion = CacheValidacion(4 * canciones)
+        self.ast = CacheAST(32, CacheFragmentos(4 * canciones).parsear)
+
+    def __call__(self, texto):
+        validar_o_lanzar(texto, self.validacion)
+        return vista_previa.renderizar_html(self.ast.parsear(texto)[0])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--canciones", type=int, default=200)
+    parser.add_argument("-n", "--repeticiones", type=int, default=20)
+    opciones = parser.parse_args()
+
+    texto = generar_cancionero(opciones.canciones)
+    lineas = texto.split('\n')
+    inicios = [i for i, linea in enumerate(lineas) if linea.startswith('O ')]
+    cancionero = parsear_cancionero(texto)
+    n = opciones.repeticiones
+
+    validacion = mediana_ms(lambda _: validar(texto), n)
+    parseo = mediana_ms(lambda _: parsear_cancionero(texto), n)
+    html = mediana_ms(lambda _: vista_previa.renderizar_html(cancionero), n)
+    texto_plano = mediana_ms(lambda _: vista_previa.renderizar_texto(cancionero), n)
+
+    preview = Preview(opciones.canciones)
+    preview(texto)
+    ediciones = [editar(lineas, inicios, vuelta) for vuelta in range(n)]
+    frio = mediana_ms(lambda _: Preview(opciones.canciones)(texto), n)
+    editado = mediana_ms(lambda vuelta: preview(ediciones[vuelta]), n)
+    sin_cambios = mediana_ms(lambda vuelta: preview(ediciones[-1]), n)
+
+    def veredicto(ms):
+        return "ok" if ms < OBJETIVO_MS else f"sobre el objetivo de {OBJETIVO_MS} ms"
+
+    print(f"{opciones.canciones} canciones (mediana de {n})")
+    print(f"  validación:         {validacion:.1f} ms")
+    print(f"  parseo:             {parseo:.1f} ms")
+    print(f"  render HTML:        {html:.1f} ms")
+    print(f"  render texto:       {texto_plano:.1f} ms")
+    print(f"  preview en frío:    {frio:.1f} ms (primera carga)")
+    print(f"  preview editado:    {editado:.1f} ms ({veredicto(editado)})")
+    print(f"  preview sin cambio: {sin_cambios:.1f} ms ({veredicto(sin_cambios)})")
+
+
+if __name__ == "__main__":
+    main()
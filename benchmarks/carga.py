@@ -0,0 +1,405 @@
+"""
+Prueba de carga del servicio web (convert:app bajo gunicorn), sin red.
+
+    python benchmarks/carga.py [--workers 2] [--threads 4] [--clientes 8] [--duracion 60]
+    python benchmarks/carga.py --url http://127.0.0.1:8000    # servidor ya levantado
+
+Levanta gunicorn como el CMD del Dockerfile (workers y threads a elección,
+cachés en un directorio temporal) y N clientes envían POST a /get/pdf/ y a
+/ con cancioneros sintéticos de varios tamaños (generador.py). Cada request
+cambia el título de la primera canción, así la caché de PDF no lo resuelve
+y se compila de verdad; con --variantes se repiten textos para medir
+también los aciertos de caché.
+
+Informa throughput, latencias p50/p95/p99 por ruta y por tamaño, tasas de
+error, rechazo (429) y timeout, y el pico de RSS de los pdflatex hijos del
+servidor, leído de /proc (sólo Linux). --json guarda el resultado para
+comparar configuraciones.
+"""
+import argparse
+import http.client
+import itertools
+import json
+import math
+import os
+import random
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from urllib.parse import urlencode, urlsplit
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+from generador import generar_cancionero  # noqa: E402
+
+RUTAS = {"get_pdf": "/get/pdf/", "form": "/"}
+ESPERA_ARRANQUE = 60
+
+
+def mezcla(texto):
+    """'1:5,25:3,100:1' -> [(1, 5.0), (25, 3.0), (100, 1.0)]"""
+    resultado = []
+    for parte in texto.split(','):
+        valor, _, peso = parte.partition(':')
+        resultado.append((valor.strip(), float(peso or 1)))
+    return resultado
+
+
+def percentil(valores, p):
+    """Percentil por rango más cercano de una lista ya ordenada."""
+    if not valores:
+        return float("nan")
+    return valores[max(0, math.ceil(p / 100 * len(valores)) - 1)]
+
+
+# =========================
+# SERVIDOR
+# =========================
+def puerto_libre():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def levantar_gunicorn(puerto, workers, threads, timeout, directorio):
+    env = dict(os.environ)
+    env.update({
+        "WEB_CONCURRENCY": str(workers),
+        "CACHE_PDF_DIR": os.path.join(directorio, "pdf"),
+        "TRABAJOS_DIR": os.path.join(directorio, "trabajos"),
+        "METRICAS_DIR": os.path.join(directorio, "metricas"),
+    })
+    return subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "--bind", f"127.0.0.1:{puerto}",
+         "--workers", str(workers), "--threads", str(threads), "--timeout", str(timeout),
+         "--log-level", "warning", "convert:app"],
+        cwd=RAIZ, env=env,
+    )
+
+
+def esperar_servidor(host, puerto, proceso=None):
+    limite = time.monotonic() + ESPERA_ARRANQUE
+    while time.monotonic() < limite:
+        if proceso is not None and proceso.poll() is not None:
+            sys.exit(f"gunicorn terminó al arrancar (código {proceso.returncode})")
+        try:
+            conexion = http.client.HTTPConnection(host, puerto, timeout=5)
+            conexion.request("GET", "/")
+            if conexion.getresponse().status == 200:
+                return
+        except OSError:
+            pass
+        time.sleep(0.2)
+    sys.exit(f"El servidor no respondió en {ESPERA_ARRANQUE} s")
+
+
+# =========================
+# RSS DE LOS PDFLATEX
+# =========================
+def _procesos():
+    """{pid: (nombre, ppid)} de todos los procesos visibles en /proc."""
+    procesos = {}
+    for entrada in os.listdir("/proc"):
+        if not entrada.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entrada}/stat", encoding="utf-8", errors="replace") as f:
+                stat = f.read()
+        except OSError:
+            continue
+        # El nombre va entre paréntesis y puede tener espacios
+        nombre = stat[stat.index('(') + 1:stat.rindex(')')]
+        ppid = int(stat[stat.rindex(')') + 2:].split()[1])
+        procesos[int(entrada)] = (nombre, ppid)
+    return procesos
+
+
+def _memoria_kb(pid):
+    """(VmRSS, VmHWM) en kB, o None si el proceso ya terminó."""
+    valores = {}
+    try:
+        with open(f"/proc/{pid}/status", encoding="utf-8") as f:
+            for linea in f:
+                if linea.startswith(("VmRSS:", "VmHWM:")):
+                    clave, valor = linea.split(':')
+                    valores[clave] = int(valor.split()[0])
+    except OSError:
+        return None
+    return valores.get("VmRSS", 0), valores.get("VmHWM", 0)
+
+
+class MonitorPdflatex(threading.Thread):
+    """
+    Muestrea los pdflatex descendientes de `raiz` (o todos, si raiz es None):
+    pico de RSS de cada proceso y pico de la suma de los que corren a la vez.
+    """
+
+    def __init__(self, raiz=None, intervalo=0.05, nombre="pdflatex"):
+        super().__init__(daemon=True)
+        self.raiz = raiz
+        self.intervalo = intervalo
+        self.nombre = nombre
+        self.picos = {}          # pid -> VmHWM máximo visto (kB)
+        self.pico_simultaneo = 0
+        self.max_procesos = 0
+        self._detener = threading.Event()
+
+    def _descendiente(self, pid, procesos):
+        while pid in procesos:
+            pid = procesos[pid][1]
+            if pid == self.raiz:
+                return True
+        return False
+
+    def muestrear(self):
+        procesos = _procesos()
+        total = 0
+        activos = 0
+        for pid, (nombre, _) in procesos.items():
+            if nombre != self.nombre:
+                continue
+            if self.raiz is not None and not self._descendiente(pid, procesos):
+                continue
+            memoria = _memoria_kb(pid)
+            if memoria is None:
+                continue
+            rss, hwm = memoria
+            self.picos[pid] = max(self.picos.get(pid, 0), hwm, rss)
+            total += rss
+            activos += 1
+        self.pico_simultaneo = max(self.pico_simultaneo, total)
+        self.max_procesos = max(self.max_procesos, activos)
+
+    def run(self):
+        while not self._detener.wait(self.intervalo):
+            self.muestrear()
+
+    def detener(self):
+        self._detener.set()
+        self.join()
+
+    def resumen(self):
+        return {
+            "procesos": len(self.picos),
+            "simultaneos_max": self.max_procesos,
+            "pico_rss_proceso_mb": max(self.picos.values(), default=0) / 1024,
+            "pico_rss_simultaneo_mb": self.pico_simultaneo / 1024,
+        }
+
+
+# =========================
+# CLIENTES
+# =========================
+def enviar(host, puerto, ruta, texto, timeout):
+    """POST de un cancionero; devuelve (resultado, estado HTTP)."""
+    if ruta == "/":
+        cuerpo = urlencode({"texto": texto}).encode("utf-8")
+        tipo = "application/x-www-form-urlencoded"
+    else:
+        cuerpo = texto.encode("utf-8")
+        tipo = "text/plain; charset=utf-8"
+    conexion = http.client.HTTPConnection(host, puerto, timeout=timeout)
+    try:
+        conexion.request("POST", ruta, body=cuerpo, headers={"Content-Type": tipo})
+        respuesta = conexion.getresponse()
+        respuesta.read()
+    except (socket.timeout, TimeoutError):
+        return "timeout", None
+    except OSError:
+        return "error", None
+    finally:
+        conexion.close()
+
+    if respuesta.status == 429:
+        return "rechazo", 429
+    # '/' responde 200 con el formulario cuando falla: éxito es recibir el PDF
+    if respuesta.status == 200 and respuesta.getheader("Content-Type", "").startswith("application/pdf"):
+        return "ok", 200
+    return "error", respuesta.status
+
+
+class Carga:
+    """Los clientes, los textos y los resultados de una corrida."""
+
+    def __init__(self, host, puerto, opciones):
+        self.host = host
+        self.puerto = puerto
+        self.opciones = opciones
+        self.tamanios = [(int(t), peso) for t, peso in mezcla(opciones.tamanios)]
+        self.rutas = [(RUTAS[r], peso) for r, peso in mezcla(opciones.rutas)]
+        self.textos = {t: generar_cancionero(t, semilla=t) for t, _ in self.tamanios}
+        self._numero = itertools.count()
+        self._lock = threading.Lock()
+        self.resultados = []     # (ruta, tamaño, resultado, estado, segundos)
+
+    def texto(self, tamanio):
+        n = next(self._numero)
+        if self.opciones.variantes:
+            n %= self.opciones.variantes
+        # Otro título en la primera canción: otro PDF, el resto sale de la caché de fragmentos
+        return self.textos[tamanio].replace("O Canción 1 ", f"O Canción 1 c{n} ", 1)
+
+    def cliente(self, indice, limite, restantes):
+        rnd = random.Random(indice)
+        tamanios, pesos_t = zip(*self.tamanios)
+        rutas, pesos_r = zip(*self.rutas)
+        while time.monotonic() < limite:
+            if restantes is not None:
+                with self._lock:
+                    if restantes[0] <= 0:
+                        return
+                    restantes[0] -= 1
+            tamanio = rnd.choices(tamanios, pesos_t)[0]
+            ruta = rnd.choices(rutas, pesos_r)[0]
+            texto = self.texto(tamanio)
+            inicio = time.perf_counter()
+            resultado, estado = enviar(self.host, self.puerto, ruta, texto, self.opciones.timeout)
+            segundos = time.perf_counter() - inicio
+            with self._lock:
+                self.resultados.append((ruta, tamanio, resultado, estado, segundos))
+
+    def correr(self):
+        limite = time.monotonic() + self.opciones.duracion
+        restantes = [self.opciones.requests] if self.opciones.requests else None
+        hilos = [
+            threading.Thread(target=self.cliente, args=(i, limite, restantes), daemon=True)
+            for i in range(self.opciones.clientes)
+        ]
+        inicio = time.perf_counter()
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+        return time.perf_counter() - inicio
+
+
+# =========================
+# INFORME
+# =========================
+def _latencias(resultados):
+    tiempos = sorted(r[4] for r in resultados if r[2] == "ok")
+    return {
+        "n": len(tiempos),
+        "p50": percentil(tiempos, 50),
+        "p95": percentil(tiempos, 95),
+        "p99": percentil(tiempos, 99),
+        "max": tiempos[-1] if tiempos else float("nan"),
+    }
+
+
+def resumen(resultados, duracion):
+    total = len(resultados)
+    conteo = {clave: sum(1 for r in resultados if r[2] == clave)
+              for clave in ("ok", "error", "rechazo", "timeout")}
+    estados = {}
+    for r in resultados:
+        if r[2] == "error":
+            estados[str(r[3])] = estados.get(str(r[3]), 0) + 1
+    return {
+        "duracion_s": duracion,
+        "requests": total,
+        "throughput_ok": conteo["ok"] / duracion if duracion else 0.0,
+        "conteo": conteo,
+        "tasas": {clave: valor / total if total else 0.0 for clave, valor in conteo.items()},
+        "errores_por_estado": estados,
+        "latencia_total": _latencias(resultados),
+        "latencia_por_ruta": {
+            ruta: _latencias([r for r in resultados if r[0] == ruta])
+            for ruta in sorted({r[0] for r in resultados})
+        },
+        "latencia_por_tamanio": {
+            str(tamanio): _latencias([r for r in resultados if r[1] == tamanio])
+            for tamanio in sorted({r[1] for r in resultados})
+        },
+    }
+
+
+def imprimir(informe):
+    c, t = informe["conteo"], informe["tasas"]
+    print(f"{informe['requests']} requests en {informe['duracion_s']:.1f} s: "
+          f"{informe['throughput_ok']:.2f} PDF/s")
+    print(f"  ok {c['ok']} ({t['ok']:.1%})   errores {c['error']} ({t['error']:.1%})   "
+          f"rechazos 429 {c['rechazo']} ({t['rechazo']:.1%})   timeouts {c['timeout']} ({t['timeout']:.1%})")
+    if informe["errores_por_estado"]:
+        print(f"  errores por estado HTTP: {informe['errores_por_estado']}")
+
+    print(f"\n  {'latencia ok (s)':<20}{'n':>6}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}")
+    filas = [("total", informe["latencia_total"])]
+    filas += [(ruta, lat) for ruta, lat in informe["latencia_por_ruta"].items()]
+    filas += [(f"{tamanio} canciones", lat) for tamanio, lat in informe["latencia_por_tamanio"].items()]
+    for nombre, lat in filas:
+        print(f"  {nombre:<20}{lat['n']:>6}{lat['p50']:>9.3f}{lat['p95']:>9.3f}"
+              f"{lat['p99']:>9.3f}{lat['max']:>9.3f}")
+
+    pdflatex = informe.get("pdflatex")
+    if pdflatex:
+        print(f"\n  pdflatex: {pdflatex['procesos']} procesos, hasta {pdflatex['simultaneos_max']} a la vez; "
+              f"pico RSS {pdflatex['pico_rss_proceso_mb']:.1f} MB por proceso, "
+              f"{pdflatex['pico_rss_simultaneo_mb']:.1f} MB sumados")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--url", help="servidor ya levantado (sin esto se levanta gunicorn)")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--timeout-gunicorn", type=int, default=180)
+    parser.add_argument("--clientes", type=int, default=8, help="requests simultáneos")
+    parser.add_argument("--duracion", type=float, default=60, help="segundos de carga")
+    parser.add_argument("--requests", type=int, default=0, help="cortar tras N requests (0: sin tope)")
+    parser.add_argument("--timeout", type=float, default=120, help="timeout de cada request (s)")
+    parser.add_argument("--tamanios", default="1:4,25:3,100:2,300:1",
+                        help="canciones:peso separados por coma")
+    parser.add_argument("--rutas", default="get_pdf:3,form:1",
+                        help=f"ruta:peso, rutas: {', '.join(RUTAS)}")
+    parser.add_argument("--variantes", type=int, default=0,
+                        help="textos distintos por tamaño (0: todos distintos, sin aciertos de caché)")
+    parser.add_argument("--json", help="guardar el informe en este archivo")
+    opciones = parser.parse_args()
+
+    servidor = None
+    directorio = tempfile.TemporaryDirectory(prefix="carga_")
+    if opciones.url:
+        partes = urlsplit(opciones.url)
+        host, puerto = partes.hostname, partes.port or 80
+    else:
+        host, puerto = "127.0.0.1", puerto_libre()
+        servidor = levantar_gunicorn(puerto, opciones.workers, opciones.threads,
+                                     opciones.timeout_gunicorn, directorio.name)
+    try:
+        esperar_servidor(host, puerto, servidor)
+        monitor = MonitorPdflatex(servidor.pid if servidor else None)
+        monitor.start()
+        carga = Carga(host, puerto, opciones)
+        print(f"{opciones.clientes} clientes contra {host}:{puerto}"
+              + (f" ({opciones.workers} workers x {opciones.threads} threads)" if servidor else ""))
+        duracion = carga.correr()
+        monitor.detener()
+    finally:
+        if servidor is not None:
+            servidor.send_signal(signal.SIGTERM)
+            try:
+                servidor.wait(30)
+            except subprocess.TimeoutExpired:
+                servidor.kill()
+        directorio.cleanup()
+
+    informe = resumen(carga.resultados, duracion)
+    informe["pdflatex"] = monitor.resumen()
+    informe["configuracion"] = {
+        clave: getattr(opciones, clave)
+        for clave in ("url", "workers", "threads", "clientes", "duracion", "requests", "tamanios", "rutas", "variantes")
+    }
+    imprimir(informe)
+    if opciones.json:
+        with open(opciones.json, "w", encoding="utf-8") as f:
+            json.dump(informe, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    main()
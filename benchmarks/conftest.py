@@ -0,0 +1,31 @@
+"""
+Configuración de la suite de benchmarks (suite_etapas.py).
+
+- Las mediciones guardadas van a benchmarks/linea_base/, no a ./.benchmarks
+  del directorio desde donde se lance pytest.
+- Con --benchmark-compare, una etapa cuya mediana empeore más que
+  UMBRAL_REGRESION (por defecto 25%) hace fallar la corrida, salvo que se
+  pase otro --benchmark-compare-fail. En una máquina ruidosa se puede
+  subir: UMBRAL_REGRESION=median:40%.
+"""
+import os
+
+import pytest
+
+DIRECTORIO = os.path.dirname(os.path.abspath(__file__))
+LINEA_BASE = os.path.join(DIRECTORIO, "linea_base")
+UMBRAL_REGRESION = os.environ.get("UMBRAL_REGRESION", "median:25%")
+ALMACEN_POR_DEFECTO = "file://./.benchmarks"
+
+
+@pytest.hookimpl(tryfirst=True)
+def pytest_configure(config):
+    # Antes que pytest-benchmark, que lee las opciones al configurarse
+    if not hasattr(config.option, "benchmark_storage"):
+        return
+    from pytest_benchmark.utils import parse_compare_fail
+
+    if config.option.benchmark_storage == ALMACEN_POR_DEFECTO:
+        config.option.benchmark_storage = "file://" + LINEA_BASE
+    if config.option.benchmark_compare and not config.option.benchmark_compare_fail:
+        config.option.benchmark_compare_fail = [parse_compare_fail(UMBRAL_REGRESION)]
@@ -0,0 +1,120 @@
+"""
+Generador determinista de cancioneros SongPro sintéticos para benchmarks.
+
+    python benchmarks/generador.py --canciones 200 > cancionero.txt
+
+Con la misma semilla el texto es siempre el mismo. Cubre lo que el parser
+acepta: secciones (S), canciones (O) con y sin transposición (=+N / =-N),
+bloques V, CH y M, líneas de acordes en notación latina y americana, acordes
+con bajo (Do/Mi, G/B), palabras del índice (#palabra, #pal_abra=Índice),
+marcas de repetición B / B3 en la letra y bloques N con caracteres que
+LaTeX tiene que escapar.
+"""
+import argparse
+import random
+
+NOTAS_LATINAS = ['Do', 'Re', 'Mi', 'Fa', 'Sol', 'La', 'Si', 'Fa#', 'Sib']
+NOTAS_AMERICANAS = ['C', 'D', 'E', 'F', 'G', 'A', 'B', 'F#', 'Bb']
+SUFIJOS = ['', '', '', 'm', 'm', '7', 'm7', 'maj7', 'sus4']
+PALABRAS = [
+    'señor', 'gloria', 'alegría', 'camino', 'vida', 'canto', 'luz', 'amor',
+    'paz', 'pueblo', 'corazón', 'esperanza', 'cielo', 'tierra', 'padre',
+    'hermano', 'pan', 'vino', 'mesa', 'fiesta', 'mañana', 'siempre', 'nuevo',
+]
+REPETICIONES = ['B', 'B', 'B3', 'B4']
+LINEAS_RAW = [
+    'Antífona: 100% de la asamblea & coro',
+    'Se canta #1 de {la} misa_breve',
+    'Lectura en voz alta',
+    'Pausa',
+]
+
+
+def _acorde(rnd, latina):
+    notas = NOTAS_LATINAS if latina else NOTAS_AMERICANAS
+    acorde = rnd.choice(notas) + rnd.choice(SUFIJOS)
+    if rnd.random() < 0.1:
+        acorde += '/' + rnd.choice(notas)
+    return acorde
+
+
+def _palabra_indice(rnd, palabra):
+    """#palabra o #pal_abra=Índice (sin '_': no consume acordes)."""
+    if rnd.random() < 0.5:
+        return '#' + palabra
+    return f"#{palabra}={palabra.capitalize()}"
+
+
+def _verso(rnd, latina):
+    """Línea de acordes + línea de letra con un '_' por acorde."""
+    palabras = [rnd.choice(PALABRAS) for _ in range(rnd.randint(4, 8))]
+    n_acordes = rnd.randint(1, min(4, len(palabras)))
+    posiciones = sorted(rnd.sample(range(len(palabras)), n_acordes))
+    acordes = [_acorde(rnd, latina) for _ in posiciones]
+    for pos in posiciones:
+        palabra = palabras[pos]
+        corte = rnd.randint(0, len(palabra) - 1)
+        palabras[pos] = palabra[:corte] + '_' + palabra[corte:]
+    libres = [i for i in range(len(palabras)) if i not in posiciones]
+    if libres and rnd.random() < 0.15:
+        i = rnd.choice(libres)
+        palabras[i] = _palabra_indice(rnd, palabras[i])
+    if rnd.random() < 0.05:
+        # Repetición: abre con B y cierra con B<n> en la misma línea
+        palabras.insert(0, 'B')
+        palabras.append(rnd.choice(REPETICIONES))
+    return [' '.join(acordes), ' '.join(palabras)]
+
+
+def _bloque(rnd, marca, latina):
+    lineas = [marca]
+    for _ in range(rnd.randint(2, 4)):
+        lineas.extend(_verso(rnd, latina))
+    return lineas
+
+
+def _raw(rnd):
+    """Bloque N; se cierra con la marca del bloque que sigue."""
+    return ['N'] + rnd.sample(LINEAS_RAW, rnd.randint(1, len(LINEAS_RAW)))
+
+
+def _titulo(rnd, n):
+    titulo = f"O Canción {n + 1} {rnd.choice(PALABRAS)}"
+    if rnd.random() < 0.2:
+        titulo += f" ={rnd.choice(['+1', '+2', '+3', '-1', '-2', '-5'])}"
+    return titulo
+
+
+def generar_cancionero(canciones=100, canciones_por_seccion=25, semilla=0):
+    """Texto SongPro con `canciones` canciones repartidas en secciones."""
+    rnd = random.Random(semilla)
+    lineas = []
+    for n in range(canciones):
+        if n % canciones_por_seccion == 0:
+            lineas.append(f"S Sección {n // canciones_por_seccion + 1}")
+        latina = rnd.random() < 0.7
+        lineas.append(_titulo(rnd, n))
+        if rnd.random() < 0.1:
+            lineas.extend(_bloque(rnd, 'M', latina))
+        for _ in range(rnd.randint(2, 4)):
+            # Un N dentro de la canción, nunca al final: 'O ...' no cierra el modo RAW
+            if rnd.random() < 0.1:
+                lineas.extend(_raw(rnd))
+            lineas.extend(_bloque(rnd, 'V', latina))
+            if rnd.random() < 0.6:
+                lineas.extend(_bloque(rnd, 'CH', latina))
+        lineas.append('')
+    return '\n'.join(lineas)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--canciones", type=int, default=100)
+    parser.add_argument("--por-seccion", type=int, default=25)
+    parser.add_argument("--semilla", type=int, default=0)
+    opciones = parser.parse_args()
+    print(generar_cancionero(opciones.canciones, opciones.por_seccion, opciones.semilla))
+
+
+if __name__ == "__main__":
+    main()
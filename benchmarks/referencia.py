@@ -0,0 +1,503 @@
+"""
+Implementaciones originales (antes de la optimización), copiadas tal cual.
+Sirven de oráculo: los benchmarks verifican que el código nuevo produce
+exactamente la misma salida antes de medir tiempos.
+"""
+import re
+
+from acordes import notas, equivalencias_latinas
+
+
+def transportar_acorde_original(acorde, semitonos):
+    acorde = acorde.strip()
+
+    # Convertir notación de bemoles en inglés a notación estándar
+    acorde = acorde.replace('Bb', 'A#').replace('bb', 'a#')
+    acorde = acorde.replace('Gb', 'F#').replace('gb', 'f#')
+
+    # Manejar acordes con bajo (por ejemplo D/F#)
+    if '/' in acorde:
+        parte_superior, bajo = acorde.split('/')
+        parte_superior_transpuesta = transportar_acorde_original(parte_superior, semitonos)
+        bajo_transpuesto = transportar_acorde_original(bajo, semitonos)
+        return f"{parte_superior_transpuesta}/{bajo_transpuesto}"
+
+    # Mapa de conversión de bemoles a sostenidos para procesamiento interno
+    mapa_bemoles_a_sostenidos = {
+        'Reb': 'Do#', 'Rebm': 'Do#m',
+        'Mib': 'Re#', 'Mibm': 'Re#m',
+        'Lab': 'Sol#', 'Labm': 'Sol#m',
+        'Sib': 'La#', 'Sibm': 'La#m'
+        # Nota: Solb no se convierte a Fa# para mantener consistencia con el mapa de bemoles
+    }
+
+    # Convertir bemoles a sostenidos para procesamiento interno
+    for bemol, sostenido in mapa_bemoles_a_sostenidos.items():
+        if acorde.lower().startswith(bemol.lower()):
+            acorde = sostenido + acorde[len(bemol):]
+            break
+
+    # Detectar si es notación latina y convertir a americana
+    for nota_lat, nota_ang in equivalencias_latinas.items():
+        if acorde.lower().startswith(nota_lat.lower()):
+            acorde = nota_ang + acorde[len(nota_lat):]
+            break            
+
+    match = re.match(r'^([A-Ga-g][#b]?)(.*)$', acorde)
+    if not match:
+        return acorde
+    nota, sufijo = match.groups()
+    nota_mayus = nota.upper()
+
+    try:
+        idx = notas.index(nota_mayus)
+    except ValueError:
+        return acorde
+
+    nueva_idx = (idx + semitonos) % 12
+    nueva_nota = notas[nueva_idx]
+    if nota[0].islower():
+        nueva_nota = nueva_nota.lower()
+
+    acorde_transpuesto = nueva_nota + sufijo
+
+    # Volver a convertir a notación latina
+    return convertir_a_latex_original(acorde_transpuesto)
+
+def convertir_a_latex_original(acorde):
+    mapa = {
+        'C': 'Do', 'C#': 'Do#', 'D': 'Re', 'D#': 'Re#', 'E': 'Mi', 'F': 'Fa',
+        'F#': 'Fa#', 'G': 'Sol', 'G#': 'Sol#', 'A': 'La', 'A#': 'La#', 'B': 'Si',
+        'Cm': 'Dom', 'C#m': 'Do#m', 'Dm': 'Rem', 'D#m': 'Re#m', 'Em': 'Mim',
+        'Fm': 'Fam', 'F#m': 'Fa#m', 'Gm': 'Solm', 'G#m': 'Sol#m',
+        'Am': 'Lam', 'A#m': 'La#m', 'Bm': 'Sim'
+    }
+
+    # Mapa de conversión de sostenidos a bemoles (SOLO para La#)
+    mapa_bemoles_excepcion = {
+        'La#': 'Sib', 'La#m': 'Sibm'
+    }
+
+    acorde = acorde.strip()
+    # Convertir notación de bemoles en inglés a notación estándar
+    acorde = acorde.replace('Bb', 'A#').replace('bb', 'a#')
+    acorde = acorde.replace('Gb', 'F#').replace('gb', 'f#')
+    acorde = acorde.replace('F#', 'FA#').replace('f#', 'fa#')
+    acorde = acorde.replace('C#', 'DO#').replace('c#', 'do#')
+
+    if any(acorde.lower().startswith(n.lower()) for n in ['do', 're', 'mi', 'fa', 'sol', 'la', 'si']):
+        return acorde
+
+    # Manejar acordes con bajo (por ejemplo D/F#)
+    if '/' in acorde:
+        parte_superior, bajo = acorde.split('/')
+        parte_superior_convertida = convertir_a_latex_original(parte_superior)
+        bajo_convertido = convertir_a_latex_original(bajo)
+        return f"{parte_superior_convertida}/{bajo_convertido}"
+
+    match = re.match(r'^([A-Ga-g][#b]?m?)(.*)$', acorde)
+    if match:
+        raiz, extension = match.groups()
+        raiz_mayus = raiz[0].upper() + raiz[1:]
+        raiz_convertida = mapa.get(raiz_mayus, raiz)
+
+        # Convertir SÓLO La# a Sib
+        raiz_convertida = mapa_bemoles_excepcion.get(raiz_convertida, raiz_convertida)
+
+        return raiz_convertida + extension
+
+    return acorde
+
+
+def es_linea_acordes_original(linea):
+    # Si la línea tiene guiones bajos, NO es acorde
+    if '_' in linea:
+        return False
+
+    tokens = linea.split()
+    if not tokens:
+        return False
+
+    # Lista completa de notas latinas (naturales, sostenidas, bemoles)
+    notas_latinas = [
+        'do', 're', 'mi', 'fa', 'sol', 'la', 'si',
+        'do#', 're#', 'fa#', 'sol#', 'la#',
+        'reb', 'mib', 'lab', 'sib'
+    ]
+    # También notación americana para seguridad
+    notas_americanas = ['c', 'd', 'e', 'f', 'g', 'a', 'b']
+
+    for t in tokens:
+        t_lower = t.lower()
+
+        # Verificar si es una nota latina con posibles sufijos (m, maj, 7, etc.)
+        es_nota = False
+        for nota in notas_latinas:
+            if t_lower.startswith(nota):
+                # Aceptar si después de la nota viene un sufijo válido o fin de token
+                resto = t_lower[len(nota):]
+                if resto == '' or resto.startswith('m') or resto.startswith('maj') or resto.startswith('min') or resto.startswith('dim') or resto.startswith('aug') or resto.startswith('sus') or resto.startswith('add') or resto.startswith('7') or resto.startswith('9') or resto.startswith('11') or resto.startswith('13') or resto.startswith('/'):
+                    es_nota = True
+                    break
+        if es_nota:
+            continue
+
+        # Verificar si es una nota americana con sufijos
+        for nota in notas_americanas:
+            if t_lower.startswith(nota):
+                resto = t_lower[len(nota):]
+                if resto == '' or resto.startswith('#') or resto.startswith('b') or resto.startswith('m') or resto.startswith('maj') or resto.startswith('min') or resto.startswith('dim') or resto.startswith('aug') or resto.startswith('sus') or resto.startswith('add') or resto.startswith('7') or resto.startswith('9') or resto.startswith('11') or resto.startswith('13') or resto.startswith('/'):
+                    es_nota = True
+                    break
+        if es_nota:
+            continue
+
+        # Si ningún token es nota, no es línea de acordes
+        return False
+
+    return True
+
+
+# =========================
+# PARSER SONGPRO ORIGINAL (sin los print/logs por línea)
+# =========================
+def procesar_linea_con_acordes_y_indices_original(
+    linea,
+    acordes,
+    titulo_cancion=None,
+    simbolo="#",
+    semitonos=0
+):
+    """
+    Procesa una línea completa SongPro con:
+    - acordes por '_'
+    - palabras indexadas con '#'
+    """
+
+    resultado = ""
+    idx_acorde = 0
+
+    palabras = linea.strip().split()
+
+    for palabra in palabras:
+        palabra_tex, idx_acorde = procesar_palabra_indexada_original(palabra, acordes, idx_acorde, titulo_cancion, semitonos=semitonos)
+        resultado += palabra_tex + " "
+
+    return resultado.rstrip()
+def procesar_palabra_indexada_original(palabra, acordes, idx_acorde, titulo_cancion, indice_nombre="tema", semitonos=0):
+    """
+    Procesa UNA palabra SongPro:
+    - _ inserta acordes
+    - # marca índice
+    - #u_ni_da=Unidad → visible con sílabas, índice limpio
+    """
+
+    es_indexada = palabra.startswith("#")
+    palabra_trabajo = palabra[1:] if es_indexada else palabra
+
+    # --- índice explícito ---
+    if es_indexada and "=" in palabra_trabajo:
+        base_raw, indice_real = palabra_trabajo.split("=", 1)
+    else:
+        base_raw = palabra_trabajo
+        indice_real = base_raw.replace("_", "")
+
+    partes = base_raw.split("_")
+    resultado = ""
+
+    for i, parte in enumerate(partes):
+        if i > 0:
+            if idx_acorde >= len(acordes):
+                raise RuntimeError(
+                    f"Error: hay más '_' que acordes en la palabra '{palabra}'"
+                )
+            acorde = transportar_acorde_original(acordes[idx_acorde], semitonos).replace("#", r"\#")
+            resultado += f"\\[{acorde}]"
+            idx_acorde += 1
+
+        resultado += parte
+
+    # --- envolver índice SOLO UNA VEZ ---
+    if es_indexada:
+        resultado = (
+            r"\textbf{"
+            + resultado
+            + rf"\protect\index[{indice_nombre}]{{{indice_real}!{titulo_cancion}}}"
+            + "}"
+        )
+
+    return resultado, idx_acorde
+
+
+def escape_latex_raw_original(linea):
+    """
+    Escapa caracteres especiales de LaTeX
+    SOLO para la sección N (RAW)
+    """
+    replacements = {
+        '#': r'\#',
+        '%': r'\%',
+        '&': r'\&',
+        '_': r'\_',
+        '{': r'\{',
+        '}': r'\}',
+    }
+    for k, v in replacements.items():
+        linea = linea.replace(k, v)
+    return linea
+
+def extraer_transposicion_original(titulo_raw):
+    """
+    Extrae transposición del tipo '=+2' o '=-2' al final del título.
+    Retorna: (titulo_limpio, semitonos)
+    """
+    match = re.search(r'\s*=\s*([+-]?\d+)\s*$', titulo_raw)
+    if match:
+        semitonos = int(match.group(1))
+        titulo_limpio = re.sub(r'\s*=\s*[+-]?\d+\s*$', '', titulo_raw).strip()
+        return titulo_limpio, semitonos
+    return titulo_raw.strip(), 0
+
+def convertir_songpro_original(texto):
+    transposicion_actual = 0
+    repeat_abierto = False
+    lineas = [l.rstrip() for l in texto.split('\n')]
+
+    resultado = []
+
+    bloque_actual = []      # V / C / M
+    raw_buffer = []         # SOLO RAW (N)
+
+    tipo_bloque = None
+    raw_mode = False
+
+    seccion_abierta = False
+    cancion_abierta = False
+    titulo_cancion_actual = ""
+
+    # =========================
+    # CIERRES
+    # =========================
+    def cerrar_raw():
+        nonlocal raw_buffer
+        if raw_buffer:
+            resultado.append(r'\\'.join(raw_buffer) + r'\\')
+            resultado.append('')
+            raw_buffer = []
+    def procesar_repeticiones_en_letra(linea):
+        nonlocal repeat_abierto
+
+        tokens = linea.split()
+
+        # B debe convivir con letra
+        if not any(t.startswith('B') for t in tokens) or len(tokens) == 1:
+            return linea
+
+        salida = []
+        for t in tokens:
+            # Caso B, B3, B4, etc.
+            if (t.startswith('B') and t[1:].isdigit()) or t == 'B':
+                if not repeat_abierto:
+                    salida.append(r'\lrep')
+                    repeat_abierto = True
+                else:
+                    rep_num = t[1:] if t != 'B' else '2'
+                    salida.append(rf'\rrep \rep{{{rep_num}}}')
+                    repeat_abierto = False
+            else:
+                salida.append(t)
+
+        return ' '.join(salida)
+    def cerrar_bloque():
+        nonlocal bloque_actual, tipo_bloque, repeat_abierto
+
+        if not bloque_actual or not tipo_bloque:
+            bloque_actual = []
+            tipo_bloque = None
+            return
+
+        env = {
+            'verse':  ('\\beginverse',  '\\endverse'),
+            'chorus': ('\\beginchorus', '\\endchorus'),
+            'melody': ('\\beginverse',  '\\endverse'),
+        }.get(tipo_bloque)
+
+        if not env:
+            bloque_actual = []
+            tipo_bloque = None
+            return
+
+        if repeat_abierto:
+            bloque_actual.append(r'\rrep \rep{2}')
+            repeat_abierto = False
+
+        begin, end = env
+
+        diagrama_id = {
+            'verse':  'A',
+            'chorus': 'B',
+            'melody': 'C',   # o lo que quieras
+    }.get(tipo_bloque, 'A')
+
+        # Todo el verso con acordes ya formateados
+        contenido_songs = ' \\\\'.join(bloque_actual)
+
+        resultado.extend([
+            begin,
+            r"\medskip",
+            fr"\diagram{{{diagrama_id}}}{{{contenido_songs}}}",
+            end,
+            r"\medskip",
+        ])
+
+        bloque_actual = []
+        tipo_bloque = None
+
+
+
+
+
+
+    def cerrar_cancion():
+            nonlocal cancion_abierta
+            if cancion_abierta:
+                resultado.append(r'\endsong')
+                resultado.append('')
+                cancion_abierta = False
+
+    # =========================
+    # PARSER
+    # =========================
+    i = 0
+    while i < len(lineas):
+        		
+        linea = lineas[i].strip()
+
+        # =========================
+        # MODO RAW
+        # =========================
+        if raw_mode:
+            if linea == 'N':
+                cerrar_raw()
+                raw_mode = True   # sigue en RAW
+                i += 1
+                continue
+
+            if linea in ('V', 'CH', 'M', 'O', 'S'):
+                cerrar_raw()
+                raw_mode = False
+                continue   # reprocesar esta línea
+
+            raw_buffer.append(escape_latex_raw_original(linea))
+            i += 1
+            continue
+
+        # =========================
+        # N → abrir RAW
+        # =========================
+        if linea == 'N':
+            cerrar_bloque()
+            raw_mode = True
+            i += 1
+            continue
+
+        # =========================
+        # SECCIÓN
+        # =========================
+        if linea.startswith('S '):
+            cerrar_bloque()
+            cerrar_cancion()
+            if seccion_abierta:
+                resultado.append(r'\end{songs}')
+                resultado.append('')				
+            seccion_abierta = True
+            resultado.extend([
+                r'\songchapter{' + linea[2:].strip().title() + '}',
+                r'\begin{songs}{titleidx}'
+            ])
+            i += 1
+            continue
+
+        # =========================
+        # CANCIÓN
+        # =========================
+        if linea.startswith('O '):
+            cerrar_bloque()
+            cerrar_cancion()
+
+            titulo_raw = linea[2:].strip()
+            titulo_limpio, transposicion_actual = extraer_transposicion_original(titulo_raw)
+
+            titulo_cancion_actual = titulo_limpio.title()
+
+            resultado.append(r'\beginsong{' + titulo_cancion_actual + '}')
+            cancion_abierta = True
+            i += 1
+            continue
+
+        # =========================
+        # BLOQUES
+        # =========================
+        if linea == 'V':
+            cerrar_bloque()
+            tipo_bloque = 'verse'
+            if i + 2 < len(lineas):
+                siguiente = lineas[i+1].strip()
+                siguiente2 = lineas[i+2].strip()
+				# Caso especial: V / C / _Estrofa   --> C es acorde Do
+                if siguiente == 'CH' and siguiente2.startswith('_'):
+                    # construimos la línea con acorde Do sobre el primer '_'
+                    acordes = ['C']  # o 'Do' según quieras
+                    linea_estrofa = siguiente2
+                    linea_procesada = procesar_linea_con_acordes_y_indices_original(
+                        linea_estrofa, acordes, titulo_cancion_actual, semitonos=transposicion_actual
+                    )
+                    bloque_actual.append(linea_procesada)
+                    # saltar las dos líneas ya consumidas
+                    i += 3
+                    continue
+            i += 1
+            continue
+
+        if linea == 'CH':
+            cerrar_bloque()
+            tipo_bloque = 'chorus'
+            i += 1
+            continue
+
+        if linea == 'M':
+            cerrar_bloque()
+            tipo_bloque = 'melody'
+            i += 1
+            continue
+        if es_linea_acordes_original(linea):
+            i += 1
+            continue
+        # =========================
+        # TEXTO NORMAL
+        # =========================
+        if tipo_bloque:
+            if i > 0 and es_linea_acordes_original(lineas[i-1]):
+                acordes = lineas[i-1].split()
+                linea_procesada = procesar_linea_con_acordes_y_indices_original(linea, acordes, titulo_cancion_actual, semitonos=transposicion_actual)
+            else:
+                linea_procesada = linea.replace('_', '')
+            bloque_actual.append(linea_procesada)
+            i += 1
+            continue
+        else:
+            i += 1
+            continue
+# =========================
+    # CIERRES FINALES
+    # =========================
+    if raw_mode:
+        cerrar_raw()
+
+    cerrar_bloque()
+    cerrar_cancion()
+
+    if seccion_abierta:
+        resultado.append(r'\end{songs}')
+
+    return '\n'.join(resultado)
@@ -0,0 +1,130 @@
+"""
+Suite de pytest-benchmark para cada etapa del pipeline, sobre cancioneros
+sintéticos (generador.py).
+
+    pip install -r benchmarks/requirements.txt
+    cd benchmarks
+    python -m pytest --benchmark-save=referencia    # guarda la línea base
+    python -m pytest --benchmark-compare            # compara con la última guardada
+
+Las líneas base quedan en benchmarks/linea_base/<máquina>/; comparar sólo
+tiene sentido contra una guardada en la misma máquina. Con
+--benchmark-compare la corrida falla si alguna mediana empeora más que
+UMBRAL_REGRESION (ver conftest.py).
+
+La compilación completa (compilar_tex_seguro) se salta si pdflatex no
+está instalado.
+"""
+import os
+import shutil
+import sys
+
+import pytest
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# convert.py lee plantilla.tex relativo al directorio actual
+os.chdir(RAIZ)
+sys.path.insert(0, RAIZ)
+
+import acordes  # noqa: E402
+import convert  # noqa: E402
+import latex_cancionero  # noqa: E402
+from cache_fragmentos import CacheFragmentos  # noqa: E402
+from generador import generar_cancionero  # noqa: E402
+from songpro import parsear_cancionero  # noqa: E402
+
+TAMANIOS = (10, 100, 500)
+# Compilar cuesta segundos por pasada: pocas canciones y pocas rondas
+CANCIONES_COMPILACION = 25
+RONDAS_COMPILACION = 3
+
+
+@pytest.fixture(scope="module")
+def cancioneros():
+    return {n: generar_cancionero(n) for n in TAMANIOS}
+
+
+@pytest.fixture(scope="module")
+def lineas(cancioneros):
+    return cancioneros[max(TAMANIOS)].split('\n')
+
+
+@pytest.fixture(scope="module")
+def tokens_acordes(lineas):
+    return [token for linea in lineas if acordes.es_linea_acordes(linea) for token in linea.split()]
+
+
+@pytest.fixture
+def cache_fria(monkeypatch):
+    """convert sin caché de fragmentos: todo se parsea y renderiza."""
+    monkeypatch.setattr(convert, "cache_fragmentos", CacheFragmentos(0))
+
+
+# =========================
+# ACORDES Y LÍNEAS
+# =========================
+def test_transportar_acorde(benchmark, tokens_acordes):
+    def transportar():
+        for semitonos in (-5, 2, 7):
+            for acorde in tokens_acordes:
+                acordes.transportar_acorde(acorde, semitonos)
+
+    benchmark(transportar)
+
+
+def test_es_linea_acordes(benchmark, lineas):
+    benchmark(lambda: [acordes.es_linea_acordes(linea) for linea in lineas])
+
+
+# =========================
+# SONGPRO -> LATEX
+# =========================
+@pytest.mark.parametrize("canciones", TAMANIOS)
+def test_convertir_songpro(benchmark, cancioneros, cache_fria, canciones):
+    benchmark(convert.convertir_songpro, cancioneros[canciones])
+
+
+@pytest.mark.parametrize("canciones", TAMANIOS)
+def test_convertir_songpro_con_fragmentos(benchmark, cancioneros, canciones):
+    """El mismo texto otra vez: todas las canciones salen de la caché."""
+    texto = cancioneros[canciones]
+    convert.convertir_songpro(texto)
+    benchmark(convert.convertir_songpro, texto)
+
+
+def test_parseo(benchmark, cancioneros):
+    benchmark(parsear_cancionero, cancioneros[max(TAMANIOS)])
+
+
+def test_render_latex(benchmark, cancioneros):
+    cancionero = parsear_cancionero(cancioneros[max(TAMANIOS)])
+    benchmark(lambda: list(latex_cancionero.renderizar_stream(cancionero)))
+
+
+# =========================
+# PLANTILLA
+# =========================
+def test_escribir_tex_cancionero(benchmark, cancioneros, tmp_path, cache_fria):
+    """Cabeza y cola de la plantilla alrededor de las canciones, directo a disco."""
+    ruta = str(tmp_path / "cancionero.tex")
+    benchmark(convert.escribir_tex_cancionero, cancioneros[max(TAMANIOS)], ruta)
+
+
+# =========================
+# COMPILACIÓN COMPLETA
+# =========================
+@pytest.mark.skipif(shutil.which("pdflatex") is None, reason="pdflatex no está instalado")
+def test_compilar_tex_seguro(benchmark, tmp_path):
+    texto = generar_cancionero(CANCIONES_COMPILACION, canciones_por_seccion=10)
+    indices = convert.indices_cancionero(texto)
+    rondas = iter(range(RONDAS_COMPILACION))
+
+    def preparar():
+        # Directorio nuevo en cada ronda: sin .aux ni .idx de la anterior
+        directorio = tmp_path / f"ronda{next(rondas)}"
+        directorio.mkdir()
+        ruta = str(directorio / "cancionero.tex")
+        convert.escribir_tex_cancionero(texto, ruta)
+        return (ruta,), {"indices": indices}
+
+    benchmark.pedantic(convert.compilar_tex_seguro, setup=preparar, rounds=RONDAS_COMPILACION)
@@ -0,0 +1,250 @@
+"""
+Caché de fragmentos por canción, para re-renderizar cancioneros editados.
+
+Quien corrige una canción de un libro de 300 reenvía el texto completo; con
+CacheAST (por hash del texto entero) eso es parsear y renderizar las 300.
+Acá el texto se parte en canciones (songpro.dividir_en_segmentos) y cada
+segmento se guarda con su árbol y su LaTeX, por hash de su texto fuente.
+Sólo se parsean y renderizan los segmentos que cambiaron.
+
+- renderizar_stream(texto): los mismos trozos que
+  latex_cancionero.renderizar_stream(parsear_cancionero(texto))
+- parsear(texto): el mismo Cancionero que parsear_cancionero(texto),
+  armado con los árboles de cada segmento
+
+Cada fragmento guarda también su mapa de fuente (latex_cancionero), con
+líneas relativas al segmento: renderizar_stream(texto, mapa) lo corre al
+lugar del segmento en el texto. El LaTeX se renderiza la primera vez que
+se pide: la vista previa sólo usa el árbol.
+
+La transposición de una canción está en su línea O, así que va en el hash.
+Los bloques sueltos de una sección (o antes de la primera canción) usan el
+título y la transposición de la canción anterior: esos segmentos llevan
+además ese contexto en la clave.
+
+Cada variante de tono (latex_cancionero.Variante) de un segmento se
+renderiza desde el árbol ya guardado, sin volver a parsear, y queda en su
+propia LRU (clave del segmento más el nombre de la variante): pedir
+muchos tonos no desaloja los fragmentos base.
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+
+import latex_cancionero
+from songpro import Cancionero, Seccion, dividir_en_segmentos, parsear_cancionero, pausar_gc
+
+
+class Fragmento:
+    """
+    Un segmento ya parseado; su LaTeX se renderiza al pedirlo por primera
+    vez. Fuera de eso no se modifica una vez guardado.
+    """
+    __slots__ = ("tipo", "nodo", "contexto", "variante", "lineas_acordes", "fuera_de_bloque", "_latex")
+
+    def __init__(self, tipo, nodo, contexto, lineas_acordes, fuera_de_bloque, variante=None):
+        self.tipo = tipo
+        # Cancion (O), Seccion (S) o lista de elementos sueltos (antes de la primera O/S)
+        self.nodo = nodo
+        self.contexto = contexto
+        self.variante = variante
+        self.lineas_acordes = lineas_acordes
+        # Números de línea relativos al segmento (1 = su primera línea)
+        self.fuera_de_bloque = fuera_de_bloque
+        self._latex = None
+
+    def _renderizado(self):
+        # Si dos hilos lo piden a la vez se renderiza dos veces; da lo mismo
+        if self._latex is None:
+            self._latex = _renderizar(self.tipo, self.nodo, self.contexto, self.variante)
+        return self._latex
+
+    @property
+    def latex(self):
+        return self._renderizado()[0]
+
+    @property
+    def mapa(self):
+        """Un rango de líneas relativo al segmento por cada línea de `latex`."""
+        return self._renderizado()[1]
+
+
+def _renderizar(tipo, nodo, contexto, variante=None):
+    """(latex, mapa) del nodo de un segmento."""
+    latex = []
+    mapa = []
+    if tipo == 'O':
+        latex_cancionero.renderizar_cancion(nodo, latex, mapa=mapa, variante=variante)
+    else:
+        if tipo == 'S':
+            latex_cancionero.abrir_seccion(nodo.titulo, latex, mapa, nodo.linea)
+            elementos = nodo.elementos
+        else:
+            elementos = nodo
+        titulo, transposicion = contexto
+        if variante is not None:
+            transposicion += variante.desplazamiento
+        latex_cancionero.renderizar_elementos(elementos, titulo, transposicion, latex, mapa)
+    return tuple(latex), tuple(mapa)
+
+
+def _fragmento(tipo, lineas, contexto):
+    parcial = parsear_cancionero('\n'.join(lineas))
+    if tipo == 'O':
+        nodo = parcial.secciones[0].canciones[0]
+    elif tipo == 'S':
+        nodo = parcial.secciones[1]
+    else:
+        nodo = parcial.secciones[0].elementos
+    return Fragmento(tipo, nodo, contexto, parcial.lineas_acordes, tuple(parcial.fuera_de_bloque))
+
+
+class CacheFragmentos:
+    """
+    LRU en memoria de fragmentos (uno por canción o sección), compartida
+    entre requests. maximo=0 la desactiva: todo se parsea y renderiza entero.
+    Las variantes de tono van en otra LRU de `maximo_variantes` (por
+    defecto, `maximo`). Aciertos y fallos cuentan una vez por fragmento
+    pedido, sea base o variante.
+    """
+
+    def __init__(self, maximo, maximo_variantes=None):
+        self.maximo = maximo
+        self.maximo_variantes = maximo if maximo_variantes is None else maximo_variantes
+        self._fragmentos = OrderedDict()
+        self._variantes = OrderedDict()
+        self._lock = threading.Lock()
+        self.aciertos = 0
+        self.fallos = 0
+
+    @property
+    def habilitada(self):
+        return self.maximo > 0
+
+    @staticmethod
+    def clave(tipo, lineas, contexto):
+        h = hashlib.sha256('\n'.join(lineas).encode("utf-8"))
+        if tipo != 'O':
+            titulo, transposicion = contexto
+            h.update(f"\0{titulo}\0{transposicion}".encode("utf-8"))
+        return h.hexdigest()
+
+    def _buscar(self, lru, clave, contar=True):
+        with self._lock:
+            fragmento = lru.get(clave)
+            if fragmento is not None:
+                lru.move_to_end(clave)
+            if contar:
+                if fragmento is not None:
+                    self.aciertos += 1
+                else:
+                    self.fallos += 1
+            return fragmento
+
+    def _guardar(self, lru, clave, fragmento, maximo):
+        with self._lock:
+            lru[clave] = fragmento
+            lru.move_to_end(clave)
+            while len(lru) > maximo:
+                lru.popitem(last=False)
+
+    def _base(self, clave, tipo, lineas, contexto, contar=True):
+        fragmento = self._buscar(self._fragmentos, clave, contar)
+        if fragmento is None:
+            # Fuera del lock, como en CacheAST; si dos hilos hacen el mismo, gana el último
+            fragmento = _fragmento(tipo, lineas, contexto)
+            self._guardar(self._fragmentos, clave, fragmento, self.maximo)
+        return fragmento
+
+    def _obtener(self, tipo, lineas, contexto, variante=None):
+        clave = self.clave(tipo, lineas, contexto)
+        if variante is None or not variante.nombre:
+            return self._base(clave, tipo, lineas, contexto)
+
+        # Otro tono: el mismo árbol, otro LaTeX. Cuenta sólo la consulta de la
+        # variante; el fragmento base es un paso interno para armarla
+        clave_variante = f"{clave}\0{variante.nombre}"
+        otro = self._buscar(self._variantes, clave_variante)
+        if otro is None:
+            fragmento = self._base(clave, tipo, lineas, contexto, contar=False)
+            otro = Fragmento(tipo, fragmento.nodo, contexto, fragmento.lineas_acordes,
+                             fragmento.fuera_de_bloque, variante)
+            self._guardar(self._variantes, clave_variante, otro, self.maximo_variantes)
+        return otro
+
+    def fragmentos(self, texto, variante=None):
+        """(tipo, inicio, Fragmento) de cada segmento, en orden."""
+        contexto = ("", 0)
+        for tipo, inicio, lineas in dividir_en_segmentos(texto):
+            fragmento = self._obtener(tipo, lineas, contexto, variante)
+            if tipo == 'O':
+                contexto = (fragmento.nodo.titulo, fragmento.nodo.transposicion)
+            yield tipo, inicio, fragmento
+
+    def renderizar_stream(self, texto, mapa=None, variante=None):
+        """Mismos trozos (y mismo `mapa`) que latex_cancionero.renderizar_stream."""
+        if not self.habilitada:
+            yield from latex_cancionero.renderizar_stream(
+                parsear_cancionero(texto), mapa=mapa, variante=variante
+            )
+            return
+
+        resultado = []
+        seccion_abierta = False
+        for tipo, inicio, fragmento in self.fragmentos(texto, variante):
+            if tipo == 'S':
+                if seccion_abierta:
+                    latex_cancionero.cerrar_seccion(resultado, mapa)
+                seccion_abierta = True
+            if tipo is not None and resultado:
+                yield '\n'.join(resultado)
+                resultado.clear()
+            resultado.extend(fragmento.latex)
+            if mapa is not None:
+                mapa.extend(None if rango is None else (inicio + rango[0], inicio + rango[1])
+                            for rango in fragmento.mapa)
+
+        if seccion_abierta:
+            resultado.append(r'\end{songs}')
+            latex_cancionero.mapear(mapa, resultado, len(resultado) - 1, None)
+
+        if resultado:
+            yield '\n'.join(resultado)
+
+    def parsear(self, texto):
+        """Mismo Cancionero que parsear_cancionero(texto)."""
+        if not self.habilitada:
+            return parsear_cancionero(texto)
+
+        cancionero = Cancionero(total_lineas=texto.count('\n') + 1)
+        seccion = Seccion(None)
+        cancionero.secciones.append(seccion)
+        # Una sola pausa del GC para todos los segmentos, no una por cada uno
+        with pausar_gc():
+            for tipo, inicio, fragmento in self.fragmentos(texto):
+                cancionero.lineas_acordes += fragmento.lineas_acordes
+                cancionero.fuera_de_bloque.extend(inicio + n for n in fragmento.fuera_de_bloque)
+                if tipo == 'O':
+                    seccion.canciones.append(fragmento.nodo)
+                elif tipo == 'S':
+                    # Sección nueva: la guardada no recibe las canciones de este texto
+                    seccion = Seccion(fragmento.nodo.titulo, list(fragmento.nodo.elementos),
+                                      linea=fragmento.nodo.linea)
+                    cancionero.secciones.append(seccion)
+                else:
+                    seccion.elementos.extend(fragmento.nodo)
+        return cancionero
+
+    def estadisticas(self):
+        with self._lock:
+            consultas = self.aciertos + self.fallos
+            return {
+                "habilitada": self.habilitada,
+                "fragmentos": len(self._fragmentos),
+                "maximo": self.maximo,
+                "variantes": len(self._variantes),
+                "maximo_variantes": self.maximo_variantes,
+                "aciertos": self.aciertos,
+                "fallos": self.fallos,
+                "tasa_aciertos": self.aciertos / consultas if consultas else 0.0,
+            }
@@ -0,0 +1,232 @@
+"""
+Caché persistente de PDFs compilados, direccionada por contenido.
+
+La clave es un SHA-256 del LaTeX generado más la huella de la plantilla
+(plantillas.Plantilla.huella) y de los estilos de texmf-local. Los archivos se escriben de forma atómica
+(temporal + os.replace) para que varios workers de gunicorn puedan compartir
+el mismo directorio, y se desalojan por LRU (mtime) al superar el presupuesto.
+
+La clave sirve también de ETag: el primer PDF guardado con una clave no se
+reemplaza (otra compilación del mismo LaTeX difiere en la fecha y el /ID del
+PDF), así que mientras esté en la caché todas las respuestas con esa ETag
+son el mismo archivo, byte a byte.
+"""
+import fcntl
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Archivos que, si cambian, invalidan todo lo compilado anteriormente
+# (cada plantilla entra con su propia huella: ver CachePDF.nuevo_hash).
+# Se buscan al lado de este archivo, no en el directorio de trabajo (cli.py)
+_RAIZ = os.path.dirname(os.path.abspath(__file__))
+ARCHIVOS_ESTILO = tuple(os.path.join(_RAIZ, ruta) for ruta in ("songs.sty", "texmf-local"))
+
+# Temporales huérfanos (worker muerto a mitad de escritura) más viejos que esto se borran
+EDAD_MAXIMA_TEMPORAL = 3600
+
+
+def _listar_archivos(rutas):
+    for ruta in rutas:
+        if os.path.isdir(ruta):
+            for raiz, dirs, archivos in os.walk(ruta):
+                dirs.sort()
+                for nombre in sorted(archivos):
+                    yield os.path.join(raiz, nombre)
+        elif os.path.isfile(ruta):
+            yield ruta
+
+
+_huella_lock = threading.Lock()
+_huella_memo = {}
+
+
+def huella_estilos(rutas=ARCHIVOS_ESTILO):
+    """
+    Hash del contenido de los archivos de estilo.
+    Se recalcula sólo si cambia el mtime o el tamaño de alguno de ellos.
+    """
+    archivos = list(_listar_archivos(rutas))
+    firma = tuple(
+        (a, st.st_mtime_ns, st.st_size)
+        for a, st in ((a, os.stat(a)) for a in archivos)
+    )
+    with _huella_lock:
+        memo = _huella_memo.get(rutas)
+        if memo and memo[0] == firma:
+            return memo[1]
+
+    h = hashlib.sha256()
+    for archivo in archivos:
+        # La ruta relativa: la huella no depende de dónde esté instalado
+        h.update(os.path.relpath(archivo, _RAIZ).encode("utf-8") + b"\0")
+        with open(archivo, "rb") as f:
+            h.update(f.read())
+        h.update(b"\0")
+    huella = h.hexdigest()
+
+    with _huella_lock:
+        _huella_memo[rutas] = (firma, huella)
+    return huella
+
+
+def nuevo_hash(huella_plantilla=""):
+    """Hash parcial para calcular la clave mientras el .tex se escribe por trozos."""
+    h = hashlib.sha256()
+    h.update(huella_estilos().encode("ascii"))
+    h.update(b"\0")
+    h.update(huella_plantilla.encode("ascii"))
+    h.update(b"\0")
+    return h
+
+
+class CachePDF:
+    """
+    Caché LRU en disco de PDFs terminados.
+    - obtener(clave): abre el PDF cacheado (o None) y lo marca como usado
+    - abrir(clave): igual, pero sin contarlo como consulta (el PDF recién guardado)
+    - guardar(clave, ruta_pdf): copia atómica (si no estaba) y desalojo si se pasa del límite
+    """
+
+    def __init__(self, directorio, limite_bytes):
+        self.directorio = directorio
+        self.limite_bytes = limite_bytes
+        self._lock = threading.Lock()
+        self.aciertos = 0
+        self.fallos = 0
+        self.escrituras = 0
+        self.desalojos = 0
+        if self.habilitada:
+            os.makedirs(directorio, exist_ok=True)
+
+    @property
+    def habilitada(self):
+        return self.limite_bytes > 0
+
+    def nuevo_hash(self, huella_plantilla=""):
+        return nuevo_hash(huella_plantilla)
+
+    def clave(self, tex, huella_plantilla=""):
+        h = self.nuevo_hash(huella_plantilla)
+        h.update(tex.encode("utf-8"))
+        return h.hexdigest()
+
+    def ruta(self, clave):
+        return os.path.join(self.directorio, clave[:2], clave + ".pdf")
+
+    def _contar(self, campo):
+        with self._lock:
+            setattr(self, campo, getattr(self, campo) + 1)
+
+    def abrir(self, clave):
+        """Devuelve un archivo abierto en modo binario, o None si no está."""
+        if not self.habilitada:
+            return None
+        ruta = self.ruta(clave)
+        try:
+            f = open(ruta, "rb")
+        except FileNotFoundError:
+            return None
+        try:
+            os.utime(ruta, None)
+        except OSError:
+            # Otro worker lo desalojó justo ahora; el handle abierto sigue siendo válido
+            pass
+        return f
+
+    def obtener(self, clave):
+        f = self.abrir(clave)
+        self._contar("fallos" if f is None else "aciertos")
+        return f
+
+    def guardar(self, clave, ruta_pdf):
+        if not self.habilitada:
+            return
+        destino = self.ruta(clave)
+        if os.path.exists(destino):
+            # Ya lo guardó otra compilación: ese es el PDF de esta ETag
+            return
+        carpeta = os.path.dirname(destino)
+        os.makedirs(carpeta, exist_ok=True)
+
+        fd, temporal = tempfile.mkstemp(dir=carpeta, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as salida, open(ruta_pdf, "rb") as entrada:
+                shutil.copyfileobj(entrada, salida)
+            os.replace(temporal, destino)
+        except Exception:
+            try:
+                os.remove(temporal)
+            except OSError:
+                pass
+            raise
+
+        self._contar("escrituras")
+        self._desalojar()
+
+    def _desalojar(self):
+        """Borra los PDFs menos usados hasta quedar bajo el límite."""
+        lock_path = os.path.join(self.directorio, ".lock")
+        with open(lock_path, "a") as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                # Otro worker ya está desalojando
+                return
+
+            ahora = time.time()
+            entradas = []
+            total = 0
+            for raiz, _, archivos in os.walk(self.directorio):
+                for nombre in archivos:
+                    ruta = os.path.join(raiz, nombre)
+                    try:
+                        st = os.stat(ruta)
+                    except FileNotFoundError:
+                        continue
+                    if nombre.endswith(".tmp"):
+                        if ahora - st.st_mtime > EDAD_MAXIMA_TEMPORAL:
+                            _borrar(ruta)
+                        continue
+                    if not nombre.endswith(".pdf"):
+                        continue
+                    entradas.append((st.st_mtime, st.st_size, ruta))
+                    total += st.st_size
+
+            if total <= self.limite_bytes:
+                return
+
+            entradas.sort()
+            for _, tamano, ruta in entradas:
+                if total <= self.limite_bytes:
+                    break
+                if _borrar(ruta):
+                    total -= tamano
+                    self._contar("desalojos")
+            logger.info(f"Caché PDF desalojada hasta {total} bytes")
+
+    def estadisticas(self):
+        with self._lock:
+            consultas = self.aciertos + self.fallos
+            return {
+                "aciertos": self.aciertos,
+                "fallos": self.fallos,
+                "tasa_aciertos": (self.aciertos / consultas) if consultas else 0.0,
+                "escrituras": self.escrituras,
+                "desalojos": self.desalojos,
+                "limite_bytes": self.limite_bytes,
+            }
+
+
+def _borrar(ruta):
+    try:
+        os.remove(ruta)
+        return True
+    except FileNotFoundError:
+        return False
@@ -0,0 +1,242 @@
+"""
+Conversión masiva de cancioneros SongPro desde la línea de comandos, sin servidor.
+
+Recorre un directorio (con subdirectorios) buscando .txt/.song y deja en el
+directorio de salida, con la misma estructura, el .tex y/o el PDF de cada uno.
+Los archivos se reparten en procesos (uno por núcleo, -j para cambiarlo):
+cada pdflatex ocupa un núcleo entero.
+
+Un archivo se salta si su contenido, la plantilla y los estilos no
+cambiaron desde la última corrida y sus salidas siguen ahí (la huella de
+cada uno queda en <salida>/.cancionero.json; --forzar convierte todo).
+
+Al terminar imprime el tiempo de cada archivo por etapa y devuelve 1 si
+alguno falló, para usarlo en CI o en cron:
+    python cli.py canciones/ salida/ --pdf --tex -j 4
+
+No importa convert.py: ni Flask, ni cachés, ni directorios creados al importar.
+
+Corre desde cualquier directorio: plantilla.tex, plantillas/, texmf-local
+(songs.sty y los demás estilos) y cache/formatos se buscan al lado de este
+archivo (RAIZ), no en el directorio actual. Las rutas de entrada y salida sí
+son relativas al directorio actual.
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import compilacion
+import formato_tex
+import latex_cancionero
+import plantillas
+from cache_pdf import huella_estilos
+from indices import IndicesCancionero
+from mapa_fuente import MapaFuente
+from metricas import Etapas
+from songpro import parsear_cancionero
+from validador import TextoInvalido, validar_o_lanzar
+
+# El servidor corre con /app como directorio de trabajo; el CLI, desde donde sea
+RAIZ = os.path.dirname(os.path.abspath(__file__))
+
+EXTENSIONES = ('.txt', '.song')
+FORMATOS = ('tex', 'pdf')
+ARCHIVO_HUELLAS = ".cancionero.json"
+
+# Plantilla de cada proceso del pool (ver _iniciar_proceso)
+_plantilla = None
+
+
+def buscar_entradas(directorio):
+    """Rutas relativas de los .txt/.song bajo `directorio`, ordenadas."""
+    entradas = []
+    for raiz, directorios, archivos in os.walk(directorio):
+        directorios[:] = sorted(d for d in directorios if not d.startswith('.'))
+        for archivo in archivos:
+            if archivo.endswith(EXTENSIONES):
+                entradas.append(os.path.relpath(os.path.join(raiz, archivo), directorio))
+    return sorted(entradas)
+
+
+def huella_entrada(ruta, plantilla, formatos):
+    """Cambia si cambia el texto, la plantilla, los estilos o los formatos pedidos."""
+    h = hashlib.sha256()
+    h.update(f"{huella_estilos()}\0{plantilla.huella}\0{','.join(formatos)}\0".encode("utf-8"))
+    with open(ruta, "rb") as f:
+        h.update(f.read())
+    return h.hexdigest()
+
+
+def leer_huellas(directorio):
+    try:
+        with open(os.path.join(directorio, ARCHIVO_HUELLAS), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def guardar_huellas(directorio, huellas):
+    ruta = os.path.join(directorio, ARCHIVO_HUELLAS)
+    with open(ruta + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(huellas, f, indent=1, sort_keys=True)
+    os.replace(ruta + ".tmp", ruta)
+
+
+def preparar_entorno():
+    """
+    Rutas del repositorio desde RAIZ para pdflatex y el formato precompilado
+    (en la imagen Docker, TEXMFHOME y el directorio de trabajo ya son /app).
+    Por el entorno, así también las ven los procesos del pool.
+    """
+    # El '//' busca en subdirectorios; el separador final conserva la búsqueda por defecto
+    os.environ["TEXINPUTS"] = (
+        os.path.join(RAIZ, "texmf-local", "tex") + "//" + os.pathsep + os.environ.get("TEXINPUTS", "")
+    )
+    os.environ.setdefault("FORMATO_TEX_DIR", os.path.join(RAIZ, "cache", "formatos"))
+    formato_tex.directorio_formatos = os.environ["FORMATO_TEX_DIR"]
+
+
+def _iniciar_proceso(plantilla):
+    global _plantilla
+    _plantilla = plantilla
+
+
+def convertir_archivo(ruta, destinos):
+    """
+    Corre en un proceso del pool. SongPro -> .tex y, si está en `destinos`
+    (formato -> ruta de salida), PDF. Un solo parseo: el mismo árbol da el
+    LaTeX y los índices. Devuelve (error o None, etapas.tiempos, segundos).
+    """
+    etapas = Etapas()
+    inicio = time.perf_counter()
+    try:
+        with etapas.medir("lectura"):
+            with open(ruta, "r", encoding="utf-8") as f:
+                texto = f.read()
+        with etapas.medir("validacion"):
+            validar_o_lanzar(texto)
+        with etapas.medir("parseo"):
+            cancionero = parsear_cancionero(texto)
+
+        with tempfile.TemporaryDirectory(prefix="cancionero_cli_") as temp_dir:
+            tex_path = os.path.join(temp_dir, "cancionero.tex")
+            mapa = MapaFuente()
+            with etapas.medir("conversion"):
+                compilacion.escribir_tex(
+                    latex_cancionero.renderizar_stream(cancionero, mapa=mapa.rangos),
+                    tex_path, _plantilla, mapa
+                )
+            if "pdf" in destinos:
+                compilacion.compilar_tex(
+                    tex_path, _plantilla, indices=IndicesCancionero.desde_cancionero(cancionero),
+                    etapas=etapas, mapa=mapa
+                )
+            with etapas.medir("copia"):
+                for formato, destino in destinos.items():
+                    os.makedirs(os.path.dirname(destino) or ".", exist_ok=True)
+                    shutil.copyfile(os.path.join(temp_dir, "cancionero." + formato), destino)
+        return None, etapas.tiempos, time.perf_counter() - inicio
+
+    except TextoInvalido as e:
+        error = "\n".join([str(e)] + [str(p) for p in e.errores])
+    except (OSError, UnicodeDecodeError, RuntimeError, ValueError) as e:
+        error = str(e)
+    return error, etapas.tiempos, time.perf_counter() - inicio
+
+
+def _linea_reporte(estado, segundos, ruta, tiempos):
+    detalle = ", ".join(f"{etapa} {s:.2f}" for etapa, s in tiempos.items())
+    return f"{segundos:8.2f} s  {estado:<7} {ruta}" + (f"  ({detalle})" if detalle else "")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Convierte un directorio de cancioneros SongPro (.txt/.song) a .tex y/o PDF."
+    )
+    parser.add_argument("entrada", help="directorio con los .txt/.song (se recorre entero)")
+    parser.add_argument("salida", help="directorio donde quedan los .tex/.pdf, con la misma estructura")
+    parser.add_argument("--tex", action="store_true", help="generar el .tex")
+    parser.add_argument("--pdf", action="store_true", help="generar el PDF (por defecto si no se pide nada)")
+    parser.add_argument("-j", "--procesos", type=int, default=os.cpu_count() or 1,
+                        help="procesos en paralelo (por defecto, uno por núcleo)")
+    parser.add_argument("--plantilla", default=None,
+                        help=f"plantilla (por defecto '{plantillas.PLANTILLA_POR_DEFECTO}')")
+    parser.add_argument("--plantillas-dir",
+                        default=os.environ.get("PLANTILLAS_DIR", os.path.join(RAIZ, plantillas.DIRECTORIO)),
+                        help="directorio con las demás plantillas")
+    parser.add_argument("--forzar", action="store_true", help="convertir también los que no cambiaron")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.WARNING, format="%(levelname)s %(name)s: %(message)s")
+
+    formatos = [f for f in FORMATOS if getattr(args, f)] or ["pdf"]
+    preparar_entorno()
+    try:
+        plantilla = plantillas.RegistroPlantillas(
+            os.path.join(RAIZ, plantillas.ARCHIVO_PRINCIPAL), args.plantillas_dir
+        ).obtener(args.plantilla)
+    except (plantillas.PlantillaDesconocida, OSError, RuntimeError) as e:
+        parser.error(str(e))
+    if not os.path.isdir(args.entrada):
+        parser.error(f"No existe el directorio {args.entrada}")
+
+    os.makedirs(args.salida, exist_ok=True)
+    huellas = leer_huellas(args.salida)
+    pendientes = {}
+    saltados = 0
+    for relativa in buscar_entradas(args.entrada):
+        ruta = os.path.join(args.entrada, relativa)
+        base = os.path.join(args.salida, os.path.splitext(relativa)[0])
+        destinos = {formato: f"{base}.{formato}" for formato in formatos}
+        huella = huella_entrada(ruta, plantilla, formatos)
+        if not args.forzar and huellas.get(relativa) == huella \
+                and all(os.path.exists(d) for d in destinos.values()):
+            saltados += 1
+            continue
+        pendientes[relativa] = (ruta, destinos, huella)
+
+    if "pdf" in formatos and pendientes:
+        # Una sola vez antes del pool: los procesos encuentran el .fmt ya hecho
+        formato_tex.asegurar_formato(plantilla)
+
+    procesos = max(1, args.procesos)
+    inicio = time.perf_counter()
+    fallidos = 0
+    try:
+        with ProcessPoolExecutor(max_workers=procesos, initializer=_iniciar_proceso,
+                                 initargs=(plantilla,)) as pool:
+            futuros = {
+                pool.submit(convertir_archivo, ruta, destinos): (relativa, huella)
+                for relativa, (ruta, destinos, huella) in pendientes.items()
+            }
+            for futuro in as_completed(futuros):
+                relativa, huella = futuros[futuro]
+                error, tiempos, segundos = futuro.result()
+                if error is None:
+                    huellas[relativa] = huella
+                    print(_linea_reporte("ok", segundos, relativa, tiempos), flush=True)
+                else:
+                    fallidos += 1
+                    huellas.pop(relativa, None)
+                    print(_linea_reporte("error", segundos, relativa, tiempos), flush=True)
+                    for linea in error.splitlines():
+                        print(f"{'':20}{linea}", flush=True)
+    finally:
+        # Lo convertido hasta acá no se repite aunque se corte a la mitad
+        guardar_huellas(args.salida, huellas)
+
+    print(
+        f"{len(pendientes) - fallidos} convertidos, {fallidos} con error, {saltados} sin cambios "
+        f"en {time.perf_counter() - inicio:.2f} s ({procesos} {'proceso' if procesos == 1 else 'procesos'})"
+    )
+    return 1 if fallidos else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,151 @@
+"""
+Ejecutor acotado para las compilaciones de LaTeX.
+
+Cada pdflatex ocupa un núcleo entero; si todos los hilos de gunicorn compilan
+a la vez, todos se vuelven lentos hasta llegar al timeout. Aquí las
+compilaciones pasan por un pool con tantos hilos como núcleos le tocan a
+este worker y una cola acotada: si la cola está llena se rechaza al tiro
+(ColaLlena -> HTTP 429 con Retry-After) en vez de degradar a todos.
+
+Un núcleo es un proceso pdflatex a la vez: cada compilación ocupa uno
+mientras corre. La compilación por secciones (compilacion_paralela) usa el
+suyo y pide prestados los que estén libres en ese momento
+(procesos_extra), así el worker nunca corre más pdflatex que `concurrencia`.
+"""
+import math
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+
+def concurrencia_por_defecto():
+    """Núcleos repartidos entre los workers de gunicorn (WEB_CONCURRENCY)."""
+    workers = max(1, int(os.environ.get("WEB_CONCURRENCY", "1")))
+    return max(1, (os.cpu_count() or 1) // workers)
+
+
+class ColaLlena(Exception):
+    """La cola de compilación está llena; reintentar en `reintentar_en` segundos."""
+
+    def __init__(self, reintentar_en):
+        super().__init__(f"Cola de compilación llena, reintentar en {reintentar_en} s")
+        self.reintentar_en = reintentar_en
+
+
+class EjecutorCompilacion:
+    """
+    Pool de compilación con control de admisión.
+    - enviar(): encola y devuelve un Future, o lanza ColaLlena
+    - ejecutar(): enviar() y esperar el resultado
+    - procesos_extra(): núcleos libres prestados a la compilación en curso
+    - estadisticas(): profundidad de cola y tiempos de espera
+    """
+
+    def __init__(self, concurrencia=None, capacidad_cola=None):
+        self.concurrencia = concurrencia or concurrencia_por_defecto()
+        self.capacidad_cola = (
+            capacidad_cola if capacidad_cola is not None else 2 * self.concurrencia
+        )
+        self._pool = ThreadPoolExecutor(
+            max_workers=self.concurrencia, thread_name_prefix="compilacion"
+        )
+        # Cupos = en ejecución + en espera
+        self._cupos = threading.BoundedSemaphore(self.concurrencia + self.capacidad_cola)
+        # Un pdflatex a la vez por núcleo: lo toma cada tarea y los procesos extra
+        self._procesos = threading.BoundedSemaphore(self.concurrencia)
+        self._lock = threading.Lock()
+        self.en_cola = 0
+        self.en_ejecucion = 0
+        self.procesos_prestados = 0
+        self.iniciadas = 0
+        self.completadas = 0
+        self.rechazadas = 0
+        self.espera_total = 0.0
+        self.espera_maxima = 0.0
+        self.duracion_total = 0.0
+
+    def reintentar_en(self):
+        """Segundos estimados hasta que se libere un cupo (mínimo 1)."""
+        with self._lock:
+            media = self.duracion_total / self.completadas if self.completadas else 5.0
+            pendientes = self.en_cola + self.en_ejecucion
+        return max(1, math.ceil(media * pendientes / self.concurrencia))
+
+    def enviar(self, funcion, *args, **kwargs):
+        if not self._cupos.acquire(blocking=False):
+            with self._lock:
+                self.rechazadas += 1
+            raise ColaLlena(self.reintentar_en())
+
+        encolada = time.monotonic()
+        with self._lock:
+            self.en_cola += 1
+
+        def tarea():
+            # Si una compilación por secciones tiene núcleos prestados, se espera a que los devuelva
+            self._procesos.acquire()
+            inicio = time.monotonic()
+            espera = inicio - encolada
+            with self._lock:
+                self.en_cola -= 1
+                self.en_ejecucion += 1
+                self.iniciadas += 1
+                self.espera_total += espera
+                self.espera_maxima = max(self.espera_maxima, espera)
+            try:
+                return funcion(*args, **kwargs)
+            finally:
+                with self._lock:
+                    self.en_ejecucion -= 1
+                    self.completadas += 1
+                    self.duracion_total += time.monotonic() - inicio
+                self._procesos.release()
+                self._cupos.release()
+
+        try:
+            return self._pool.submit(tarea)
+        except Exception:
+            with self._lock:
+                self.en_cola -= 1
+            self._cupos.release()
+            raise
+
+    def ejecutar(self, funcion, *args, **kwargs):
+        return self.enviar(funcion, *args, **kwargs).result()
+
+    @contextmanager
+    def procesos_extra(self, maximo):
+        """
+        Hasta `maximo` pdflatex más para la tarea en curso (que ya tiene el
+        suyo), sólo entre los núcleos libres ahora: no espera. Entrega cuántos
+        consiguió (puede ser 0) y los devuelve al salir.
+        """
+        obtenidos = 0
+        while obtenidos < maximo and self._procesos.acquire(blocking=False):
+            obtenidos += 1
+        with self._lock:
+            self.procesos_prestados += obtenidos
+        try:
+            yield obtenidos
+        finally:
+            with self._lock:
+                self.procesos_prestados -= obtenidos
+            for _ in range(obtenidos):
+                self._procesos.release()
+
+    def estadisticas(self):
+        with self._lock:
+            return {
+                "concurrencia": self.concurrencia,
+                "capacidad_cola": self.capacidad_cola,
+                "en_cola": self.en_cola,
+                "en_ejecucion": self.en_ejecucion,
+                "procesos_prestados": self.procesos_prestados,
+                "completadas": self.completadas,
+                "rechazadas": self.rechazadas,
+                "espera_media": self.espera_total / self.iniciadas if self.iniciadas else 0.0,
+                "espera_maxima": self.espera_maxima,
+                "duracion_media": self.duracion_total / self.completadas if self.completadas else 0.0,
+            }
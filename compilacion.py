@@ -0,0 +1,175 @@
+"""
+Compilación de un .tex del cancionero con pdflatex, sin Flask.
+
+La usan el servidor (convert.py, dentro del pool de compilación) y la línea
+de comandos (cli.py, en procesos aparte). Importarlo no lee plantillas ni
+crea directorios: todo lo que necesita se pasa explícito.
+
+- escribir_tex(): plantilla + trozos de LaTeX -> .tex y su clave de caché
+- compilar_tex(): pasadas de pdflatex hasta que el documento se estabiliza
+"""
+import hashlib
+import logging
+import os
+import subprocess
+
+import formato_tex
+from cache_pdf import nuevo_hash
+from indices import NOMBRES_INDICE
+from mapa_fuente import error_compilacion
+from metricas import Etapas
+
+logger = logging.getLogger(__name__)
+
+# Tope de pasadas de pdflatex aunque .aux/.toc/índices sigan cambiando
+MAX_PASADAS_LATEX = int(os.environ.get("MAX_PASADAS_LATEX", "4"))
+# Archivos que pdflatex lee de la pasada anterior: si no cambian, otra pasada no cambia nada
+EXTENSIONES_ENTRADA_LATEX = ('.aux', '.toc', '.out', '.ind', '.sbx')
+
+
+def _hash_archivo(ruta):
+    with open(ruta, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def instantanea_entradas_latex(tex_dir):
+    """Hash de cada .aux/.toc/.out/índice presente en el directorio de compilación."""
+    instantanea = {}
+    for nombre in os.listdir(tex_dir):
+        if nombre.endswith(EXTENSIONES_ENTRADA_LATEX):
+            try:
+                instantanea[nombre] = _hash_archivo(os.path.join(tex_dir, nombre))
+            except OSError:
+                pass
+    return instantanea
+
+
+def compilar_tex(tex_path, plantilla, limpiar=True, indices=None, etapas=None, mapa=None):
+    """
+    Compila un archivo .tex y devuelve True si tuvo éxito.
+    Repite pdflatex sólo mientras cambien los .aux/.toc/.out/índices que lee,
+    hasta MAX_PASADAS_LATEX. Con `indices` (IndicesCancionero) los .ind se
+    escriben en Python entre pasadas, sin makeindex.
+    En caso de error lanza ErrorCompilacion con sólo los errores '!' del log,
+    sin repetidos y, con `mapa` (MapaFuente del .tex), en líneas del SongPro.
+    Con limpiar=False se dejan los auxiliares (.log, .toc...) para leerlos
+    después, y el log de todas las pasadas queda en <base>.log.
+    `etapas` (metricas.Etapas) recibe el tiempo de cada pasada y de los índices.
+    `plantilla` (plantillas.Plantilla, la de tex_path) elige el formato precompilado.
+    """
+    etapas = etapas or Etapas()
+    tex_dir = os.path.dirname(tex_path) or "."
+    tex_file = os.path.basename(tex_path)
+    base_name = os.path.splitext(tex_file)[0]
+    logs = ""
+    # Salida de la última pasada: la que trae los errores si falló
+    salida = ""
+    AUX_FILES = ['.aux', '.log', '.out', '.toc', '.lof', '.lot', '.tema.ind', '.tema.idx', '.cbtitle', '.cbtitle.ind', '.fls', '.synctex.gz']
+    def cleanup_aux_files():
+        """Elimina todos los archivos auxiliares generados por LaTeX y makeindex."""
+        for ext in AUX_FILES:
+            aux_file = os.path.join(tex_dir, base_name + ext)
+            if os.path.exists(aux_file):
+                try:
+                    os.remove(aux_file)
+                except Exception as e:
+                    logger.warning(f"No se pudo borrar el archivo auxiliar {aux_file}: {e}")
+    # Todas las pasadas usan el preámbulo precompilado si está disponible
+    args_formato, env_formato = formato_tex.argumentos_pdflatex(plantilla)
+    try:
+        # Lo que leerá la primera pasada (normalmente nada)
+        entradas_previas = instantanea_entradas_latex(tex_dir)
+        idx_procesados = {}
+        motivos = []
+        pasada = 0
+        while True:
+            pasada += 1
+            with etapas.medir(f"pdflatex_{pasada}"):
+                result = subprocess.run(
+                    ["pdflatex", "-interaction=nonstopmode", *args_formato, tex_file],
+                    capture_output=True, text=True, cwd=tex_dir, env=env_formato
+                )
+            salida = result.stdout
+            logs += f"\n--- COMPILACIÓN {pasada} ---\n" + result.stdout + result.stderr
+            if result.returncode != 0:
+                raise RuntimeError(f"Error compilando LaTeX en la pasada {pasada}.")
+
+            # .ind nuevo sólo si el .idx cambió desde la última vez
+            for nombre in NOMBRES_INDICE if indices is not None else ():
+                ruta_entrada = os.path.join(tex_dir, nombre + ".idx")
+                if not os.path.exists(ruta_entrada):
+                    continue
+                huella = _hash_archivo(ruta_entrada)
+                if idx_procesados.get(nombre) == huella:
+                    continue
+                idx_procesados[nombre] = huella
+                with etapas.medir("indices"):
+                    cantidad = indices.escribir(tex_dir, nombre)
+                logs += f"\n--- ÍNDICE {nombre}: {cantidad} entradas ---\n"
+
+            # Otra pasada sólo si cambió algo de lo que pdflatex lee
+            entradas = instantanea_entradas_latex(tex_dir)
+            cambios = sorted(
+                nombre for nombre in entradas.keys() | entradas_previas.keys()
+                if entradas.get(nombre) != entradas_previas.get(nombre)
+            )
+            if not cambios:
+                break
+            if pasada >= MAX_PASADAS_LATEX:
+                logger.warning(
+                    f"LaTeX no se estabilizó tras {pasada} pasadas; cambió {', '.join(cambios)}"
+                )
+                break
+            motivos.append(f"pasada {pasada + 1}: cambió {', '.join(cambios)}")
+            entradas_previas = entradas
+
+        logger.info(
+            f"LaTeX compilado en {pasada} pasadas"
+            + (f" ({'; '.join(motivos)})" if motivos else "")
+        )
+
+        # Verificar PDF
+        pdf_file = os.path.splitext(tex_path)[0] + ".pdf"
+        if not os.path.exists(pdf_file):
+            raise RuntimeError("No se generó el PDF.")
+
+        return True
+
+    except Exception as e:
+        if not limpiar:
+            with open(os.path.join(tex_dir, f"{base_name}.log"), "w", encoding="utf-8") as f:
+                f.write(logs)
+        raise error_compilacion(salida, mapa, str(e)) from e
+    finally:
+        # **LIMPIEZA CRÍTICA:** Se ejecuta siempre, haya éxito o error.
+        if limpiar:
+            cleanup_aux_files()
+
+
+def escribir_tex(trozos, ruta_tex, plantilla, mapa=None):
+    """
+    Escribe cabeza de la plantilla + `trozos` (LaTeX de las canciones, que se
+    unen con '\n') + cola directo al archivo, sin armar el documento en
+    memoria. Devuelve (clave de caché, cantidad de canciones).
+    Con `mapa` (MapaFuente) sólo se fija el desplazamiento de la cabeza: los
+    rangos los llena quien genera los trozos.
+    """
+    if mapa is not None:
+        mapa.desplazamiento = plantilla.lineas_cabeza
+    h = nuevo_hash(plantilla.huella)
+    canciones = 0
+
+    with open(ruta_tex, "w", encoding="utf-8") as f:
+        def escribir(trozo):
+            f.write(trozo)
+            h.update(trozo.encode("utf-8"))
+
+        escribir(plantilla.cabeza + "\n")
+        for n, trozo in enumerate(trozos):
+            # Cada canción es un trozo propio
+            if trozo.startswith('\\beginsong{'):
+                canciones += 1
+            escribir(trozo if n == 0 else "\n" + trozo)
+        escribir("\n" + plantilla.cola)
+
+    return h.hexdigest(), canciones
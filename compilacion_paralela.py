@@ -0,0 +1,206 @@
+"""
+Compilación paralela por secciones (modo opcional, ?paralelo=1).
+
+El paquete songs cierra cada entorno songs con \\clearpage, así que cada
+sección (S) ya empieza en página nueva y se puede compilar por separado sin
+cambiar la diagramación:
+
+1. El LaTeX de canciones se parte en una parte por sección.
+2. Cada parte se compila en su propio directorio, todas a la vez. El trabajo
+   lo hacen los procesos pdflatex; los hilos del pool sólo los esperan.
+3. Un documento marco con la plantilla completa incluye las páginas de cada
+   parte con pdfpages y les pone el número de página final. El índice general
+   se rehace con las entradas de cada parte corridas a su página final, y
+   las entradas de índice (tema, titleidx) se vuelven a emitir en la página
+   donde quedaron, así los índices cubren todo el libro.
+
+Los enlaces del índice general y de los índices apuntan a las páginas del
+marco; los enlaces internos de cada parte no sobreviven a la inclusión.
+
+Con el MapaFuente del documento entero, cada parte lleva el suyo (sus
+líneas del mapa y su propia cabeza), así un error de pdflatex en una
+sección se informa en líneas del texto igual que al compilar de una vez.
+"""
+import logging
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+from indices import leer_grupos, leer_idx
+from mapa_fuente import MapaFuente
+
+logger = logging.getLogger(__name__)
+
+MARCA_SECCION = '\\songchapter{'
+
+# Sin índice general ni folios propios: los pone el marco
+PREAMBULO_PARTE = '\\renewcommand\\tableofcontents{}\n'
+INICIO_PARTE = (
+    '\\pagestyle{empty}\n'
+    '\\makeatletter\\let\\ps@plain\\ps@empty\\makeatother\n'
+    '\\setcounter{SB@songsnum}{%d}\n'
+)
+
+_RE_PAGINAS = re.compile(r'Output written on .*?\((\d+)\s+pages?', re.S)
+
+
+def agrupar_por_seccion(trozos):
+    """
+    Trozos de latex_cancionero.renderizar_stream -> un LaTeX por sección.
+    Lo que venga antes de la primera sección va con ella.
+    """
+    partes = []
+    for trozo in trozos:
+        if not partes or (trozo.startswith(MARCA_SECCION) and partes[-1]):
+            partes.append([])
+        partes[-1].append(trozo)
+    return ['\n'.join(parte) for parte in partes]
+
+
+def leer_toc(ruta):
+    """Entradas \\contentsline de un .toc como [tipo, texto, página, destino]."""
+    if not os.path.exists(ruta):
+        return []
+    entradas = []
+    with open(ruta, encoding="utf-8", errors="replace") as f:
+        for linea in f:
+            if not linea.startswith('\\contentsline'):
+                continue
+            try:
+                entradas.append(leer_grupos(linea, len('\\contentsline'), 4))
+            except (ValueError, IndexError):
+                logger.warning(f"Entrada de índice general ilegible: {linea.strip()}")
+    return entradas
+
+
+def contar_paginas(ruta_log):
+    with open(ruta_log, encoding="utf-8", errors="replace") as f:
+        match = _RE_PAGINAS.search(f.read())
+    if not match:
+        raise RuntimeError(f"No se pudo leer la cantidad de páginas de {ruta_log}")
+    return int(match.group(1))
+
+
+class Parte:
+    """Una sección compilada por separado."""
+    __slots__ = ("numero", "directorio", "nombre", "paginas", "toc", "indices", "mapa")
+
+    def __init__(self, numero, directorio):
+        self.numero = numero
+        self.directorio = directorio
+        self.nombre = f"parte_{numero:03d}"
+        self.paginas = 0
+        self.toc = []
+        self.indices = {}   # nombre del índice -> [(clave, página)]
+        self.mapa = None    # MapaFuente de ruta_tex
+
+    @property
+    def ruta_tex(self):
+        return os.path.join(self.directorio, self.nombre + ".tex")
+
+    def ruta(self, extension):
+        return os.path.join(self.directorio, self.nombre + extension)
+
+    def leer_resultados(self):
+        self.paginas = contar_paginas(self.ruta(".log"))
+        self.toc = leer_toc(self.ruta(".toc"))
+        for archivo in sorted(os.listdir(self.directorio)):
+            # imakeidx escribe <nombre del índice>.idx
+            if archivo.endswith(".idx") and not archivo.startswith(self.nombre):
+                self.indices[archivo[:-4]] = leer_idx(os.path.join(self.directorio, archivo))
+
+
+def escribir_partes(partes_latex, cabeza, directorio, mapa=None):
+    """
+    Un .tex por sección, cada uno en su subdirectorio (imakeidx usa nombres fijos).
+    Con `mapa` (MapaFuente del documento entero) cada parte recibe el suyo.
+    """
+    cabeza_parte = cabeza.replace('\\begin{document}', PREAMBULO_PARTE + '\\begin{document}', 1)
+    # Líneas de cada parte antes de su contenido: cabeza y INICIO_PARTE
+    desplazamiento = cabeza_parte.count('\n') + 1 + INICIO_PARTE.count('\n')
+    partes = []
+    entornos_previos = 0
+    linea = 0
+    for numero, contenido in enumerate(partes_latex):
+        parte = Parte(numero, os.path.join(directorio, f"parte_{numero:03d}"))
+        if mapa is not None:
+            # Las partes son trozos seguidos del documento: sus líneas del mapa también
+            lineas = contenido.count('\n') + 1
+            parte.mapa = MapaFuente(desplazamiento)
+            parte.mapa.rangos = mapa.rangos[linea:linea + lineas]
+            linea += lineas
+        os.makedirs(parte.directorio)
+        with open(parte.ruta_tex, "w", encoding="utf-8") as f:
+            f.write(cabeza_parte + "\n")
+            # Numeración de los entornos songs (y de sus enlaces) como en el libro completo
+            f.write(INICIO_PARTE % entornos_previos)
+            f.write(contenido)
+            f.write("\n\\end{document}\n")
+        entornos_previos += contenido.count('\\begin{songs}')
+        partes.append(parte)
+    return partes
+
+
+def contenido_marco(partes, directorio):
+    """LaTeX que va entre los marcadores de la plantilla en el documento marco."""
+    lineas = ['\\makeatletter']
+    desplazamiento = 0
+    for parte in partes:
+        for tipo, texto, pagina, _ in parte.toc:
+            try:
+                final = int(pagina) + desplazamiento
+            except ValueError:
+                continue
+            entrada = f'\\contentsline {{{tipo}}}{{{texto}}}{{{final}}}{{page.{final}}}'
+            lineas.append(f'\\immediate\\write\\@auxout{{\\unexpanded{{\\@writefile{{toc}}{{{entrada}}}}}}}')
+        desplazamiento += parte.paginas
+    lineas.append('\\makeatother')
+
+    for parte in partes:
+        por_pagina = {}
+        for indice, entradas in parte.indices.items():
+            for clave, pagina in entradas:
+                por_pagina.setdefault(pagina, []).append(f'\\index[{indice}]{{{clave}}}')
+        ruta_pdf = os.path.relpath(parte.ruta(".pdf"), directorio)
+        for pagina in range(1, parte.paginas + 1):
+            comandos = ''.join(por_pagina.get(pagina, ()))
+            lineas.append(
+                f'\\includepdf[pages={pagina},pagecommand={{\\thispagestyle{{plain}}{comandos}}}]'
+                f'{{{ruta_pdf}}}'
+            )
+    return '\n'.join(lineas)
+
+
+def compilar_en_paralelo(partes_latex, cabeza, cola, ruta_marco, compilar, concurrencia=1,
+                         indices=None, mapa=None):
+    """
+    Compila cada sección por separado y las une en `ruta_marco` (.tex), que
+    queda compilado a PDF al lado. `compilar(ruta_tex, limpiar=..., indices=...,
+    mapa=...)` es la función de compilación de siempre (pasadas + índices).
+    Sólo el marco imprime los índices, así que `indices` (IndicesCancionero)
+    es sólo para él. `concurrencia` son los pdflatex que puede correr a la
+    vez: los núcleos que le dio el pool de compilación
+    (EjecutorCompilacion.procesos_extra). `mapa` (MapaFuente del documento
+    entero, el mismo LaTeX que `partes_latex`) lleva los errores de cada
+    sección a líneas del texto.
+    """
+    directorio = os.path.dirname(ruta_marco) or "."
+    partes = escribir_partes(partes_latex, cabeza, directorio, mapa)
+
+    concurrencia = max(1, min(len(partes), concurrencia))
+    with ThreadPoolExecutor(max_workers=concurrencia, thread_name_prefix="seccion") as pool:
+        # list() propaga el primer error de compilación
+        list(pool.map(lambda parte: compilar(parte.ruta_tex, limpiar=False, mapa=parte.mapa), partes))
+
+    for parte in partes:
+        parte.leer_resultados()
+    logger.info(
+        f"{len(partes)} secciones compiladas en paralelo ({concurrencia} a la vez), "
+        f"{sum(p.paginas for p in partes)} páginas"
+    )
+
+    with open(ruta_marco, "w", encoding="utf-8") as f:
+        f.write(cabeza + "\n")
+        f.write(contenido_marco(partes, directorio))
+        f.write("\n" + cola)
+    compilar(ruta_marco, indices=indices)
@@ -1,20 +1,46 @@
-from flask import session, Flask, request, after_this_request, jsonify, send_file, render_template_string, Response, redirect, url_for
+from flask import session, Flask, g, request, after_this_request, jsonify, send_file, render_template_string, Response, redirect, url_for, make_response
 from flask_cors import CORS
-from werkzeug.exceptions import NotFound
+from markupsafe import escape
+from werkzeug.exceptions import NotFound, RequestedRangeNotSatisfiable
 import traceback
 import os
-import subprocess
 import re
 import unicodedata
+import hashlib
 import uuid
 import time
 import io
+import contextlib
+import functools
 import tempfile
+import json
+import logging
+import random
+import threading
+
+from cache_pdf import CachePDF
+import compilacion
+import espacios
+from cola_compilacion import ColaLlena, EjecutorCompilacion
+import compilacion_paralela
+import plantillas
+from metricas import Etapas, Metricas, reiniciar as reiniciar_metricas
+from indices import IndicesCancionero
+import trabajos
+import lote
+from acordes import equivalencias_latinas
+import latex_cancionero
+import vista_previa
+from cache_fragmentos import CacheFragmentos
+from mapa_fuente import ErrorCompilacion, MapaFuente
+from songpro import CacheAST, TrazaParser
+from validador import CacheValidacion, TextoInvalido, validar_o_lanzar
 
 
 app = Flask(__name__)
 CORS(app, resources={
-    r"/get/pdf/": {"origins": ["https://vinaconc.cl"]}
+    r"/get/pdf/": {"origins": ["https://vinaconc.cl"]},
+    r"/preview": {"origins": ["https://vinaconc.cl"]},
 })
 app.secret_key = 'Quique04#'
 app.config['ENV'] = 'production'
@@ -33,271 +59,127 @@ def handle_exception(e):
     # Devolver un mensaje de error genérico
     return jsonify({"error": "Error inesperado en el servidor."}), 500
 
-archivo_plantilla = "plantilla.tex"
-
-archivo_salida = "cancionero_web.tex"
 directorio_pdfs = "pdfs"
-os.makedirs(directorio_pdfs, exist_ok=True)
-
-with open(archivo_plantilla, "r", encoding="utf-8") as f:
-	plantilla = f.read()
-
-indice_tematica_global = {}
-
-notas = ['C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#', 'A', 'A#', 'B']
-equivalencias_latinas = {
-	'Do': 'C', 'Do#': 'C#', 'Re': 'D', 'Re#': 'D#', 'Mi': 'E', 'Fa': 'F',
-	'Fa#': 'F#', 'Sol': 'G', 'Sol#': 'G#', 'La': 'A', 'La#': 'A#', 'Si': 'B'
-}
-
-def transportar_acorde(acorde, semitonos):
-	acorde = acorde.strip()
-
-	# Convertir notación de bemoles en inglés a notación estándar
-	acorde = acorde.replace('Bb', 'A#').replace('bb', 'a#')
-	acorde = acorde.replace('Gb', 'F#').replace('gb', 'f#')
-
-	# Manejar acordes con bajo (por ejemplo D/F#)
-	if '/' in acorde:
-		parte_superior, bajo = acorde.split('/')
-		parte_superior_transpuesta = transportar_acorde(parte_superior, semitonos)
-		bajo_transpuesto = transportar_acorde(bajo, semitonos)
-		return f"{parte_superior_transpuesta}/{bajo_transpuesto}"
-
-	# Mapa de conversión de bemoles a sostenidos para procesamiento interno
-	mapa_bemoles_a_sostenidos = {
-		'Reb': 'Do#', 'Rebm': 'Do#m',
-		'Mib': 'Re#', 'Mibm': 'Re#m',
-		'Lab': 'Sol#', 'Labm': 'Sol#m',
-		'Sib': 'La#', 'Sibm': 'La#m'
-		# Nota: Solb no se convierte a Fa# para mantener consistencia con el mapa de bemoles
-	}
-
-	# Convertir bemoles a sostenidos para procesamiento interno
-	for bemol, sostenido in mapa_bemoles_a_sostenidos.items():
-		if acorde.lower().startswith(bemol.lower()):
-			acorde = sostenido + acorde[len(bemol):]
-			break
-
-	# Detectar si es notación latina y convertir a americana
-	for nota_lat, nota_ang in equivalencias_latinas.items():
-		if acorde.lower().startswith(nota_lat.lower()):
-			acorde = nota_ang + acorde[len(nota_lat):]
-			break			
-
-	match = re.match(r'^([A-Ga-g][#b]?)(.*)$', acorde)
-	if not match:
-		return acorde
-	nota, sufijo = match.groups()
-	nota_mayus = nota.upper()
-
-	try:
-		idx = notas.index(nota_mayus)
-	except ValueError:
-		return acorde
-
-	nueva_idx = (idx + semitonos) % 12
-	nueva_nota = notas[nueva_idx]
-	if nota[0].islower():
-		nueva_nota = nueva_nota.lower()
-
-	acorde_transpuesto = nueva_nota + sufijo
-
-	# Volver a convertir a notación latina
-	return convertir_a_latex(acorde_transpuesto)
-
-
-def limpiar_para_indice(palabra):
-	return re.sub(r'[^a-zA-Z0-9áéíóúÁÉÍÓÚñÑ]', '', palabra)
-
 
-def es_linea_acordes(linea):
-    # Si la línea tiene guiones bajos, NO es acorde
-    if '_' in linea:
-        return False
-
-    tokens = linea.split()
-    if not tokens:
-        return False
-
-    # Lista completa de notas latinas (naturales, sostenidas, bemoles)
-    notas_latinas = [
-        'do', 're', 'mi', 'fa', 'sol', 'la', 'si',
-        'do#', 're#', 'fa#', 'sol#', 'la#',
-        'reb', 'mib', 'lab', 'sib'
-    ]
-    # También notación americana para seguridad
-    notas_americanas = ['c', 'd', 'e', 'f', 'g', 'a', 'b']
-
-    for t in tokens:
-        t_lower = t.lower()
-
-        # Verificar si es una nota latina con posibles sufijos (m, maj, 7, etc.)
-        es_nota = False
-        for nota in notas_latinas:
-            if t_lower.startswith(nota):
-                # Aceptar si después de la nota viene un sufijo válido o fin de token
-                resto = t_lower[len(nota):]
-                if resto == '' or resto.startswith('m') or resto.startswith('maj') or resto.startswith('min') or resto.startswith('dim') or resto.startswith('aug') or resto.startswith('sus') or resto.startswith('add') or resto.startswith('7') or resto.startswith('9') or resto.startswith('11') or resto.startswith('13') or resto.startswith('/'):
-                    es_nota = True
-                    break
-        if es_nota:
-            continue
-
-        # Verificar si es una nota americana con sufijos
-        for nota in notas_americanas:
-            if t_lower.startswith(nota):
-                resto = t_lower[len(nota):]
-                if resto == '' or resto.startswith('#') or resto.startswith('b') or resto.startswith('m') or resto.startswith('maj') or resto.startswith('min') or resto.startswith('dim') or resto.startswith('aug') or resto.startswith('sus') or resto.startswith('add') or resto.startswith('7') or resto.startswith('9') or resto.startswith('11') or resto.startswith('13') or resto.startswith('/'):
-                    es_nota = True
-                    break
-        if es_nota:
-            continue
-
-        # Si ningún token es nota, no es línea de acordes
-        return False
-
-    return True
-
-def convertir_a_latex(acorde):
-	mapa = {
-		'C': 'Do', 'C#': 'Do#', 'D': 'Re', 'D#': 'Re#', 'E': 'Mi', 'F': 'Fa',
-		'F#': 'Fa#', 'G': 'Sol', 'G#': 'Sol#', 'A': 'La', 'A#': 'La#', 'B': 'Si',
-		'Cm': 'Dom', 'C#m': 'Do#m', 'Dm': 'Rem', 'D#m': 'Re#m', 'Em': 'Mim',
-		'Fm': 'Fam', 'F#m': 'Fa#m', 'Gm': 'Solm', 'G#m': 'Sol#m',
-		'Am': 'Lam', 'A#m': 'La#m', 'Bm': 'Sim'
-	}
-
-	# Mapa de conversión de sostenidos a bemoles (SOLO para La#)
-	mapa_bemoles_excepcion = {
-		'La#': 'Sib', 'La#m': 'Sibm'
-	}
-
-	acorde = acorde.strip()
-	# Convertir notación de bemoles en inglés a notación estándar
-	acorde = acorde.replace('Bb', 'A#').replace('bb', 'a#')
-	acorde = acorde.replace('Gb', 'F#').replace('gb', 'f#')
-	acorde = acorde.replace('F#', 'FA#').replace('f#', 'fa#')
-	acorde = acorde.replace('C#', 'DO#').replace('c#', 'do#')
-
-	if any(acorde.lower().startswith(n.lower()) for n in ['do', 're', 'mi', 'fa', 'sol', 'la', 'si']):
-		return acorde
-
-	# Manejar acordes con bajo (por ejemplo D/F#)
-	if '/' in acorde:
-		parte_superior, bajo = acorde.split('/')
-		parte_superior_convertida = convertir_a_latex(parte_superior)
-		bajo_convertido = convertir_a_latex(bajo)
-		return f"{parte_superior_convertida}/{bajo_convertido}"
-
-	match = re.match(r'^([A-Ga-g][#b]?m?)(.*)$', acorde)
-	if match:
-		raiz, extension = match.groups()
-		raiz_mayus = raiz[0].upper() + raiz[1:]
-		raiz_convertida = mapa.get(raiz_mayus, raiz)
-
-		# Convertir SÓLO La# a Sib
-		raiz_convertida = mapa_bemoles_excepcion.get(raiz_convertida, raiz_convertida)
-
-		return raiz_convertida + extension
-
-	return acorde
-def procesar_linea_con_acordes_y_indices(
-    linea,
-    acordes,
-    titulo_cancion=None,
-    simbolo="#",
-    semitonos=0
-):
+# Plantillas LaTeX ya partidas: plantilla.tex y cada <nombre>.tex de PLANTILLAS_DIR
+# (?plantilla=<nombre>); se releen solas cuando cambia el archivo
+registro_plantillas = plantillas.RegistroPlantillas(
+    plantillas.ARCHIVO_PRINCIPAL, os.environ.get("PLANTILLAS_DIR", plantillas.DIRECTORIO)
+)
+
+# Todas las compilaciones pasan por aquí: concurrencia según núcleos y cola acotada
+ejecutor_compilacion = EjecutorCompilacion(
+    int(os.environ.get("COMPILACION_CONCURRENCIA", "0")) or None,
+    int(os.environ["COMPILACION_COLA"]) if "COMPILACION_COLA" in os.environ else None,
+)
+
+# Lotes (POST /lote): tope de cancioneros y cuánto esperar cupo en la cola por cada uno
+lote.MAXIMO_ITEMS = int(os.environ.get("LOTE_MAXIMO", str(lote.MAXIMO_ITEMS)))
+LOTE_ESPERA_MAXIMA = int(os.environ.get("LOTE_ESPERA_MAXIMA", "300"))
+# Variantes de tono por request (?variantes=0,+2,capo3)
+MAXIMO_VARIANTES = int(os.environ.get("MAXIMO_VARIANTES", "12"))
+
+# Compilación por secciones en paralelo por defecto (cada request puede pedir ?paralelo=0/1)
+COMPILACION_PARALELA = os.environ.get("COMPILACION_PARALELA", "0") == "1"
+# Tope de pdflatex simultáneos por cancionero en ese modo (0 = los núcleos libres del pool)
+CONCURRENCIA_PARALELA = int(os.environ.get("COMPILACION_PARALELA_CONCURRENCIA", "0")) or None
+
+# Canciones ya parseadas y renderizadas, por hash de cada una (CACHE_FRAGMENTOS_MAX=0 la desactiva);
+# las variantes de tono, en su propia LRU de CACHE_FRAGMENTOS_VARIANTES_MAX
+cache_fragmentos = CacheFragmentos(
+    int(os.environ.get("CACHE_FRAGMENTOS_MAX", "2048")),
+    int(os.environ.get("CACHE_FRAGMENTOS_VARIANTES_MAX", "2048")),
+)
+# Cancioneros ya parseados, por hash del texto (CACHE_AST_MAX=0 la desactiva);
+# si el texto no está, el árbol se arma con los fragmentos de cada canción
+cache_ast = CacheAST(int(os.environ.get("CACHE_AST_MAX", "32")), cache_fragmentos.parsear)
+# Problemas de validación por canción, por hash de cada una (CACHE_VALIDACION_MAX=0 la desactiva)
+cache_validacion = CacheValidacion(int(os.environ.get("CACHE_VALIDACION_MAX", "2048")))
+
+# Métricas de todos los workers (/metrics); cada uno vuelca lo suyo en METRICAS_DIR
+# cada METRICAS_INTERVALO segundos (además de al scrape y al salir)
+directorio_metricas = os.environ.get("METRICAS_DIR", os.path.join(tempfile.gettempdir(), "cancionero_metricas"))
+
+# Lo que toca el disco o arranca hilos se crea en iniciar_app(), no al importar
+cache_pdf = espacios_trabajo = almacen_trabajos = metricas = None
+_arranque = threading.Lock()
+
+
+def iniciar_app():
     """
-    Procesa una línea completa SongPro con:
-    - acordes por '_'
-    - palabras indexadas con '#'
-    """
-
-    resultado = ""
-    idx_acorde = 0
-
-    palabras = linea.strip().split()
-
-    for palabra in palabras:
-        palabra_tex, idx_acorde = procesar_palabra_indexada(palabra, acordes, idx_acorde, titulo_cancion, semitonos=semitonos)
-        resultado += palabra_tex + " "
-
-    return resultado.rstrip()
-def procesar_palabra_indexada(palabra, acordes, idx_acorde, titulo_cancion, indice_nombre="tema", semitonos=0):
+    Directorios, plantilla principal, caché de PDFs, espacios de compilación,
+    limpieza de trabajos y volcado de métricas. Una vez por proceso: la llaman
+    post_worker_init (gunicorn.conf.py), __main__ y, si no, el primer request.
     """
-    Procesa UNA palabra SongPro:
-    - _ inserta acordes
-    - # marca índice
-    - #u_ni_da=Unidad → visible con sílabas, índice limpio
-    """
-
-    es_indexada = palabra.startswith("#")
-    palabra_trabajo = palabra[1:] if es_indexada else palabra
-
-    # --- índice explícito ---
-    if es_indexada and "=" in palabra_trabajo:
-        base_raw, indice_real = palabra_trabajo.split("=", 1)
-    else:
-        base_raw = palabra_trabajo
-        indice_real = base_raw.replace("_", "")
-
-    partes = base_raw.split("_")
-    resultado = ""
-
-    for i, parte in enumerate(partes):
-        if i > 0:
-            if idx_acorde >= len(acordes):
-                raise RuntimeError(
-                    f"Error: hay más '_' que acordes en la palabra '{palabra}'"
-                )
-            acorde = transportar_acorde(acordes[idx_acorde], semitonos).replace("#", r"\#")
-            resultado += f"\\[{acorde}]"
-            idx_acorde += 1
-
-        resultado += parte
-
-    # --- envolver índice SOLO UNA VEZ ---
-    if es_indexada:
-        resultado = (
-            r"\textbf{"
-            + resultado
-            + rf"\protect\index[{indice_nombre}]{{{indice_real}!{titulo_cancion}}}"
-            + "}"
+    global cache_pdf, espacios_trabajo, almacen_trabajos, metricas
+    with _arranque:
+        if metricas is not None:
+            return
+        os.makedirs(directorio_pdfs, exist_ok=True)
+        # Una plantilla sin marcadores falla al arrancar y no en el primer request que la usa
+        registro_plantillas.obtener()
+
+        # Caché de PDFs ya compilados (CACHE_PDF_MAX_MB=0 la desactiva)
+        cache_pdf = CachePDF(
+            os.environ.get("CACHE_PDF_DIR", os.path.join("cache", "pdf")),
+            int(os.environ.get("CACHE_PDF_MAX_MB", "512")) * 1024 * 1024,
         )
-
-    return resultado, idx_acorde
+        # Un directorio propio por compilación, en RAM si se puede (ESPACIOS_DIR="" compila en pdfs/)
+        espacios_trabajo = espacios.EspaciosTrabajo(
+            os.environ.get("ESPACIOS_DIR", espacios.raiz_ram()),
+            directorio_pdfs,
+            int(os.environ.get("ESPACIOS_MAX_MB", "256")) * 1024 * 1024,
+        )
+        # Trabajos asíncronos (/jobs): estado y PDFs en disco, compartidos entre workers
+        almacen_trabajos = trabajos.AlmacenTrabajos(
+            os.environ.get("TRABAJOS_DIR", os.path.join("cache", "trabajos")),
+            int(os.environ.get("TRABAJOS_TTL", "3600")),
+        )
+        almacen_trabajos.iniciar_limpieza(int(os.environ.get("TRABAJOS_LIMPIEZA", "300")))
+
+        nuevas = Metricas(directorio_metricas)
+        nuevas.agregar_fuente("cache_pdf", cache_pdf.estadisticas)
+        nuevas.agregar_fuente("cache_ast", cache_ast.estadisticas)
+        nuevas.agregar_fuente("cache_fragmentos", cache_fragmentos.estadisticas)
+        nuevas.agregar_fuente("cache_validacion", cache_validacion.estadisticas)
+        nuevas.agregar_fuente("compilacion", ejecutor_compilacion.estadisticas)
+        nuevas.agregar_fuente("espacios", espacios_trabajo.estadisticas)
+        nuevas.agregar_fuente("plantillas", registro_plantillas.estadisticas)
+        nuevas.iniciar_volcado(float(os.environ.get("METRICAS_INTERVALO", "5")))
+        # Última: con `metricas` asignada el arranque está completo (ver arrancar)
+        metricas = nuevas
+
+
+@app.before_request
+def arrancar():
+    if metricas is None:
+        iniciar_app()
+
+
+@app.before_request
+def iniciar_etapas():
+    g.etapas = Etapas()
+    g.inicio_request = time.perf_counter()
+    if request.content_length:
+        g.etapas.datos["bytes_entrada"] = request.content_length
+
+
+@app.after_request
+def registrar_metricas(respuesta):
+    etapas = getattr(g, "etapas", None)
+    if etapas is None:
+        return respuesta
+    total = time.perf_counter() - g.inicio_request
+    respuesta.headers["Server-Timing"] = etapas.server_timing(total)
+    # Sin la regla no hay ruta acotada (p. ej. 404): todo va junto
+    ruta = request.url_rule.rule if request.url_rule is not None else "sin_ruta"
+    metricas.registrar_request(ruta, request.method, respuesta.status_code, total, etapas)
+    return respuesta
 
 
-def escape_latex_raw(linea):
-    """
-    Escapa caracteres especiales de LaTeX
-    SOLO para la sección N (RAW)
-    """
-    replacements = {
-        '#': r'\#',
-        '%': r'\%',
-        '&': r'\&',
-        '_': r'\_',
-        '{': r'\{',
-        '}': r'\}',
-    }
-    for k, v in replacements.items():
-        linea = linea.replace(k, v)
-    return linea
+def limpiar_para_indice(palabra):
+	return re.sub(r'[^a-zA-Z0-9áéíóúÁÉÍÓÚñÑ]', '', palabra)
 
-def extraer_transposicion(titulo_raw):
-    """
-    Extrae transposición del tipo '=+2' o '=-2' al final del título.
-    Retorna: (titulo_limpio, semitonos)
-    """
-    match = re.search(r'\s*=\s*([+-]?\d+)\s*$', titulo_raw)
-    if match:
-        semitonos = int(match.group(1))
-        titulo_limpio = re.sub(r'\s*=\s*[+-]?\d+\s*$', '', titulo_raw).strip()
-        return titulo_limpio, semitonos
-    return titulo_raw.strip(), 0
 
 def sanitize_for_diagram(texto: str) -> str:
     """
@@ -329,274 +211,69 @@ def limpiar_titulo_para_label(titulo):
     titulo = re.sub(r'[^a-zA-Z0-9\- ]+', '', titulo)
     return titulo.replace(' ', '-')
 
-def convertir_songpro(texto):
-    transposicion_actual = 0
-    repeat_abierto = False
-    lineas = [l.rstrip() for l in texto.split('\n')]
-
-    resultado = []
-
-    bloque_actual = []      # V / C / M
-    raw_buffer = []         # SOLO RAW (N)
-
-    tipo_bloque = None
-    raw_mode = False
-
-    seccion_abierta = False
-    cancion_abierta = False
-    titulo_cancion_actual = ""
-
-    # =========================
-    # CIERRES
-    # =========================
-    def cerrar_raw():
-        nonlocal raw_buffer
-        if raw_buffer:
-            resultado.append(r'\\'.join(raw_buffer) + r'\\')
-            resultado.append('')
-            raw_buffer = []
-    def procesar_repeticiones_en_letra(linea):
-        nonlocal repeat_abierto
-
-        tokens = linea.split()
-
-        # B debe convivir con letra
-        if not any(t.startswith('B') for t in tokens) or len(tokens) == 1:
-            return linea
-
-        salida = []
-        for t in tokens:
-            # Caso B, B3, B4, etc.
-            if (t.startswith('B') and t[1:].isdigit()) or t == 'B':
-                if not repeat_abierto:
-                    salida.append(r'\lrep')
-                    repeat_abierto = True
-                else:
-                    rep_num = t[1:] if t != 'B' else '2'
-                    salida.append(rf'\rrep \rep{{{rep_num}}}')
-                    repeat_abierto = False
-            else:
-                salida.append(t)
+# =========================
+# TRAZA DEL PARSER
+# =========================
+# Fracción de requests trazados aunque no lo pidan (0 = ninguno)
+TRAZA_MUESTREO = float(os.environ.get("TRAZA_PARSER_MUESTREO", "0"))
+logger_traza = app.logger.getChild("traza")
+logger_traza.setLevel(logging.INFO)
 
-        return ' '.join(salida)
-    def cerrar_bloque():
-        nonlocal bloque_actual, tipo_bloque, repeat_abierto
-        print(f"⏹️ [PARSER] Llamada a cerrar_bloque() desde el ciclo principal")
 
-        if not bloque_actual or not tipo_bloque:
-            print(f"🔍 [PARSER] Cerrar bloque vacío o sin tipo")
-            bloque_actual = []
-            tipo_bloque = None
-            return
+def traza_para_request():
+    """
+    TrazaParser si el request pidió traza (header X-Traza-Parser: 1 o
+    ?traza=1) o cayó en el muestreo; None en caso contrario.
+    """
+    if request.headers.get("X-Traza-Parser") == "1" or request.args.get("traza") == "1":
+        return TrazaParser()
+    if TRAZA_MUESTREO and random.random() < TRAZA_MUESTREO:
+        return TrazaParser()
+    return None
 
-        env = {
-            'verse':  ('\\beginverse',  '\\endverse'),
-            'chorus': ('\\beginchorus', '\\endchorus'),
-            'melody': ('\\beginverse',  '\\endverse'),
-        }.get(tipo_bloque)
 
-        if not env:
-            bloque_actual = []
-            tipo_bloque = None
-            return
-        print(f"🔍 [PARSER] Cerrando bloque {tipo_bloque} con {len(bloque_actual)} líneas:")
-        for idx, line in enumerate(bloque_actual):
-            print(f"    {idx}: '{line}'")
-
-        if repeat_abierto:
-            bloque_actual.append(r'\rrep \rep{2}')
-            repeat_abierto = False
-
-        begin, end = env
-
-        diagrama_id = {
-            'verse':  'A',
-            'chorus': 'B',
-            'melody': 'C',   # o lo que quieras
-    }.get(tipo_bloque, 'A')
-
-        # Todo el verso con acordes ya formateados
-        contenido_songs = ' \\\\'.join(bloque_actual)
-
-        resultado.extend([
-            begin,
-            r"\medskip",
-            fr"\diagram{{{diagrama_id}}}{{{contenido_songs}}}",
-            end,
-            r"\medskip",
-        ])
-
-        bloque_actual = []
-        tipo_bloque = None
-
-
-
-
-
-
-    def cerrar_cancion():
-            nonlocal cancion_abierta
-            if cancion_abierta:
-                print(f"🔍 [PARSER] Cerrando canción '{titulo_cancion_actual}'")
-                resultado.append(r'\endsong')
-                resultado.append('')
-                cancion_abierta = False
-
-    # =========================
-    # PARSER
-    # =========================
-    i = 0
-    while i < len(lineas):
-        		
-        linea = lineas[i].strip()
-        app.logger.info(f"🔍 [PARSER] Procesando línea {i}: '{linea}'")
-        if "Reden" in linea or "RE" == linea:
-            print(f"🔍 [PARSER] Procesando línea {i}: '{linea}'")
-
-        # =========================
-        # MODO RAW
-        # =========================
-        if raw_mode:
-            if linea == 'N':
-                cerrar_raw()
-                raw_mode = True   # sigue en RAW
-                i += 1
-                continue
-
-            if linea in ('V', 'CH', 'M', 'O', 'S'):
-                cerrar_raw()
-                raw_mode = False
-                continue   # reprocesar esta línea
-
-            raw_buffer.append(escape_latex_raw(linea))
-            i += 1
-            continue
-
-        # =========================
-        # N → abrir RAW
-        # =========================
-        if linea == 'N':
-            cerrar_bloque()
-            raw_mode = True
-            i += 1
-            continue
-
-        # =========================
-        # SECCIÓN
-        # =========================
-        if linea.startswith('S '):
-            cerrar_bloque()
-            cerrar_cancion()
-            if seccion_abierta:
-                resultado.append(r'\end{songs}')
-                resultado.append('')				
-            seccion_abierta = True
-            resultado.extend([
-                r'\songchapter{' + linea[2:].strip().title() + '}',
-                r'\begin{songs}{titleidx}'
-            ])
-            i += 1
-            continue
-
-        # =========================
-        # CANCIÓN
-        # =========================
-        if linea.startswith('O '):
-            cerrar_bloque()
-            cerrar_cancion()
-
-            titulo_raw = linea[2:].strip()
-            titulo_limpio, transposicion_actual = extraer_transposicion(titulo_raw)
-
-            titulo_cancion_actual = titulo_limpio.title()
-
-            resultado.append(r'\beginsong{' + titulo_cancion_actual + '}')
-            cancion_abierta = True
-            i += 1
-            continue
-
-        # =========================
-        # BLOQUES
-        # =========================
-        if linea == 'V':
-            cerrar_bloque()
-            tipo_bloque = 'verse'
-            if i + 2 < len(lineas):
-                siguiente = lineas[i+1].strip()
-                siguiente2 = lineas[i+2].strip()
-				# Caso especial: V / C / _Estrofa   --> C es acorde Do
-                if siguiente == 'CH' and siguiente2.startswith('_'):
-                    # construimos la línea con acorde Do sobre el primer '_'
-                    acordes = ['C']  # o 'Do' según quieras
-                    linea_estrofa = siguiente2
-                    linea_procesada = procesar_linea_con_acordes_y_indices(
-                        linea_estrofa, acordes, titulo_cancion_actual, semitonos=transposicion_actual
-                    )
-                    bloque_actual.append(linea_procesada)
-                    # saltar las dos líneas ya consumidas
-                    i += 3
-                    continue
-            i += 1
-            continue
-
-        if linea == 'CH':
-            cerrar_bloque()
-            tipo_bloque = 'chorus'
-            i += 1
-            continue
-
-        if linea == 'M':
-            cerrar_bloque()
-            tipo_bloque = 'melody'
-            i += 1
-            continue
-        if es_linea_acordes(linea):
-            app.logger.info(f"🎵 [PARSER] Línea de acordes: '{linea}'")
-            i += 1
-            continue
-        # =========================
-        # TEXTO NORMAL
-        # =========================
-        if tipo_bloque:
-            app.logger.info(f"📝 [PARSER] Procesando letra en bloque {tipo_bloque}: '{linea}'")
-            if i > 0 and es_linea_acordes(lineas[i-1]):
-                acordes = lineas[i-1].split()
-                app.logger.info(f"🎵 [PARSER] Acordes encontrados en línea anterior: {acordes}")
-                linea_procesada = procesar_linea_con_acordes_y_indices(linea, acordes, titulo_cancion_actual, semitonos=transposicion_actual)
-                app.logger.info(f"✅ [PARSER] Línea procesada con acordes: '{linea_procesada}'")
-            else:
-                app.logger.warning(f"⚠️ [PARSER] No se encontraron acordes para la línea: '{linea}'")
-                linea_procesada = linea.replace('_', '')
-                app.logger.info(f"➡️ [PARSER] Línea sin acordes: '{linea_procesada}'")
-            bloque_actual.append(linea_procesada)
-            i += 1
-            continue
-        else:
-            app.logger.warning(f"⚠️ [PARSER] Línea fuera de bloque: '{linea}'")
-            i += 1
-            continue
-# =========================
-    # CIERRES FINALES
-    # =========================
-    if raw_mode:
-        cerrar_raw()
+def emitir_traza(traza, origen, respuesta=None):
+    """Registra el resumen en una sola línea y, si hay respuesta, lo agrega como header."""
+    if traza is None:
+        return respuesta
+    logger_traza.info(f"Traza parser {origen}: {json.dumps(traza.resumen())}")
+    if respuesta is not None:
+        respuesta = make_response(respuesta)
+        respuesta.headers["X-Traza-Parser"] = traza.cabecera()
+    return respuesta
+
+
+def parsear_songpro(texto, traza=None):
+    """SongPro -> Cancionero, desde cache_ast si ya se parseó; llena la traza si hay."""
+    cancionero, desde_cache = cache_ast.parsear(texto)
+    if traza is not None:
+        traza.registrar(cancionero, desde_cache)
+    return cancionero
 
-    cerrar_bloque()
-    cerrar_cancion()
 
-    if seccion_abierta:
-        resultado.append(r'\end{songs}')
+def convertir_songpro(texto, traza=None, mapa=None, variante=None):
+    return '\n'.join(convertir_songpro_stream(texto, traza, mapa, variante))
 
-    return '\n'.join(resultado)
 
+def convertir_songpro_stream(texto, traza=None, mapa=None, variante=None):
+    """
+    SongPro -> trozos de LaTeX (uno por canción o sección). Sólo se parsean
+    y renderizan las canciones que no están en cache_fragmentos.
+    Unir los trozos con '\\n' da el documento de canciones completo.
+    Si se pasa una TrazaParser, se llenan sus contadores y el tiempo de parseo.
+    Con una lista en `mapa` se agrega, por cada línea generada, el rango de
+    líneas del texto de donde sale (ver mapa_fuente.py).
+    `variante` (latex_cancionero.Variante) cambia el tono de todas las canciones.
+    """
+    if traza is not None:
+        return traza.cronometrar(_convertir_songpro_con_traza(texto, traza, mapa, variante))
+    return cache_fragmentos.renderizar_stream(texto, mapa, variante)
 
 
-def normalizar(palabra):
-	# Normaliza palabra para ordenar (quita tildes y pasa a minúscula)
-	return ''.join(
-		c for c in unicodedata.normalize('NFD', palabra.lower())
-		if unicodedata.category(c) != 'Mn'
-	)
+def _convertir_songpro_con_traza(texto, traza, mapa, variante):
+    parsear_songpro(texto, traza)
+    yield from cache_fragmentos.renderizar_stream(texto, mapa, variante)
+
 
 def convertir_a_latina(acorde):
 	"""Convierte un acorde de notación americana a latina, incluyendo acordes con bajo."""
@@ -607,101 +284,40 @@ def convertir_a_latina(acorde):
 		return f"{parte_superior}/{bajo}"
 	return equivalencias_latinas.get(acorde, acorde)
 
-def limpiar_titulo_para_label(titulo):
-	# Elimina transposición al final como ' =-2' o '=+1'
-	titulo = re.sub(r'\s*=[+-]?\d+\s*$', '', titulo.strip())
-	# Normaliza: quita tildes y caracteres no válidos para etiquetas
-	titulo = unicodedata.normalize('NFD', titulo)
-	titulo = ''.join(c for c in titulo if unicodedata.category(c) != 'Mn')
-	titulo = re.sub(r'[^a-zA-Z0-9\- ]+', '', titulo)
-	return titulo.replace(' ', '-')
-
 texto_ejemplo = """
  """
 
-def compilar_tex_seguro(tex_path):
-    """
-    Compila un archivo .tex y devuelve True si tuvo éxito.
-    En caso de error, lanza RuntimeError genérico sin mostrar el log.
-    El log completo se guarda en 'plantilla.log' para depuración.
-    """
-    tex_dir = os.path.dirname(tex_path) or "."
-    tex_file = os.path.basename(tex_path)
-    base_name = os.path.splitext(tex_file)[0]
-    logs = ""
-    AUX_FILES = ['.aux', '.log', '.out', '.toc', '.lof', '.lot', '.tema.ind', '.tema.idx', '.cbtitle', '.cbtitle.ind', '.fls', '.synctex.gz']
-    def cleanup_aux_files():
-        """Elimina todos los archivos auxiliares generados por LaTeX y makeindex."""
-        for ext in AUX_FILES:
-            aux_file = os.path.join(tex_dir, base_name + ext)
-            if os.path.exists(aux_file):
-                try:
-                    os.remove(aux_file)
-                except Exception as e:
-                    app.logger.warning(f"No se pudo borrar el archivo auxiliar {aux_file}: {e}")
-    try:
-        # Primera pasada
-        result = subprocess.run(
-            ["pdflatex", "-interaction=nonstopmode", tex_file],
-            capture_output=True, text=True, cwd=tex_dir
-        )
-        logs += "\n--- COMPILACIÓN 1 ---\n" + result.stdout + result.stderr
-        if result.returncode != 0:
-            raise RuntimeError("Error compilando LaTeX en la primera pasada.")
-
-        # makeindex (si aplica)
-        base = os.path.splitext(tex_file)[0]
-        for entrada, salida in [
-            (f"{base}.tema.idx", f"{base}.tema.ind"),
-            (f"{base}.cbtitle", f"{base}.cbtitle.ind"),
-        ]:
-            if os.path.exists(os.path.join(tex_dir, entrada)):
-                cmd = ["makeindex", entrada] if salida is None else ["makeindex", "-o", salida, entrada]
-                mi = subprocess.run(cmd, capture_output=True, text=True, cwd=tex_dir)
-                logs += "\n--- MAKEINDEX ---\n" + mi.stdout + mi.stderr
-
-        # Segunda pasada
-        result2 = subprocess.run(
-            ["pdflatex", "-interaction=nonstopmode", tex_file],
-            capture_output=True, text=True, cwd=tex_dir
-        )
-        logs += "\n--- COMPILACIÓN 2 ---\n" + result2.stdout + result2.stderr
-        if result2.returncode != 0:
-            raise RuntimeError("Error compilando LaTeX en la segunda pasada.")
-
-        # Verificar PDF
-        pdf_file = os.path.splitext(tex_path)[0] + ".pdf"
-        if not os.path.exists(pdf_file):
-            raise RuntimeError("No se generó el PDF.")
-
-        return True
-
-    except Exception as e:
-        log_path = os.path.join(tex_dir, f"{base_name}.log")
-        with open(log_path, "w", encoding="utf-8") as f:
-            f.write(logs)
-        with open(log_path, "r", encoding="utf-8") as f:
-            error_log = f.read()
-        raise RuntimeError(f"Error de sintaxis en el texto ingresado\nDetalles del log:\n{error_log}")
-    finally:
-        # **LIMPIEZA CRÍTICA:** Se ejecuta siempre, haya éxito o error.
-        cleanup_aux_files()
+def compilar_tex_seguro(tex_path, limpiar=True, indices=None, etapas=None, mapa=None, plantilla=None):
+    """
+    compilacion.compilar_tex(); `plantilla` es por defecto plantilla.tex.
+    Lanza ErrorCompilacion si pdflatex falla.
+    """
+    return compilacion.compilar_tex(
+        tex_path, plantilla or registro_plantillas.obtener(), limpiar, indices, etapas, mapa
+    )
 
 @app.route("/api/generar_pdf", methods=["POST"])
 def api_generar_pdf():
     try:
         texto = request.data.decode("utf-8")  # Recibe el cuerpo de la petición como texto plano
 
-        # Aquí llamas a la función que procesa 'texto' y genera el PDF
-        # Ejemplo:
-        compilar_tex_seguro(texto)  # Función que crea .tex y compila .pdf
+        # Mismo camino que /get/pdf/: conversión, caché y pool de compilación
+        traza = traza_para_request()
+        variante = variante_para_request()
+        pdf = generar_pdf_cancionero(
+            texto, traza, paralelo_para_request(), g.etapas, plantilla_para_request(),
+            request.if_none_match, variante
+        )
+        return respuesta_pdf(pdf, traza, nombre_pdf(variante))
+
+    except ColaLlena as e:
+        return f"Servidor ocupado, reintente en {e.reintentar_en} s", 429, {"Retry-After": str(e.reintentar_en)}
 
-        pdf_file = "archivo_generado.pdf"  # Ruta al PDF generado
+    except TextoInvalido as e:
+        return jsonify(e.como_dict()), 422
 
-        if os.path.exists(pdf_file):
-            return send_file(pdf_file, as_attachment=False, mimetype="application/pdf")
-        else:
-            return "No se generó el PDF", 500
+    except (plantillas.PlantillaDesconocida, VarianteInvalida) as e:
+        return str(e), 400
 
     except Exception as e:
         app.logger.error(f"Error en api_generar_pdf: {str(e)}")
@@ -716,7 +332,17 @@ FORM_HTML = """
 {% endif %}
 <form id="formulario" method="post" enctype="multipart/form-data">
     <textarea id="texto" name="texto" rows="20" cols="80">{{ texto }}</textarea><br>
+    {% if plantillas|length > 1 %}
+    <label>Plantilla
+        <select name="plantilla">
+            {% for nombre in plantillas %}
+            <option value="{{ nombre }}" {% if nombre == plantilla %}selected{% endif %}>{{ nombre }}</option>
+            {% endfor %}
+        </select>
+    </label><br>
+    {% endif %}
     <button type="submit">Enviar</button>
+    <button type="submit" formaction="/preview" formtarget="_blank">Vista previa</button>
 	<input type="file" id="archivoLocal" accept=".txt,.song" hidden>
 	<button type="button" id="btnAbrirLocal" style="margin:5px;">📂 Abrir TXT</button>
 </form>
@@ -746,6 +372,14 @@ document.addEventListener("DOMContentLoaded", () => {
 </script>
 """
 
+def formulario(texto, error=None):
+    return render_template_string(
+        FORM_HTML, texto=texto, error=error,
+        plantillas=registro_plantillas.nombres(),
+        plantilla=request.values.get("plantilla", plantillas.PLANTILLA_POR_DEFECTO),
+    )
+
+
 @app.route("/", methods=["GET", "POST"])
 def index():
     error = None
@@ -755,201 +389,665 @@ def index():
         try:
             app.logger.info("📥 LLEGÓ POST /")
             texto = request.form.get("texto", "")
-            app.logger.info(f"Texto recibido: {repr(texto)}")
+            app.logger.info(f"Texto recibido: {len(texto)} caracteres")
+            traza = traza_para_request()
 
             # Guardar texto en sesión por si hay error
             session['texto_guardado'] = texto
 
-            # Procesar canciones
-            indice_tematica_global.clear()
-            contenido_canciones = convertir_songpro(texto)
-            
-
-            def reemplazar(match):
-                return (
-                    match.group(1)
-                    + "\n" + contenido_canciones
-                    + "\n" + match.group(3)
-                )
-
-            nuevo_tex = re.sub(
-                r"(% --- INICIO CANCIONERO ---)(.*?)(% --- FIN CANCIONERO ---)",
-                reemplazar,
-                plantilla,
-                flags=re.S
+            # Mismo camino que /get/pdf/: espacio propio, caché y pool de compilación
+            pdf = generar_pdf_cancionero(
+                texto, traza, etapas=g.etapas, plantilla=plantilla_para_request()
+            )
+            return respuesta_pdf(pdf, traza)
+
+        except ColaLlena as e:
+            app.logger.warning(f"Compilación rechazada en '/': {e}")
+            error = f"Servidor ocupado. Reintente en {e.reintentar_en} segundos."
+            return (
+                formulario(texto, error),
+                429,
+                {"Retry-After": str(e.reintentar_en)},
             )
 
-            with open(archivo_salida, "w", encoding="utf-8") as f:
-                f.write(nuevo_tex)
+        except TextoInvalido as e:
+            # El formulario muestra el error sin escapar (|safe): los mensajes citan el texto
+            error = "\n".join([f"{e}:"] + [str(escape(str(p))) for p in e.errores])
 
-            # Compilar y devolver PDF
-            compilar_tex_seguro(archivo_salida)
-            pdf_file = os.path.splitext(archivo_salida)[0] + ".pdf"
-            return send_file(pdf_file, as_attachment=False)
+        except ErrorCompilacion as e:
+            app.logger.error(f"Error generando PDF en '/': {e}")
+            error = str(escape(str(e)))
+
+        except plantillas.PlantillaDesconocida as e:
+            error = str(escape(str(e)))
 
         except Exception as e:
             app.logger.error(f"Error generando PDF en '/': {e}")
             error = "Error generando PDF. Revisa el log de sintaxis en LaTeX."
 
     # GET inicial o si hubo error en POST
-    return render_template_string(FORM_HTML, texto=texto, error=error)
-
-@app.route("/get/pdf/", methods=["POST"])
-def get_pdf():
-    try:
-        texto = request.data.decode("utf-8")
-        contenido_canciones = convertir_songpro(texto)
-        
-
-        def reemplazar(match):
-            """Función para reemplazar el marcador en la plantilla LaTeX."""
-            return match.group(1) + "\n" + contenido_canciones + "\n" + match.group(3)
-
-        nuevo_tex = re.sub(
-            r"(% --- INICIO CANCIONERO ---)(.*?)(% --- FIN CANCIONERO ---)",
-            reemplazar,
-            plantilla,
-            flags=re.S
-        )
-
-        # 1. Generar un UUID para un nombre de archivo único
-        unique_id = str(uuid.uuid4())
-        base_filename = f"cancionero_{unique_id}"
-
-        with tempfile.TemporaryDirectory(dir=directorio_pdfs) as temp_dir:
-            
-            # 2. Usar el UUID para construir los nombres de los archivos
-            archivo_salida_unico = os.path.join(temp_dir, f"{base_filename}.tex")
-            pdf_file = os.path.join(temp_dir, f"{base_filename}.pdf")
-
-            app.logger.info(f"Generando archivo único interno: {archivo_salida_unico}")
-
-            with open(archivo_salida_unico, "w", encoding="utf-8") as f:
-                f.write(nuevo_tex)
-
-            # Compilar el archivo .tex
-            compilar_tex_seguro(archivo_salida_unico)
-
-            if os.path.exists(pdf_file):
-
-                with open(pdf_file, "rb") as f:
-                    pdf_data = f.read()
-
-                # El borrado se maneja automáticamente por tempfile.TemporaryDirectory
-                # al salir del bloque 'with'.
-
-                # IMPORTANTE: resetear el puntero antes de enviar
-                buffer = io.BytesIO(pdf_data)
-                buffer.seek(0)
-
-                # Se mantiene el nombre de descarga simple para el usuario final
-                return send_file(
-                    buffer,
-                    as_attachment=False,
-                    mimetype="application/pdf",
-                    download_name="cancionero.pdf"
-                )
-
-            else:
-                return jsonify({"error": "No se generó el PDF"}), 500
-
-    except RuntimeError as e:
-        # Captura errores específicos de compilación lanzados por compilar_tex_seguro
-        app.logger.error(f"Error de compilación capturado: {e}")
-        return jsonify({"error": str(e)}), 500
-	
-    except Exception as e:
-        app.logger.error(f"Error no manejado en /get/pdf: {e}", exc_info=True)
-        return jsonify({"error": str(e)}), 500
-
-
-if __name__ == "__main__":
-    port = int(os.environ.get("PORT", "8000"))
-    app.run(host="0.0.0.0", port=port, debug=True, threaded=True)
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
+    return formulario(texto, error)
 
 
+def plantilla_para_request():
+    """?plantilla=<nombre> (o el campo del form); sin parámetro, plantilla.tex."""
+    with g.etapas.medir("plantilla"):
+        return registro_plantillas.obtener(request.values.get("plantilla"))
 
 
+class VarianteInvalida(ValueError):
+    """?transponer / ?capo / ?variantes mal escritos (HTTP 400)."""
 
 
+def variantes_para_request():
+    """
+    Variantes de tono pedidas, sin repetir (ver latex_cancionero.Variante):
+    - ?variantes=0,+2,capo3,-1capo2: varias a la vez (hasta MAXIMO_VARIANTES)
+    - ?transponer=N y/o ?capo=N: una sola
+    Sin parámetros, [Variante()]: el cancionero tal como está escrito.
+    """
+    try:
+        if "variantes" in request.values:
+            variantes = list(dict.fromkeys(
+                latex_cancionero.leer_variante(t) for t in request.values["variantes"].split(",")
+            ))
+            if len(variantes) > MAXIMO_VARIANTES:
+                raise ValueError(f"Se pueden pedir hasta {MAXIMO_VARIANTES} variantes")
+            return variantes
+        valores = {}
+        for parametro in ("transponer", "capo"):
+            valor = request.values.get(parametro) or "0"
+            if not re.fullmatch(r"[+-]?\d+", valor.strip()):
+                raise ValueError(f"'{parametro}' tiene que ser un número entero de semitonos")
+            valores[parametro] = int(valor)
+        return [latex_cancionero.Variante(valores["transponer"], valores["capo"])]
+    except ValueError as e:
+        raise VarianteInvalida(str(e)) from e
+
+
+def variante_para_request():
+    """La única variante pedida; para varias está /get/pdf/, que devuelve un ZIP."""
+    variantes = variantes_para_request()
+    if len(variantes) > 1:
+        raise VarianteInvalida("Varias variantes a la vez sólo en /get/pdf/")
+    return variantes[0]
+
+
+def nombre_pdf(variante):
+    """cancionero.pdf, cancionero_+2.pdf, cancionero_capo3.pdf..."""
+    return f"cancionero_{variante.nombre}.pdf" if variante.nombre else "cancionero.pdf"
+
+
+def escribir_tex_cancionero(texto, ruta_tex, traza=None, etapas=None, mapa=None, plantilla=None,
+                            variante=None):
+    """
+    Escribe el documento LaTeX directo al archivo: cabeza de la plantilla,
+    canciones a medida que el parser las entrega y cola. Nunca se arma el
+    documento completo en memoria. Devuelve la clave de caché del contenido.
+    Con `mapa` (MapaFuente) queda de qué líneas del texto sale cada línea del .tex.
+    `plantilla` (plantillas.Plantilla) es por defecto plantilla.tex.
+    `variante` (latex_cancionero.Variante) cambia el tono: el .tex, y por lo
+    tanto la clave, son otros.
+    """
+    etapas = etapas or Etapas()
+    if plantilla is None:
+        with etapas.medir("plantilla"):
+            plantilla = registro_plantillas.obtener()
+    rangos = mapa.rangos if mapa is not None else None
+    with etapas.medir("conversion"):
+        clave, canciones = compilacion.escribir_tex(
+            convertir_songpro_stream(texto, traza, rangos, variante), ruta_tex, plantilla, mapa
+        )
+    etapas.datos["canciones"] = canciones
+    return clave
 
 
+def indices_cancionero(texto):
+    """Entradas de tema y titleidx tomadas del árbol (ya en caché tras escribir el .tex)."""
+    cancionero, _ = cache_ast.parsear(texto)
+    return IndicesCancionero.desde_cancionero(cancionero)
 
 
+def compilar_pdf_cancionero(archivo_tex, clave_cache, partes=None, indices=None, etapas=None,
+                            mapa=None, plantilla=None):
+    """
+    Compila el .tex ya escrito, guarda el PDF en la caché y devuelve sus bytes.
+    Con `partes` (LaTeX por sección, ver partes_paralelas) compila cada sección
+    en paralelo y reescribe archivo_tex como el documento que las une.
+    `indices` (ver indices_cancionero) arma los índices sin makeindex.
+    `mapa` (MapaFuente de archivo_tex) lleva los errores a líneas del texto,
+    también los de cada sección en paralelo (cada una recibe su parte del mapa);
+    corre dentro de una tarea del pool (que ya tiene un núcleo) y usa además
+    los núcleos que estén libres, sin pasarse de la concurrencia del pool.
+    `plantilla` tiene que ser la misma con la que se escribió archivo_tex.
+    Devuelve la ruta del PDF, al lado de archivo_tex.
+    Lanza RuntimeError (ErrorCompilacion si falla pdflatex) si la compilación falla.
+    """
+    etapas = etapas or Etapas()
+    plantilla = plantilla or registro_plantillas.obtener()
+    if partes:
+        maximo = min(len(partes), CONCURRENCIA_PARALELA or len(partes))
+        with etapas.medir("secciones_paralelas"), \
+                ejecutor_compilacion.procesos_extra(maximo - 1) as extra:
+            compilacion_paralela.compilar_en_paralelo(
+                partes, plantilla.cabeza, plantilla.cola, archivo_tex,
+                functools.partial(compilar_tex_seguro, plantilla=plantilla),
+                1 + extra, indices, mapa
+            )
+    else:
+        compilar_tex_seguro(archivo_tex, indices=indices, etapas=etapas, mapa=mapa, plantilla=plantilla)
 
+    pdf_file = os.path.splitext(archivo_tex)[0] + ".pdf"
+    if not os.path.exists(pdf_file):
+        raise RuntimeError("No se generó el PDF")
 
+    with etapas.medir("guardar_cache"):
+        try:
+            cache_pdf.guardar(clave_cache, pdf_file)
+        except OSError as e:
+            app.logger.warning(f"No se pudo guardar el PDF en caché: {e}")
 
+    etapas.datos["bytes_pdf"] = os.path.getsize(pdf_file)
+    return pdf_file
 
 
+def partes_paralelas(texto, variante=None):
+    """
+    LaTeX de cada sección si el cancionero tiene dos o más; si no, None.
+    Es el mismo render que escribe el .tex: las secciones se reparten su MapaFuente.
+    """
+    partes = compilacion_paralela.agrupar_por_seccion(
+        convertir_songpro_stream(texto, variante=variante)
+    )
+    return partes if len(partes) > 1 else None
 
 
+def clave_paralela(clave_cache):
+    # El PDF armado por secciones no es idéntico al monolítico: va con otra clave
+    return hashlib.sha256(f"{clave_cache}:paralelo".encode()).hexdigest()
 
 
+def paralelo_para_request():
+    """?paralelo=1 / ?paralelo=0; sin parámetro manda COMPILACION_PARALELA."""
+    return request.args.get("paralelo", "1" if COMPILACION_PARALELA else "0") == "1"
 
 
+class PdfGenerado:
+    """
+    PDF listo para responder (ver respuesta_pdf):
+    - archivo: abierto en modo binario, o None si el cliente ya lo tiene
+    - etag: la clave de caché del PDF
+    - en_cache: si además se puede pedir por GET /pdf/<etag>
+    cerrar() cierra el archivo y borra el espacio de trabajo donde se compiló,
+    cuando la respuesta ya se mandó.
+    """
+    __slots__ = ("archivo", "etag", "en_cache", "tamano", "_pila")
 
+    def __init__(self, archivo, etag, en_cache, pila=None):
+        self.archivo = archivo
+        self.etag = etag
+        self.en_cache = en_cache
+        self.tamano = os.fstat(archivo.fileno()).st_size if archivo is not None else 0
+        self._pila = pila or contextlib.ExitStack()
+        if archivo is not None:
+            self._pila.callback(archivo.close)
 
+    def cerrar(self):
+        self._pila.close()
 
 
+def generar_pdf_cancionero(texto, traza=None, paralelo=False, etapas=None, plantilla=None,
+                           etags=(), variante=None):
+    """
+    SongPro -> PdfGenerado, tomado de la caché si ese mismo LaTeX ya se compiló.
+    Con paralelo=True las secciones se compilan por separado y a la vez.
+    `etapas` (metricas.Etapas) recibe los tiempos de cada paso.
+    `plantilla` (plantillas.Plantilla) es por defecto plantilla.tex.
+    Si la clave está en `etags` (If-None-Match) no se abre ni se compila nada.
+    `variante` (latex_cancionero.Variante) es una transposición global o capo;
+    cada variante es otro .tex y queda en la caché con su propia clave.
+    Lanza TextoInvalido (sin lanzar pdflatex) si el texto tiene errores,
+    RuntimeError si la compilación falla y ColaLlena si no hay cupo.
+    """
+    etapas = etapas or Etapas()
+    plantilla = plantilla or registro_plantillas.obtener()
+    # 1. Generar un UUID para un nombre de archivo único
+    unique_id = str(uuid.uuid4())
+    base_filename = f"cancionero_{unique_id}"
+
+    # Directorio propio (en RAM si hay lugar); si el PDF se manda desde ahí,
+    # se borra cuando termina la respuesta (PdfGenerado.cerrar)
+    with contextlib.ExitStack() as pila:
+        temp_dir = pila.enter_context(espacios_trabajo.espacio())
+
+        # 2. Usar el UUID para construir los nombres de los archivos
+        archivo_salida_unico = os.path.join(temp_dir, f"{base_filename}.tex")
+        app.logger.info(f"Generando archivo único interno: {archivo_salida_unico}")
+        mapa = MapaFuente()
+        try:
+            clave_cache = escribir_tex_cancionero(
+                texto, archivo_salida_unico, traza, etapas, mapa, plantilla, variante
+            )
+        except (RuntimeError, ValueError):
+            # El parser se detiene en el primer error; el validador los informa todos
+            validar_texto(texto, etapas)
+            raise
+        partes = partes_paralelas(texto, variante) if paralelo else None
+        if partes:
+            clave_cache = clave_paralela(clave_cache)
+
+        # El cliente ya tiene este mismo PDF
+        if clave_cache in etags:
+            return PdfGenerado(None, clave_cache, cache_pdf.habilitada)
+
+        # Si este mismo LaTeX ya se compiló, se sirve desde la caché sin lanzar TeX
+        with etapas.medir("cache"):
+            pdf_cacheado = cache_pdf.obtener(clave_cache)
+        if pdf_cacheado is not None:
+            app.logger.info(f"PDF servido desde caché: {clave_cache}")
+            etapas.datos["bytes_pdf"] = os.fstat(pdf_cacheado.fileno()).st_size
+            return PdfGenerado(pdf_cacheado, clave_cache, True)
+
+        # Antes de lanzar TeX: con errores en el texto no se compila
+        validar_texto(texto, etapas)
+        indices = indices_cancionero(texto)
+        encolado = time.perf_counter()
+
+        def compilar():
+            etapas.agregar("cola", time.perf_counter() - encolado)
+            return compilar_pdf_cancionero(
+                archivo_salida_unico, clave_cache, partes, indices, etapas, mapa, plantilla
+            )
 
+        # La compilación corre en el pool acotado (en modo paralelo, las
+        # secciones de este cancionero ocupan un solo lugar del pool)
+        pdf_file = ejecutor_compilacion.ejecutar(compilar)
 
+        # Se manda la copia de la caché si quedó guardada: es la de esta ETag
+        pdf_cacheado = cache_pdf.abrir(clave_cache)
+        if pdf_cacheado is not None:
+            return PdfGenerado(pdf_cacheado, clave_cache, True)
+        return PdfGenerado(open(pdf_file, "rb"), clave_cache, False, pila.pop_all())
 
 
+def respuesta_pdf(pdf, traza=None, nombre="cancionero.pdf"):
+    """
+    Respuesta con el PDF desde su archivo abierto, sin leerlo a memoria
+    (gunicorn lo manda con sendfile), y la ETag fuerte de su clave.
+    En GET atiende If-None-Match (304) y Range (206). En POST, que acá sólo
+    consulta, generar_pdf_cancionero ya resolvió If-None-Match y no hay Range.
+    """
+    if pdf.archivo is None:
+        respuesta = Response(status=304)
+    else:
+        respuesta = send_file(
+            pdf.archivo, mimetype="application/pdf", download_name=nombre,
+            etag=False, conditional=False,
+        )
+        respuesta.content_length = pdf.tamano
+    respuesta.call_on_close(pdf.cerrar)
+    respuesta.set_etag(pdf.etag)
+    if pdf.en_cache:
+        respuesta.headers["Content-Location"] = url_for("pdf_cacheado", clave=pdf.etag)
+    try:
+        respuesta = respuesta.make_conditional(request.environ, accept_ranges=True,
+                                               complete_length=pdf.tamano)
+    except RequestedRangeNotSatisfiable as e:
+        respuesta.close()
+        return e.get_response()
+    return emitir_traza(traza, request.path, respuesta)
 
 
+def validar_texto(texto, etapas):
+    """Lanza TextoInvalido con todos los errores del texto, con línea y columna."""
+    with etapas.medir("validacion"):
+        validar_o_lanzar(texto, cache_validacion)
 
 
+def respuesta_cola_llena(e):
+    app.logger.warning(f"Compilación rechazada: {e}")
+    return (
+        jsonify({"error": "Servidor ocupado, reintente en unos segundos."}),
+        429,
+        {"Retry-After": str(e.reintentar_en)},
+    )
 
+@app.route("/get/pdf/", methods=["POST"])
+def get_pdf():
+    try:
+        texto = request.data.decode("utf-8")
+        traza = traza_para_request()
+        variantes = variantes_para_request()
+        if len(variantes) > 1:
+            return respuesta_variantes(texto, variantes, plantilla_para_request())
+        pdf = generar_pdf_cancionero(
+            texto, traza, paralelo_para_request(), g.etapas, plantilla_para_request(),
+            request.if_none_match, variantes[0]
+        )
+        # Se mantiene el nombre de descarga simple para el usuario final
+        return respuesta_pdf(pdf, traza, nombre_pdf(variantes[0]))
 
+    except ColaLlena as e:
+        return respuesta_cola_llena(e)
 
+    except TextoInvalido as e:
+        return jsonify(e.como_dict()), 422
 
+    except plantillas.PlantillaDesconocida as e:
+        return jsonify({"error": str(e), "disponibles": e.disponibles}), 400
 
+    except VarianteInvalida as e:
+        return jsonify({"error": str(e)}), 400
 
+    except ErrorCompilacion as e:
+        # Sólo los errores del log, en líneas del texto ingresado
+        app.logger.error(f"Error de compilación capturado: {e}")
+        return jsonify(e.como_dict()), 500
 
+    except RuntimeError as e:
+        # Captura errores específicos de compilación lanzados por compilar_tex_seguro
+        app.logger.error(f"Error de compilación capturado: {e}")
+        return jsonify({"error": str(e)}), 500
+	
+    except Exception as e:
+        app.logger.error(f"Error no manejado en /get/pdf: {e}", exc_info=True)
+        return jsonify({"error": str(e)}), 500
 
+# =========================
+# VISTA PREVIA (sin LaTeX)
+# =========================
+@app.route("/preview", methods=["POST"])
+def preview():
+    """
+    SongPro -> HTML (o texto con ?formato=texto) en el mismo proceso, sin
+    compilar. Acepta el texto como cuerpo plano o como campo 'texto' del form.
+    Un texto con errores da 422 con la misma lista (línea, columna, código)
+    que /get/pdf/.
+    """
+    texto = request.form["texto"] if "texto" in request.form else request.data.decode("utf-8")
+    traza = traza_para_request()
+    try:
+        validar_texto(texto, g.etapas)
+        inicio = time.perf_counter()
+        with g.etapas.medir("parseo"):
+            cancionero = parsear_songpro(texto, traza)
+        g.etapas.datos["canciones"] = sum(len(s.canciones) for s in cancionero.secciones)
+        with g.etapas.medir("vista_previa"):
+            if request.args.get("formato") == "texto":
+                respuesta = Response(vista_previa.renderizar_texto(cancionero), mimetype="text/plain")
+            else:
+                respuesta = Response(vista_previa.renderizar_html(cancionero), mimetype="text/html")
+        if traza is not None:
+            traza.tiempo += time.perf_counter() - inicio
+        return emitir_traza(traza, request.path, respuesta)
 
+    except TextoInvalido as e:
+        return jsonify(e.como_dict()), 422
 
+    except (RuntimeError, ValueError) as e:
+        # Lo que el validador no ve y el parser rechaza
+        return jsonify({"error": str(e)}), 400
 
+# =========================
+# TRABAJOS ASÍNCRONOS
+# =========================
+def procesar_trabajo(id_trabajo, texto, traza=None, paralelo=False, plantilla=None, variante=None):
+    """Corre dentro del pool de compilación: conversión, caché y compilación."""
+    inicio = time.time()
+    estado = almacen_trabajos.actualizar(id_trabajo, estado=trabajos.EJECUTANDO, iniciado=inicio)
+    if estado is None:
+        # Expiró mientras esperaba en la cola
+        return
+    etapas = Etapas()
+    etapas.agregar("espera", inicio - estado["creado"])
+    etapas.datos["bytes_entrada"] = len(texto.encode("utf-8"))
+    resultado = trabajos.FALLIDO
+    try:
+        plantilla = plantilla or registro_plantillas.obtener()
+        with espacios_trabajo.espacio() as temp_dir:
+            archivo_tex = os.path.join(temp_dir, f"cancionero_{id_trabajo}.tex")
+            mapa = MapaFuente()
+            clave_cache = escribir_tex_cancionero(
+                texto, archivo_tex, traza, etapas, mapa, plantilla, variante
+            )
+            partes = partes_paralelas(texto, variante) if paralelo else None
+            if partes:
+                clave_cache = clave_paralela(clave_cache)
+            emitir_traza(traza, f"trabajo {id_trabajo}")
+
+            with etapas.medir("cache"):
+                pdf = cache_pdf.obtener(clave_cache)
+            if pdf is not None:
+                etapas.datos["bytes_pdf"] = os.fstat(pdf.fileno()).st_size
+            else:
+                with etapas.medir("compilacion"):
+                    pdf_file = compilar_pdf_cancionero(
+                        archivo_tex, clave_cache, partes, indices_cancionero(texto), etapas, mapa,
+                        plantilla
+                    )
+                pdf = cache_pdf.abrir(clave_cache) or open(pdf_file, "rb")
+            # Antes de borrar el espacio: el PDF puede estar ahí
+            with pdf:
+                almacen_trabajos.guardar_pdf(id_trabajo, pdf)
+
+        resultado = trabajos.LISTO
+        campos = {"traza": traza.resumen()} if traza is not None else {}
+        almacen_trabajos.actualizar(
+            id_trabajo, estado=trabajos.LISTO, etapas=etapas_trabajo(etapas, inicio),
+            etag=clave_cache, **campos
+        )
 
+    except Exception as e:
+        app.logger.error(f"Error en trabajo {id_trabajo}: {e}")
+        campos = {"errores": e.como_dict()["errores"]} if isinstance(e, ErrorCompilacion) else {}
+        almacen_trabajos.actualizar(
+            id_trabajo, estado=trabajos.FALLIDO, etapas=etapas_trabajo(etapas, inicio), error=str(e),
+            **campos
+        )
 
+    finally:
+        # Fuera de un request: el after_request no lo registra
+        metricas.incrementar("trabajos_total", "Trabajos asíncronos terminados", estado=resultado)
+        metricas.registrar_etapas(etapas, "trabajo")
 
 
+def etapas_trabajo(etapas, inicio):
+    return {**etapas.tiempos, "total": time.time() - inicio}
 
 
+@app.route("/jobs", methods=["POST"])
+def crear_trabajo():
+    texto = request.data.decode("utf-8")
+    try:
+        validar_texto(texto, g.etapas)
+        plantilla = plantilla_para_request()
+        variante = variante_para_request()
+    except TextoInvalido as e:
+        return jsonify(e.como_dict()), 422
+    except plantillas.PlantillaDesconocida as e:
+        return jsonify({"error": str(e), "disponibles": e.disponibles}), 400
+    except VarianteInvalida as e:
+        return jsonify({"error": str(e)}), 400
+    id_trabajo = almacen_trabajos.crear()
+    try:
+        ejecutor_compilacion.enviar(
+            procesar_trabajo, id_trabajo, texto, traza_para_request(), paralelo_para_request(),
+            plantilla, variante
+        )
+    except ColaLlena as e:
+        almacen_trabajos.eliminar(id_trabajo)
+        return respuesta_cola_llena(e)
+
+    url = url_for("estado_trabajo", id_trabajo=id_trabajo)
+    return (
+        jsonify({"id": id_trabajo, "estado": trabajos.EN_COLA, "url": url}),
+        202,
+        {"Location": url},
+    )
+
+
+@app.route("/jobs/<id_trabajo>", methods=["GET"])
+def estado_trabajo(id_trabajo):
+    estado = almacen_trabajos.leer(id_trabajo)
+    if estado is None:
+        return jsonify({"error": "Trabajo no encontrado o expirado."}), 404
+    if estado["estado"] == trabajos.LISTO:
+        estado["pdf"] = url_for("pdf_trabajo", id_trabajo=id_trabajo)
+    return jsonify(estado)
+
+
+@app.route("/jobs/<id_trabajo>/pdf", methods=["GET"])
+def pdf_trabajo(id_trabajo):
+    estado = almacen_trabajos.leer(id_trabajo)
+    if estado is None:
+        return jsonify({"error": "Trabajo no encontrado o expirado."}), 404
+    if estado["estado"] != trabajos.LISTO:
+        return jsonify({"error": "El PDF aún no está disponible.", "estado": estado["estado"]}), 409
+    # Desde la ruta: send_file atiende If-None-Match y Range
+    return send_file(
+        almacen_trabajos.ruta_pdf(id_trabajo),
+        as_attachment=False,
+        mimetype="application/pdf",
+        download_name="cancionero.pdf",
+        etag=estado.get("etag", True),
+    )
+
+
+@app.route("/pdf/<clave>", methods=["GET"])
+def pdf_cacheado(clave):
+    """
+    PDF ya compilado, por su clave (la ETag de las respuestas con PDF, que
+    lo anuncian en Content-Location). Con If-None-Match y Range: un visor
+    puede pedir sólo las páginas que muestra.
+    """
+    if not re.fullmatch(r"[0-9a-f]{64}", clave):
+        return jsonify({"error": "Clave inválida."}), 404
+    if clave in request.if_none_match:
+        return respuesta_pdf(PdfGenerado(None, clave, True))
+    pdf = cache_pdf.abrir(clave)
+    if pdf is None:
+        return jsonify({"error": "PDF no encontrado o desalojado de la caché."}), 404
+    return respuesta_pdf(PdfGenerado(pdf, clave, True))
 
 
+# =========================
+# LOTES
+# =========================
+def error_como_dict(e):
+    """El mismo JSON de error que devuelve /get/pdf/."""
+    if isinstance(e, (TextoInvalido, ErrorCompilacion)):
+        return e.como_dict()
+    if isinstance(e, ColaLlena):
+        return {"error": "Servidor ocupado, reintente en unos segundos."}
+    return {"error": str(e)}
 
 
+def generar_item_lote(item):
+    """
+    generar_pdf_cancionero() para un cancionero del lote. Si la cola está
+    llena se espera lo que ella indica y se reintenta, hasta LOTE_ESPERA_MAXIMA.
+    """
+    limite = time.monotonic() + LOTE_ESPERA_MAXIMA
+    while True:
+        try:
+            return generar_pdf_cancionero(
+                item.texto, None, False, item.extra["etapas"], item.extra["plantilla"],
+                variante=item.extra.get("variante")
+            )
+        except ColaLlena as e:
+            if time.monotonic() + e.reintentar_en > limite:
+                raise
+            time.sleep(e.reintentar_en)
 
 
+@app.route("/lote", methods=["POST"])
+def generar_lote():
+    """
+    Muchos cancioneros -> un ZIP con un PDF (o un .error.json) por cada uno,
+    que se va mandando a medida que terminan (ver lote.py). Entrada:
+    - JSON: [{"nombre": ..., "texto": ..., "plantilla": ...}, ...] o {"nombre": "texto", ...}
+    - multipart: un archivo por cancionero
+    ?plantilla= vale para los que no dicen la suya.
+    """
+    try:
+        if request.files:
+            items = lote.leer_multipart(request.files)
+        else:
+            items = lote.leer_json(request.get_json(force=True, silent=True))
+        por_defecto = plantilla_para_request()
+        for item in items:
+            item.extra["plantilla"] = (
+                registro_plantillas.obtener(item.plantilla) if item.plantilla else por_defecto
+            )
+            item.extra["etapas"] = Etapas()
+    except lote.LoteInvalido as e:
+        return jsonify({"error": str(e)}), 400
+    except plantillas.PlantillaDesconocida as e:
+        return jsonify({"error": str(e), "disponibles": e.disponibles}), 400
+    g.etapas.datos["cancioneros"] = len(items)
+    app.logger.info(f"Lote de {len(items)} cancioneros")
+    return respuesta_zip(items, "lote.zip")
+
+
+def registrar_item_lote(item, ok, segundos):
+    # Fuera del request (el ZIP se manda después): como los trabajos
+    metricas.incrementar("lote_cancioneros_total", "Cancioneros generados en lotes",
+                         estado="ok" if ok else "error")
+    metricas.registrar_etapas(item.extra["etapas"], "lote")
+
+
+def respuesta_zip(items, nombre):
+    """ItemLote (con plantilla y etapas en `extra`) -> ZIP que se manda a medida que terminan."""
+    contenido = lote.zip_en_stream(
+        items,
+        generar_item_lote,
+        error_como_dict,
+        ejecutor_compilacion.concurrencia,
+        registrar_item_lote,
+    )
+    return Response(
+        contenido, mimetype="application/zip",
+        headers={"Content-Disposition": f"attachment; filename={nombre}"},
+    )
+
+
+def respuesta_variantes(texto, variantes, plantilla):
+    """
+    Varias variantes de tono del mismo texto -> ZIP con un PDF por variante.
+    El texto se valida y se parsea una sola vez: cada variante se renderiza
+    desde los árboles de cache_fragmentos y su PDF queda en la caché con su clave.
+    """
+    validar_texto(texto, g.etapas)
+    with g.etapas.medir("parseo"):
+        parsear_songpro(texto)
+    usados = set()
+    items = [
+        lote.ItemLote(
+            lote.nombre_archivo(nombre_pdf(variante)[:-4], usados), texto,
+            extra={"plantilla": plantilla, "etapas": Etapas(), "variante": variante},
+        )
+        for variante in variantes
+    ]
+    g.etapas.datos["variantes"] = len(items)
+    return respuesta_zip(items, "variantes.zip")
 
 
+@app.route("/cache/estadisticas", methods=["GET"])
+def estadisticas_cache():
+    return jsonify({**cache_pdf.estadisticas(), "fragmentos": cache_fragmentos.estadisticas()})
 
+@app.route("/metrics", methods=["GET"])
+def exponer_metricas():
+    return Response(metricas.exponer(), mimetype="text/plain; version=0.0.4")
 
+@app.route("/compilacion/estadisticas", methods=["GET"])
+def estadisticas_compilacion():
+    return jsonify({**ejecutor_compilacion.estadisticas(), "espacios": espacios_trabajo.estadisticas()})
 
 
+if __name__ == "__main__":
+    # Sin gunicorn no hay master que vacíe las fotos de corridas anteriores
+    reiniciar_metricas(directorio_metricas)
+    iniciar_app()
+    port = int(os.environ.get("PORT", "8000"))
+    app.run(host="0.0.0.0", port=port, debug=True, threaded=True)
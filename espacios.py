@@ -0,0 +1,118 @@
+"""
+Directorios de trabajo aislados, uno por compilación.
+
+Cada request (y cada trabajo de /jobs) escribe su .tex, los auxiliares de
+pdflatex, los .idx/.ind y el PDF en un directorio propio que se borra al
+terminar: dos requests simultáneos nunca comparten archivos.
+
+Los directorios se crean en una raíz en RAM (tmpfs, /dev/shm en Linux) para
+que las pasadas de pdflatex no toquen el disco. Un tmpfs ocupa memoria: si
+los espacios activos de este proceso ya ocupan `maximo_bytes`, o al tmpfs le
+quedan menos de `reserva_bytes` libres, el espacio nuevo va a la raíz de
+disco (un desborde). Sin raíz en RAM todo va a disco, como antes.
+"""
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+RAIZ_RAM_POR_DEFECTO = "/dev/shm/cancionero"
+PREFIJO = "espacio_"
+# Espacios huérfanos (worker muerto a mitad de compilación) más viejos que esto se borran
+EDAD_MAXIMA_HUERFANO = 3600
+
+
+def raiz_ram():
+    """RAIZ_RAM_POR_DEFECTO si hay /dev/shm; si no, "" (todo en disco)."""
+    return RAIZ_RAM_POR_DEFECTO if os.path.isdir(os.path.dirname(RAIZ_RAM_POR_DEFECTO)) else ""
+
+
+def _tamano(ruta):
+    total = 0
+    for raiz, _, archivos in os.walk(ruta):
+        for nombre in archivos:
+            try:
+                total += os.lstat(os.path.join(raiz, nombre)).st_size
+            except FileNotFoundError:
+                pass
+    return total
+
+
+class EspaciosTrabajo:
+    """
+    - espacio(): context manager con la ruta de un directorio nuevo y vacío
+    - estadisticas(): espacios activos, en RAM, en disco y desbordes
+    """
+
+    def __init__(self, raiz_ram, raiz_disco, maximo_bytes, reserva_bytes=16 * 1024 * 1024):
+        self.raiz_disco = raiz_disco
+        self.maximo_bytes = maximo_bytes
+        self.reserva_bytes = reserva_bytes
+        self.raiz_ram = None
+        self._lock = threading.Lock()
+        self._activos_ram = set()
+        self._contadores = {"en_ram": 0, "en_disco": 0, "desbordes": 0}
+
+        os.makedirs(raiz_disco, exist_ok=True)
+        if raiz_ram:
+            try:
+                os.makedirs(raiz_ram, exist_ok=True)
+                self.raiz_ram = raiz_ram
+            except OSError as e:
+                logger.warning(f"No se pudo usar {raiz_ram} para compilar; se compila en disco: {e}")
+        for raiz in (self.raiz_ram, self.raiz_disco):
+            if raiz:
+                self._limpiar_huerfanos(raiz)
+
+    def _limpiar_huerfanos(self, raiz):
+        ahora = time.time()
+        for nombre in os.listdir(raiz):
+            ruta = os.path.join(raiz, nombre)
+            try:
+                if nombre.startswith(PREFIJO) and ahora - os.stat(ruta).st_mtime > EDAD_MAXIMA_HUERFANO:
+                    shutil.rmtree(ruta, ignore_errors=True)
+            except OSError:
+                continue
+
+    def _cabe_en_ram(self):
+        if self.raiz_ram is None:
+            return False
+        with self._lock:
+            activos = list(self._activos_ram)
+        if sum(_tamano(ruta) for ruta in activos) >= self.maximo_bytes:
+            return False
+        try:
+            return shutil.disk_usage(self.raiz_ram).free >= self.reserva_bytes
+        except OSError:
+            return False
+
+    @contextmanager
+    def espacio(self):
+        en_ram = self._cabe_en_ram()
+        ruta = tempfile.mkdtemp(prefix=PREFIJO, dir=self.raiz_ram if en_ram else self.raiz_disco)
+        with self._lock:
+            self._contadores["en_ram" if en_ram else "en_disco"] += 1
+            if self.raiz_ram is not None and not en_ram:
+                self._contadores["desbordes"] += 1
+            if en_ram:
+                self._activos_ram.add(ruta)
+        try:
+            yield ruta
+        finally:
+            with self._lock:
+                self._activos_ram.discard(ruta)
+            shutil.rmtree(ruta, ignore_errors=True)
+
+    def estadisticas(self):
+        with self._lock:
+            return {
+                "raiz_ram": self.raiz_ram,
+                "activos_ram": len(self._activos_ram),
+                "maximo_bytes": self.maximo_bytes,
+                **self._contadores,
+            }
@@ -0,0 +1,172 @@
+"""
+Formato LaTeX precompilado (.fmt) con el preámbulo de cada plantilla.
+
+Cargar babel, songs, schemata, geometry, etc. en cada pasada de pdflatex es
+la mayor parte del tiempo de arranque. Aquí se vuelca ese preámbulo una sola
+vez con mylatexformat y las compilaciones usan -fmt. Cada plantilla
+(plantillas.py) tiene el suyo, cuyo nombre lleva la huella de la plantilla
+y de texmf-local, así que cualquier cambio en ellos genera un formato nuevo
+automáticamente.
+
+Uso desde línea de comandos (p.ej. al construir la imagen Docker), genera
+los formatos de todas las plantillas:
+    python formato_tex.py
+"""
+import fcntl
+import hashlib
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+
+from cache_pdf import huella_estilos
+
+logger = logging.getLogger(__name__)
+
+PREFIJO = "cancionero-"
+directorio_formatos = os.environ.get(
+    "FORMATO_TEX_DIR", os.path.join("cache", "formatos")
+)
+# FORMATO_TEX=0 desactiva el formato y compila siempre con el preámbulo completo
+habilitado = os.environ.get("FORMATO_TEX", "1") != "0"
+
+_lock = threading.Lock()
+_version_pdflatex = None
+# huella -> nombre del formato, o None si la construcción falló
+_formatos = {}
+
+
+def version_pdflatex():
+    """Un .fmt sólo sirve para el binario que lo generó."""
+    global _version_pdflatex
+    if _version_pdflatex is None:
+        try:
+            r = subprocess.run(
+                ["pdflatex", "--version"], capture_output=True, text=True
+            )
+            _version_pdflatex = r.stdout.splitlines()[0] if r.stdout else ""
+        except OSError:
+            _version_pdflatex = ""
+    return _version_pdflatex
+
+
+def nombre_formato(plantilla):
+    h = hashlib.sha256(
+        (huella_estilos() + "\0" + plantilla.huella + "\0" + version_pdflatex()).encode("utf-8")
+    )
+    return f"{PREFIJO}{plantilla.nombre}-{h.hexdigest()[:16]}"
+
+
+def construir_formato(nombre, plantilla, directorio=None):
+    """
+    Vuelca el preámbulo de la plantilla (plantillas.Plantilla, hasta
+    \\endofdump) a <nombre>.fmt. Se construye en un directorio temporal y se
+    mueve con os.replace, así un worker nunca ve un formato a medio escribir.
+    Devuelve True si el formato quedó disponible.
+    """
+    directorio = directorio or directorio_formatos
+    os.makedirs(directorio, exist_ok=True)
+    destino = os.path.join(directorio, nombre + ".fmt")
+
+    with open(os.path.join(directorio, ".lock"), "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        if os.path.exists(destino):
+            return True
+
+        with tempfile.TemporaryDirectory(dir=directorio) as tmp:
+            with open(os.path.join(tmp, "preambulo.tex"), "w", encoding="utf-8") as f:
+                f.write(plantilla.texto)
+            result = subprocess.run(
+                [
+                    "pdflatex", "-ini", "-interaction=nonstopmode",
+                    f"-jobname={nombre}",
+                    "&pdflatex", "mylatexformat.ltx", "preambulo.tex",
+                ],
+                capture_output=True, text=True, cwd=tmp
+            )
+            generado = os.path.join(tmp, nombre + ".fmt")
+            if result.returncode != 0 or not os.path.exists(generado):
+                logger.warning(
+                    f"No se pudo generar el formato {nombre}:\n"
+                    + (result.stdout + result.stderr)[-2000:]
+                )
+                return False
+            os.replace(generado, destino)
+
+        # Los formatos de versiones anteriores de esta plantilla ya no se van a usar
+        anteriores = f"{PREFIJO}{plantilla.nombre}-"
+        for archivo in os.listdir(directorio):
+            if archivo.startswith(anteriores) and archivo.endswith(".fmt") \
+                    and archivo != nombre + ".fmt":
+                try:
+                    os.remove(os.path.join(directorio, archivo))
+                except OSError:
+                    pass
+
+    logger.info(f"Formato LaTeX generado: {destino}")
+    return True
+
+
+def asegurar_formato(plantilla):
+    """
+    Devuelve el nombre del formato vigente de la plantilla, construyéndolo si
+    hace falta, o None si está desactivado o no se pudo construir.
+    """
+    if not habilitado:
+        return None
+    try:
+        nombre = nombre_formato(plantilla)
+    except OSError as e:
+        logger.warning(f"No se pudo calcular la huella de la plantilla: {e}")
+        return None
+
+    with _lock:
+        if nombre in _formatos:
+            disponible = _formatos[nombre]
+            if disponible is None or os.path.exists(
+                os.path.join(directorio_formatos, nombre + ".fmt")
+            ):
+                return disponible
+
+        # Sólo se reintenta una vez por huella; si falla se compila sin formato
+        try:
+            construido = construir_formato(nombre, plantilla)
+        except OSError as e:
+            logger.warning(f"No se pudo ejecutar pdflatex -ini: {e}")
+            construido = False
+        _formatos[nombre] = nombre if construido else None
+        return _formatos[nombre]
+
+
+def argumentos_pdflatex(plantilla):
+    """
+    Argumentos extra y entorno para que pdflatex use el formato precompilado
+    de la plantilla. Retorna ([], None) si no hay formato: se compila como siempre.
+    """
+    nombre = asegurar_formato(plantilla)
+    if nombre is None:
+        return [], None
+    env = dict(os.environ)
+    # El separador final conserva la ruta de búsqueda por defecto
+    env["TEXFORMATS"] = os.path.abspath(directorio_formatos) + os.pathsep + env.get("TEXFORMATS", "")
+    return [f"-fmt={nombre}"], env
+
+
+if __name__ == "__main__":
+    import plantillas
+
+    logging.basicConfig(level=logging.INFO)
+    registro = plantillas.RegistroPlantillas(
+        plantillas.ARCHIVO_PRINCIPAL, os.environ.get("PLANTILLAS_DIR", plantillas.DIRECTORIO)
+    )
+    fallidas = []
+    for nombre_plantilla in registro.nombres():
+        nombre = asegurar_formato(registro.obtener(nombre_plantilla))
+        if nombre is None:
+            fallidas.append(nombre_plantilla)
+        else:
+            print(os.path.join(directorio_formatos, nombre + ".fmt"))
+    if fallidas:
+        sys.exit(f"No se generó el formato LaTeX de: {', '.join(fallidas)}")
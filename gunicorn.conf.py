@@ -0,0 +1,40 @@
+"""
+Hooks de gunicorn (lo lee solo desde el directorio de trabajo; el resto de
+la configuración va en el CMD del Dockerfile).
+
+Las métricas de /metrics son fotos que cada worker deja en METRICAS_DIR
+(ver metricas.py); el master las ordena:
+- on_starting: vacía el directorio, las fotos de una corrida anterior no cuentan
+- post_worker_init: el worker arranca la app (directorios, hilos; ver convert.iniciar_app)
+- worker_exit: el worker vuelca su última foto antes de salir
+- child_exit: el master suma la foto del worker que terminó a terminados.json
+"""
+import os
+import sys
+import tempfile
+
+import metricas
+
+
+def _directorio_metricas():
+    return os.environ.get("METRICAS_DIR", os.path.join(tempfile.gettempdir(), "cancionero_metricas"))
+
+
+def on_starting(server):
+    metricas.reiniciar(_directorio_metricas())
+
+
+def post_worker_init(worker):
+    convert = sys.modules.get("convert")
+    if convert is not None:
+        convert.iniciar_app()
+
+
+def worker_exit(server, worker):
+    convert = sys.modules.get("convert")
+    if convert is not None and convert.metricas is not None:
+        convert.metricas.volcar()
+
+
+def child_exit(server, worker):
+    metricas.retirar_worker(_directorio_metricas(), worker.pid)
@@ -0,0 +1,227 @@
+"""
+Índices del cancionero (tema y titleidx) armados en Python, sin makeindex.
+
+Las entradas salen del árbol del parser (songpro.py): cada palabra con '#'
+da 'palabra!Título' en tema y cada canción su título en titleidx. Las
+páginas se toman del .idx que deja la primera pasada de pdflatex, y con eso
+se escribe el .ind que \\printindex lee en la pasada siguiente (la plantilla
+carga imakeidx con noautomatic para que no lance makeindex por su cuenta).
+
+El orden es alfabético sin tildes ni mayúsculas (normalizar), no el orden
+por bytes de makeindex, que deja 'Ángel' después de 'zorro'.
+"""
+import logging
+import os
+import re
+import unicodedata
+
+from songpro import Bloque
+
+logger = logging.getLogger(__name__)
+
+INDICE_TEMAS = 'tema'
+INDICE_TITULOS = 'titleidx'
+NOMBRES_INDICE = (INDICE_TEMAS, INDICE_TITULOS)
+
+# Formato del .ind, el mismo que el estilo por defecto de makeindex
+PREAMBULO_IND = '\\begin{theindex}\n'
+POSTAMBULO_IND = '\n\n\\end{theindex}\n'
+SEPARADOR_GRUPOS = '\n\n  \\indexspace\n'
+ITEMS_IND = ('\n  \\item ', '\n    \\subitem ', '\n      \\subsubitem ')
+# Tres o más páginas seguidas van como rango, igual que en makeindex
+MINIMO_RANGO = 3
+
+# Signos iniciales que no cuentan para ordenar: '¡Gloria!' va en la G
+_RE_SIGNOS_INICIALES = re.compile(r'^[\W_]+')
+
+
+def normalizar(palabra):
+    # Normaliza palabra para ordenar (quita tildes y pasa a minúscula)
+    return ''.join(
+        c for c in unicodedata.normalize('NFD', palabra.lower())
+        if unicodedata.category(c) != 'Mn'
+    )
+
+
+# =========================
+# LECTURA DEL .idx
+# =========================
+def _grupo(texto, inicio):
+    """(contenido, fin) del grupo {...} balanceado que empieza en `inicio`."""
+    if texto[inicio] != '{':
+        raise ValueError(f"Se esperaba '{{' en la posición {inicio}")
+    nivel = 0
+    for pos in range(inicio, len(texto)):
+        caracter = texto[pos]
+        if caracter == '{' and texto[pos - 1] != '\\':
+            nivel += 1
+        elif caracter == '}' and texto[pos - 1] != '\\':
+            nivel -= 1
+            if nivel == 0:
+                return texto[inicio + 1:pos], pos + 1
+    raise ValueError("Grupo sin cerrar")
+
+
+def leer_grupos(texto, inicio, cantidad):
+    """Los `cantidad` grupos {...} seguidos que empiezan en `inicio`."""
+    grupos = []
+    pos = inicio
+    for _ in range(cantidad):
+        while texto[pos] == ' ':
+            pos += 1
+        contenido, pos = _grupo(texto, pos)
+        grupos.append(contenido)
+    return grupos
+
+
+def leer_idx(ruta):
+    """Entradas \\indexentry{clave|hyperpage}{página} de un .idx como (clave, página)."""
+    entradas = []
+    with open(ruta, encoding="utf-8", errors="replace") as f:
+        for linea in f:
+            if not linea.startswith('\\indexentry'):
+                continue
+            try:
+                clave, pagina = leer_grupos(linea, len('\\indexentry'), 2)
+                # hyperref agrega |hyperpage; el .ind lo vuelve a poner
+                if clave.endswith('|hyperpage'):
+                    clave = clave[:-len('|hyperpage')]
+                entradas.append((clave, int(pagina)))
+            except (ValueError, IndexError):
+                logger.warning(f"Entrada de índice ilegible en {ruta}: {linea.strip()}")
+    return entradas
+
+
+# =========================
+# ESCRITURA DEL .ind
+# =========================
+def _orden(texto):
+    return _RE_SIGNOS_INICIALES.sub('', normalizar(texto)) or texto
+
+
+def _grupo_inicial(texto):
+    """Grupo de makeindex: símbolos, después números, después cada letra."""
+    inicial = _orden(texto)[:1]
+    if inicial.isalpha():
+        return 2, inicial
+    if inicial.isdigit():
+        return 1, ''
+    return 0, ''
+
+
+def clave_orden(niveles):
+    return (_grupo_inicial(niveles[0]),) + tuple((_orden(nivel), nivel) for nivel in niveles)
+
+
+def _paginas_ind(paginas):
+    partes = []
+    paginas = sorted(paginas)
+    i = 0
+    while i < len(paginas):
+        j = i
+        while j + 1 < len(paginas) and paginas[j + 1] == paginas[j] + 1:
+            j += 1
+        if j - i + 1 >= MINIMO_RANGO:
+            partes.append(f'\\hyperpage{{{paginas[i]}}}--\\hyperpage{{{paginas[j]}}}')
+        else:
+            partes.extend(f'\\hyperpage{{{p}}}' for p in paginas[i:j + 1])
+        i = j + 1
+    return ', '.join(partes)
+
+
+class Indice:
+    """
+    Las entradas de un índice, cada una como tupla de niveles
+    ('palabra', 'Título'). Las páginas no se guardan: llegan del .idx de
+    cada pasada.
+    """
+    __slots__ = ("nombre", "niveles")
+
+    def __init__(self, nombre):
+        self.nombre = nombre
+        # Clave tal como la escribe \index -> niveles. Desde el árbol no hace
+        # falta partir la clave en '!', así un título con '!' queda entero
+        self.niveles = {}
+
+    def registrar(self, *niveles):
+        self.niveles['!'.join(niveles)] = niveles
+
+    def paginas(self, entradas_idx):
+        """{niveles: {páginas}} de las entradas del .idx."""
+        paginas = {}
+        for clave, pagina in entradas_idx:
+            niveles = self.niveles.get(clave)
+            if niveles is None:
+                # No salió del parser (p. ej. \indexword escrito en la plantilla)
+                niveles = tuple(clave.split('!'))
+            paginas.setdefault(niveles, set()).add(pagina)
+        return paginas
+
+    def renderizar(self, entradas_idx):
+        paginas = self.paginas(entradas_idx)
+        sin_pagina = len(set(self.niveles.values()) - paginas.keys())
+        if sin_pagina:
+            logger.debug(f"Índice {self.nombre}: {sin_pagina} entradas sin página en el .idx")
+
+        salida = [PREAMBULO_IND]
+        grupo_anterior = None
+        anterior = ()
+        for niveles in sorted(paginas, key=clave_orden):
+            grupo = _grupo_inicial(niveles[0])
+            if grupo_anterior is not None and grupo != grupo_anterior:
+                salida.append(SEPARADOR_GRUPOS)
+            grupo_anterior = grupo
+            # Los niveles compartidos con la entrada anterior no se repiten
+            for nivel, texto in enumerate(niveles[:len(ITEMS_IND)]):
+                if niveles[:nivel + 1] != anterior[:nivel + 1]:
+                    salida.append(ITEMS_IND[nivel] + texto)
+            salida.append(', ' + _paginas_ind(paginas[niveles]))
+            anterior = niveles
+        salida.append(POSTAMBULO_IND)
+        return ''.join(salida)
+
+
+class IndicesCancionero:
+    """Los índices tema y titleidx de un cancionero."""
+    __slots__ = ("indices",)
+
+    def __init__(self):
+        self.indices = {nombre: Indice(nombre) for nombre in NOMBRES_INDICE}
+
+    @classmethod
+    def desde_cancionero(cls, cancionero):
+        """
+        Entradas tomadas del árbol. Los bloques fuera de una canción indexan
+        con el título de la anterior, igual que en el render LaTeX.
+        """
+        resultado = cls()
+        temas = resultado.indices[INDICE_TEMAS]
+        titulos = resultado.indices[INDICE_TITULOS]
+        titulo = ""
+
+        def registrar_palabras(elementos):
+            for elemento in elementos:
+                if not isinstance(elemento, Bloque):
+                    continue
+                for linea in elemento.lineas:
+                    for palabra in linea.palabras or ():
+                        if palabra.__class__ is not str and palabra.indice is not None:
+                            temas.registrar(palabra.indice, titulo)
+
+        for seccion in cancionero.secciones:
+            registrar_palabras(seccion.elementos)
+            for cancion in seccion.canciones:
+                titulo = cancion.titulo
+                titulos.registrar(titulo)
+                registrar_palabras(cancion.elementos)
+        return resultado
+
+    def escribir(self, tex_dir, nombre):
+        """
+        Lee <nombre>.idx de tex_dir y escribe <nombre>.ind.
+        Devuelve la cantidad de entradas leídas.
+        """
+        entradas = leer_idx(os.path.join(tex_dir, nombre + ".idx"))
+        with open(os.path.join(tex_dir, nombre + ".ind"), "w", encoding="utf-8") as f:
+            f.write(self.indices[nombre].renderizar(entradas))
+        return len(entradas)
@@ -0,0 +1,227 @@
+"""
+Render LaTeX (paquete songs) de un Cancionero ya parseado (songpro.py).
+
+- renderizar_stream(cancionero): trozos de LaTeX, uno por canción o sección
+- renderizar(cancionero): el documento de canciones completo
+
+Unir los trozos con '\\n' da exactamente lo que producía el parser original,
+más una entrada \\index[titleidx] por canción para el índice de títulos
+(indice_titulos=False la omite).
+
+Con una lista en `mapa`, el render agrega por cada línea LaTeX que produce
+el rango (primera, última) de líneas del texto SongPro que la generaron, o
+None si no sale de ninguna (\\end{songs}). Ver mapa_fuente.py.
+
+Con una Variante el mismo árbol se renderiza en otro tono: su desplazamiento
+se suma a la transposición de cada canción (el '=+N' del título). Con capo
+los acordes bajan esos semitonos (la forma que se toca con la cejilla) y
+cada canción lleva la nota "Capo N".
+"""
+import re
+from dataclasses import dataclass
+
+from songpro import Bloque
+
+ENTORNOS_BLOQUE = {
+    'verse':  ('\\beginverse',  '\\endverse'),
+    'chorus': ('\\beginchorus', '\\endchorus'),
+    'melody': ('\\beginverse',  '\\endverse'),
+}
+
+DIAGRAMAS_BLOQUE = {
+    'verse':  'A',
+    'chorus': 'B',
+    'melody': 'C',
+}
+
+MAXIMO_SEMITONOS = 12
+MAXIMO_CAPO = 12
+_RE_VARIANTE = re.compile(r'([+-]?\d+)?(?:capo(\d+))?', re.I)
+
+
+@dataclass(frozen=True, slots=True)
+class Variante:
+    """Transposición global del cancionero y/o capo; Variante() es el original."""
+    semitonos: int = 0
+    capo: int = 0
+
+    def __post_init__(self):
+        if abs(self.semitonos) > MAXIMO_SEMITONOS:
+            raise ValueError(f"La transposición va de -{MAXIMO_SEMITONOS} a +{MAXIMO_SEMITONOS} semitonos")
+        if not 0 <= self.capo <= MAXIMO_CAPO:
+            raise ValueError(f"El capo va de 0 a {MAXIMO_CAPO}")
+
+    @property
+    def desplazamiento(self):
+        """Semitonos que se suman a la transposición de cada canción."""
+        return self.semitonos - self.capo
+
+    @property
+    def nombre(self):
+        """'' para el original; si no, p. ej. '+2', '-1', 'capo3' o '+2capo3'."""
+        return (f"{self.semitonos:+d}" if self.semitonos else "") + (f"capo{self.capo}" if self.capo else "")
+
+
+def leer_variante(texto):
+    """'+2', '-1', 'capo3', '+2capo3' o '0' -> Variante. Lanza ValueError si no se entiende."""
+    m = _RE_VARIANTE.fullmatch(texto.strip())
+    if m is None or not texto.strip():
+        raise ValueError(f"Variante inválida '{texto}' (p. ej. '+2', '-1', 'capo3' o '+2capo3')")
+    return Variante(int(m.group(1) or 0), int(m.group(2) or 0))
+
+
+def escape_latex_raw(linea):
+    """
+    Escapa caracteres especiales de LaTeX
+    SOLO para la sección N (RAW)
+    """
+    replacements = {
+        '#': r'\#',
+        '%': r'\%',
+        '&': r'\&',
+        '_': r'\_',
+        '{': r'\{',
+        '}': r'\}',
+    }
+    for k, v in replacements.items():
+        linea = linea.replace(k, v)
+    return linea
+
+
+def renderizar_palabra(palabra, titulo_cancion, semitonos=0, indice_nombre="tema"):
+    resultado = palabra.inicio
+    for ancla in palabra.anclas:
+        acorde = ancla.acorde.transportar(semitonos).replace("#", r"\#")
+        resultado += f"\\[{acorde}]" + ancla.texto
+
+    # --- envolver índice SOLO UNA VEZ ---
+    if palabra.indice is not None:
+        resultado = (
+            r"\textbf{"
+            + resultado
+            + rf"\protect\index[{indice_nombre}]{{{palabra.indice}!{titulo_cancion}}}"
+            + "}"
+        )
+    return resultado
+
+
+def renderizar_linea(linea, titulo_cancion, semitonos=0):
+    if linea.palabras is None:
+        return linea.texto.replace('_', '')
+    return ' '.join(
+        p if p.__class__ is str else renderizar_palabra(p, titulo_cancion, semitonos)
+        for p in linea.palabras
+    )
+
+
+def renderizar_elemento(elemento, titulo_cancion, semitonos, resultado):
+    """Agrega a `resultado` las líneas LaTeX de un Bloque o BloqueRaw."""
+    if not isinstance(elemento, Bloque):
+        resultado.append(r'\\'.join(escape_latex_raw(l) for l in elemento.lineas) + r'\\')
+        resultado.append('')
+        return
+
+    begin, end = ENTORNOS_BLOQUE[elemento.tipo]
+    # Todo el verso con acordes ya formateados
+    contenido_songs = ' \\\\'.join(
+        renderizar_linea(l, titulo_cancion, semitonos) for l in elemento.lineas
+    )
+    resultado.extend([
+        begin,
+        r"\medskip",
+        fr"\diagram{{{DIAGRAMAS_BLOQUE[elemento.tipo]}}}{{{contenido_songs}}}",
+        end,
+        r"\medskip",
+    ])
+
+
+def mapear(mapa, resultado, desde, rango):
+    """Las líneas agregadas a `resultado` a partir de `desde` salen de `rango`."""
+    if mapa is not None:
+        mapa.extend([rango] * (len(resultado) - desde))
+
+
+def renderizar_elementos(elementos, titulo_cancion, semitonos, resultado, mapa=None):
+    for elemento in elementos:
+        desde = len(resultado)
+        renderizar_elemento(elemento, titulo_cancion, semitonos, resultado)
+        mapear(mapa, resultado, desde, (elemento.linea, elemento.fin))
+
+
+def renderizar_cancion(cancion, resultado, indice_titulos=True, mapa=None, variante=None):
+    """Agrega a `resultado` las líneas LaTeX de una canción completa."""
+    desde = len(resultado)
+    resultado.append(r'\beginsong{' + cancion.titulo + '}')
+    if indice_titulos:
+        # Página del título para titleidx (ver indices.py)
+        resultado.append(r'\index[titleidx]{' + cancion.titulo + '}')
+    semitonos = cancion.transposicion
+    if variante is not None:
+        semitonos += variante.desplazamiento
+        if variante.capo:
+            resultado.append(r'\musicnote{Capo ' + str(variante.capo) + '}')
+    mapear(mapa, resultado, desde, (cancion.linea, cancion.linea))
+    renderizar_elementos(cancion.elementos, cancion.titulo, semitonos, resultado, mapa)
+    desde = len(resultado)
+    resultado.append(r'\endsong')
+    resultado.append('')
+    mapear(mapa, resultado, desde, (cancion.linea, cancion.linea))
+
+
+def abrir_seccion(titulo, resultado, mapa=None, linea=0):
+    desde = len(resultado)
+    resultado.extend([
+        r'\songchapter{' + titulo + '}',
+        r'\begin{songs}{titleidx}'
+    ])
+    mapear(mapa, resultado, desde, (linea, linea))
+
+
+def cerrar_seccion(resultado, mapa=None):
+    desde = len(resultado)
+    resultado.append(r'\end{songs}')
+    resultado.append('')
+    mapear(mapa, resultado, desde, None)
+
+
+def renderizar_stream(cancionero, indice_titulos=True, mapa=None, variante=None):
+    """
+    Entrega el LaTeX por trozos (uno por canción o sección) en vez de armar
+    el documento completo en memoria. `variante` (Variante) cambia el tono.
+    """
+    resultado = []
+    desplazamiento = variante.desplazamiento if variante is not None else 0
+    # Título y transposición de la última canción abierta: los bloques que
+    # quedan fuera de una canción usan los de la anterior, como siempre
+    titulo_cancion, transposicion = "", desplazamiento
+    seccion_abierta = False
+
+    for seccion in cancionero.secciones:
+        if seccion.titulo is not None:
+            if seccion_abierta:
+                cerrar_seccion(resultado, mapa)
+            if resultado:
+                yield '\n'.join(resultado)
+                resultado.clear()
+            seccion_abierta = True
+            abrir_seccion(seccion.titulo, resultado, mapa, seccion.linea)
+
+        renderizar_elementos(seccion.elementos, titulo_cancion, transposicion, resultado, mapa)
+
+        for cancion in seccion.canciones:
+            if resultado:
+                yield '\n'.join(resultado)
+                resultado.clear()
+            titulo_cancion, transposicion = cancion.titulo, cancion.transposicion + desplazamiento
+            renderizar_cancion(cancion, resultado, indice_titulos, mapa, variante)
+
+    if seccion_abierta:
+        resultado.append(r'\end{songs}')
+        mapear(mapa, resultado, len(resultado) - 1, None)
+
+    if resultado:
+        yield '\n'.join(resultado)
+
+
+def renderizar(cancionero, indice_titulos=True, variante=None):
+    return '\n'.join(renderizar_stream(cancionero, indice_titulos, variante=variante))
@@ -0,0 +1,195 @@
+"""
+Lotes: muchos cancioneros en un solo request, devueltos en un ZIP.
+
+El ZIP se arma y se manda a medida que cada PDF termina (no espera al
+último ni lo guarda entero en memoria). Por cada cancionero va:
+- <nombre>.pdf si salió bien
+- <nombre>.error.json con el error (mismo JSON que /get/pdf/) si no
+y al final resumen.json con el estado, tiempo y tamaño de cada uno.
+
+Cada cancionero pasa por la misma generación que /get/pdf/ (una función
+`generar(item)` que devuelve un PdfGenerado); acá sólo se reparte y se empaqueta.
+"""
+import json
+import re
+import threading
+import time
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from typing import Optional
+
+# Tope de cancioneros por lote
+MAXIMO_ITEMS = 100
+# Bloques de copia del PDF al ZIP: cada uno sale al cliente apenas se escribe
+TAMANO_BLOQUE = 256 * 1024
+
+_RE_NO_VALIDO = re.compile(r'[^A-Za-z0-9._+ -]+')
+
+
+class LoteInvalido(ValueError):
+    """El cuerpo del request no es un lote válido (HTTP 400)."""
+
+
+@dataclass(slots=True)
+class ItemLote:
+    nombre: str
+    texto: str
+    # Nombre de plantilla pedido para este cancionero, o None
+    plantilla: Optional[str] = None
+    # Lo que necesite quien genera (p. ej. la Plantilla ya resuelta)
+    extra: dict = field(default_factory=dict)
+
+
+def nombre_archivo(nombre, usados):
+    """Nombre seguro dentro del ZIP (sin rutas), único entre `usados`."""
+    base = _RE_NO_VALIDO.sub('_', nombre).strip(' ._')[:80] or "cancionero"
+    if base.lower().endswith('.pdf'):
+        base = base[:-4] or "cancionero"
+    candidato, n = base, 1
+    while candidato.lower() in usados:
+        n += 1
+        candidato = f"{base}-{n}"
+    usados.add(candidato.lower())
+    return candidato
+
+
+def _items(pares):
+    usados = set()
+    items = []
+    for n, (nombre, texto, plantilla) in enumerate(pares, 1):
+        if not isinstance(texto, str):
+            raise LoteInvalido(f"El cancionero {n} no tiene texto")
+        items.append(ItemLote(nombre_archivo(str(nombre or f"cancionero-{n}"), usados), texto, plantilla))
+    if not items:
+        raise LoteInvalido("El lote no tiene cancioneros")
+    if len(items) > MAXIMO_ITEMS:
+        raise LoteInvalido(f"El lote tiene {len(items)} cancioneros; el máximo es {MAXIMO_ITEMS}")
+    return items
+
+
+def leer_json(datos):
+    """
+    {"cancioneros": [{"nombre": ..., "texto": ..., "plantilla": ...}, ...]},
+    la lista sola, o {"nombre": "texto", ...}.
+    """
+    if isinstance(datos, dict) and "cancioneros" in datos:
+        datos = datos["cancioneros"]
+    if isinstance(datos, dict):
+        return _items((nombre, texto, None) for nombre, texto in datos.items())
+    if isinstance(datos, list) and all(isinstance(d, dict) for d in datos):
+        return _items((d.get("nombre"), d.get("texto"), d.get("plantilla")) for d in datos)
+    raise LoteInvalido("Se esperaba una lista de cancioneros con 'nombre' y 'texto'")
+
+
+def leer_multipart(archivos):
+    """Un cancionero por archivo subido (werkzeug FileStorage); el nombre sale del archivo."""
+    pares = []
+    for campo, archivo in archivos.items(multi=True):
+        try:
+            texto = archivo.read().decode("utf-8")
+        except UnicodeDecodeError:
+            raise LoteInvalido(f"El archivo '{archivo.filename or campo}' no está en UTF-8")
+        nombre = re.sub(r'\.(txt|song|pro)$', '', archivo.filename or campo, flags=re.I)
+        pares.append((nombre, texto, None))
+    return _items(pares)
+
+
+class _Salida:
+    """Destino no posicionable del ZipFile: junta lo escrito hasta que se entrega."""
+
+    def __init__(self):
+        self._trozos = []
+
+    def write(self, datos):
+        self._trozos.append(bytes(datos))
+        return len(datos)
+
+    def flush(self):
+        pass
+
+    def vaciar(self):
+        datos = b"".join(self._trozos)
+        self._trozos.clear()
+        return datos
+
+
+def zip_en_stream(items, generar, describir_error, concurrencia, al_terminar=None):
+    """
+    Genera los bytes del ZIP. Hasta `concurrencia` cancioneros a la vez;
+    cada uno entra al ZIP apenas termina, en el orden en que terminan.
+    - generar(item) -> PdfGenerado (archivo abierto y cerrar())
+    - describir_error(excepción) -> dict para el .error.json
+    - al_terminar(item, ok, segundos): opcional, p. ej. para métricas
+    Si el cliente corta, los pendientes se cancelan y los PDFs ya
+    generados se liberan igual.
+    """
+    salida = _Salida()
+    zf = zipfile.ZipFile(salida, "w", zipfile.ZIP_STORED)
+    resumen = []
+    cancelado = threading.Event()
+
+    def tarea(item):
+        if cancelado.is_set():
+            return None, None, 0.0
+        inicio = time.perf_counter()
+        try:
+            return generar(item), None, time.perf_counter() - inicio
+        except Exception as e:
+            return None, e, time.perf_counter() - inicio
+
+    pool = ThreadPoolExecutor(max_workers=max(1, concurrencia), thread_name_prefix="lote")
+    pendientes = {pool.submit(tarea, item): item for item in items}
+    try:
+        while pendientes:
+            listos, _ = wait(pendientes, return_when=FIRST_COMPLETED)
+            for futuro in listos:
+                item = pendientes.pop(futuro)
+                pdf, error, segundos = futuro.result()
+                entrada = {"nombre": item.nombre, "segundos": round(segundos, 3)}
+                if error is None:
+                    try:
+                        info = zipfile.ZipInfo(item.nombre + ".pdf", time.localtime()[:6])
+                        with zf.open(info, "w") as destino:
+                            while True:
+                                bloque = pdf.archivo.read(TAMANO_BLOQUE)
+                                if not bloque:
+                                    break
+                                destino.write(bloque)
+                                yield salida.vaciar()
+                    finally:
+                        pdf.cerrar()
+                    entrada.update(estado="ok", archivo=info.filename, bytes=info.file_size)
+                else:
+                    detalle = describir_error(error)
+                    archivo = item.nombre + ".error.json"
+                    zf.writestr(archivo, json.dumps(detalle, ensure_ascii=False, indent=1))
+                    entrada.update(estado="error", archivo=archivo, error=detalle.get("error"))
+                resumen.append(entrada)
+                if al_terminar is not None:
+                    al_terminar(item, error is None, segundos)
+                yield salida.vaciar()
+
+        zf.writestr("resumen.json", json.dumps({
+            "total": len(resumen),
+            "ok": sum(1 for e in resumen if e["estado"] == "ok"),
+            "errores": sum(1 for e in resumen if e["estado"] == "error"),
+            "cancioneros": resumen,
+        }, ensure_ascii=False, indent=1))
+        zf.close()
+        yield salida.vaciar()
+    finally:
+        # Cliente desconectado (GeneratorExit) o error: no se empieza nada más
+        cancelado.set()
+        for futuro in pendientes:
+            futuro.cancel()
+        pool.shutdown(wait=False)
+        for futuro in pendientes:
+            if not futuro.cancelled():
+                futuro.add_done_callback(_liberar)
+
+
+def _liberar(futuro):
+    pdf = futuro.result()[0]
+    if pdf is not None:
+        pdf.cerrar()
@@ -0,0 +1,123 @@
+"""
+Mapa de fuente: de las líneas del .tex generado a las del texto SongPro.
+
+Cuando pdflatex falla, su log trae cada error como una línea '! mensaje'
+seguida (unas líneas más abajo) de 'l.NNN contexto', con NNN la línea del
+.tex. error_compilacion() saca sólo eso del log, lo lleva a líneas del
+texto con el MapaFuente y junta los repetidos: el usuario recibe unas pocas
+líneas en vez del log completo.
+
+El mapa lo llena el render (latex_cancionero, cache_fragmentos) mientras
+escribe el .tex: un rango por línea generada, con la granularidad de los
+bloques (todo un bloque V/CH/M va en una sola línea \\diagram del .tex).
+"""
+import re
+from dataclasses import asdict, dataclass
+from typing import Optional, Tuple
+
+# Errores informados como máximo; del resto sólo se dice cuántos son
+MAXIMO_ERRORES = 20
+# Largo máximo del contexto citado de cada error (el final, donde TeX se detuvo)
+LARGO_CONTEXTO = 40
+MENSAJE = "Error de sintaxis en el texto ingresado"
+# Consecuencias de otro error: sólo se informan si no hay nada más
+_ARRASTRE = ("Emergency stop.",)
+
+_RE_REFERENCIA = re.compile(r'l\.(\d+)(?: (.*))?$')
+
+
+class MapaFuente:
+    """
+    - desplazamiento: líneas del .tex antes de la primera canción (cabeza de la plantilla)
+    - rangos: (primera, última) línea del SongPro, o None, por cada línea generada
+    """
+    __slots__ = ("desplazamiento", "rangos")
+
+    def __init__(self, desplazamiento=0):
+        self.desplazamiento = desplazamiento
+        self.rangos = []
+
+    def fuente(self, linea_tex):
+        """Rango de líneas del SongPro de la línea `linea_tex` del .tex (desde 1), o None."""
+        i = linea_tex - 1 - self.desplazamiento
+        return self.rangos[i] if 0 <= i < len(self.rangos) else None
+
+
+@dataclass(slots=True)
+class ErrorLatex:
+    mensaje: str
+    linea_tex: Optional[int] = None
+    # (primera, última) línea del texto SongPro, si la línea del .tex sale de él
+    lineas: Optional[Tuple[int, int]] = None
+    contexto: str = ""
+
+    def como_dict(self):
+        return asdict(self)
+
+    def __str__(self):
+        if self.lineas is not None:
+            primera, ultima = self.lineas
+            donde = f"Línea {primera}" if primera == ultima else f"Líneas {primera}-{ultima}"
+        elif self.linea_tex is not None:
+            donde = f"Línea {self.linea_tex} del LaTeX"
+        else:
+            donde = "LaTeX"
+        cerca = f" (cerca de '{self.contexto}')" if self.contexto else ""
+        return f"{donde}: {self.mensaje}{cerca}"
+
+
+class ErrorCompilacion(RuntimeError):
+    """pdflatex falló; `errores` son los ErrorLatex ya sin repetidos."""
+
+    def __init__(self, errores, omitidos=0):
+        self.errores = errores
+        self.omitidos = omitidos
+        lineas = [MENSAJE] + [str(e) for e in errores]
+        if omitidos:
+            lineas.append(f"... y {omitidos} {'error' if omitidos == 1 else 'errores'} más")
+        super().__init__("\n".join(lineas))
+
+    def como_dict(self):
+        return {
+            "error": MENSAJE,
+            "errores": [e.como_dict() for e in self.errores],
+            "omitidos": self.omitidos,
+        }
+
+
+def leer_errores_log(log):
+    """ErrorLatex (sin mapear) por cada línea '! ...' del log, en orden."""
+    errores = []
+    actual = None
+    for linea in log.splitlines():
+        if linea.startswith('! '):
+            actual = ErrorLatex(linea[2:].strip())
+            errores.append(actual)
+        elif actual is not None and actual.linea_tex is None:
+            # La primera referencia l.NNN después del '!' es la de ese error
+            m = _RE_REFERENCIA.match(linea)
+            if m:
+                actual.linea_tex = int(m.group(1))
+                actual.contexto = (m.group(2) or "").strip()[-LARGO_CONTEXTO:]
+    return errores
+
+
+def error_compilacion(log, mapa=None, respaldo=MENSAJE, maximo=MAXIMO_ERRORES):
+    """
+    ErrorCompilacion con los errores del log llevados al texto con `mapa`,
+    sin repetidos. Si el log no trae ninguno, un único error con `respaldo`.
+    """
+    errores = []
+    vistos = set()
+    for error in leer_errores_log(log):
+        if mapa is not None and error.linea_tex is not None:
+            error.lineas = mapa.fuente(error.linea_tex)
+        clave = (error.mensaje, error.lineas or error.linea_tex)
+        if clave not in vistos:
+            vistos.add(clave)
+            errores.append(error)
+    if any(e.mensaje not in _ARRASTRE for e in errores):
+        errores = [e for e in errores if e.mensaje not in _ARRASTRE]
+    if not errores:
+        errores = [ErrorLatex(respaldo)]
+    return ErrorCompilacion(errores[:maximo], max(len(errores) - maximo, 0))
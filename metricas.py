@@ -0,0 +1,407 @@
+"""
+Tiempos por etapa de cada request y métricas agregadas para /metrics.
+
+- Etapas: cronómetro de UN request (conversión, cola, cada pasada de
+  pdflatex, índices, lectura del PDF...). Va en el header Server-Timing.
+- Metricas: contadores e histogramas del proceso, expuestos en el formato
+  de texto de Prometheus.
+
+Cada worker de gunicorn acumula en memoria y vuelca su foto a
+<directorio>/<pid>-<instancia>.json (reescritura atómica, como trabajos.py)
+cada pocos segundos, al responder /metrics y al salir; no en cada request.
+/metrics suma las fotos de todos los workers, así cualquiera responde por
+el total. Las estadísticas en vivo (cachés, pool) van por worker, con la
+etiqueta worker, y sólo de los procesos que siguen vivos.
+
+El master de gunicorn (gunicorn.conf.py) vacía el directorio al arrancar
+(reiniciar) y, cuando un worker muere, suma su foto a terminados.json y la
+borra (retirar_worker): los contadores no bajan aunque el PID se reuse.
+"""
+import atexit
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+CUBETAS_SEGUNDOS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+CUBETAS_BYTES = (1e3, 1e4, 1e5, 1e6, 1e7, 1e8)
+CUBETAS_CANCIONES = (1, 5, 10, 25, 50, 100, 250, 500, 1000)
+
+# Suma de las fotos de los workers que ya terminaron
+ARCHIVO_TERMINADOS = "terminados.json"
+
+_RE_NOMBRE_INVALIDO = re.compile(r'[^a-zA-Z0-9_]')
+
+
+# =========================
+# ETAPAS DE UN REQUEST
+# =========================
+class Etapas:
+    """
+    Segundos por etapa de un request, en el orden en que ocurrieron (una
+    etapa que se repite suma). `datos` guarda tamaños y cantidades.
+    Se pasa explícito al pool de compilación: el hilo que compila no tiene
+    el contexto del request.
+    """
+    __slots__ = ("tiempos", "datos")
+
+    def __init__(self):
+        self.tiempos = {}
+        self.datos = {}
+
+    def agregar(self, nombre, segundos):
+        self.tiempos[nombre] = self.tiempos.get(nombre, 0.0) + segundos
+
+    @contextmanager
+    def medir(self, nombre):
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.agregar(nombre, time.perf_counter() - inicio)
+
+    def server_timing(self, total=None):
+        """Valor del header Server-Timing (milisegundos)."""
+        partes = [f"{nombre};dur={segundos * 1000:.1f}" for nombre, segundos in self.tiempos.items()]
+        if total is not None:
+            partes.append(f"total;dur={total * 1000:.1f}")
+        return ", ".join(partes)
+
+
+# =========================
+# AGREGADOS DEL PROCESO
+# =========================
+def _etiquetas(etiquetas):
+    return tuple(sorted((str(k), str(v)) for k, v in etiquetas.items()))
+
+
+def _nombre_metrica(nombre):
+    return _RE_NOMBRE_INVALIDO.sub('_', nombre)
+
+
+def _valor_etiqueta(valor):
+    return valor.replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def _formato_etiquetas(etiquetas):
+    if not etiquetas:
+        return ''
+    return '{' + ','.join(f'{k}="{_valor_etiqueta(v)}"' for k, v in etiquetas) + '}'
+
+
+def _numero(valor):
+    # Sin notación corta: los contadores grandes no pierden dígitos
+    if isinstance(valor, float) and valor.is_integer():
+        return str(int(valor))
+    return repr(valor)
+
+
+def _leer_json(ruta):
+    with open(ruta, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _escribir_json(directorio, nombre, datos):
+    fd, temporal = tempfile.mkstemp(dir=directorio, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(datos, f)
+        os.replace(temporal, os.path.join(directorio, nombre))
+    except BaseException:
+        try:
+            os.unlink(temporal)
+        except OSError:
+            pass
+        raise
+
+
+def _sumar(acumulado, foto):
+    """Suma los contadores e histogramas de `foto` a `acumulado` (mismo formato)."""
+    acumulado["ayuda"].update(foto["ayuda"])
+    contadores = {(n, tuple(map(tuple, e))): [n, e, v] for n, e, v in acumulado["contadores"]}
+    for nombre, etiquetas, valor in foto["contadores"]:
+        clave = (nombre, tuple(map(tuple, etiquetas)))
+        if clave in contadores:
+            contadores[clave][2] += valor
+        else:
+            contadores[clave] = [nombre, etiquetas, valor]
+    histogramas = {(n, tuple(map(tuple, e))): [n, e, h] for n, e, h in acumulado["histogramas"]}
+    for nombre, etiquetas, (cubetas, conteos, suma, cuenta) in foto["histogramas"]:
+        clave = (nombre, tuple(map(tuple, etiquetas)))
+        if clave not in histogramas:
+            histogramas[clave] = [nombre, etiquetas, [cubetas, list(conteos), suma, cuenta]]
+            continue
+        h = histogramas[clave][2]
+        h[1] = [a + b for a, b in zip(h[1], conteos)]
+        h[2] += suma
+        h[3] += cuenta
+    acumulado["contadores"] = list(contadores.values())
+    acumulado["histogramas"] = list(histogramas.values())
+
+
+def reiniciar(directorio):
+    """Vacía el directorio de fotos. Una vez, al arrancar el master, antes de los workers."""
+    os.makedirs(directorio, exist_ok=True)
+    for archivo in os.listdir(directorio):
+        if archivo.endswith((".json", ".tmp")):
+            try:
+                os.unlink(os.path.join(directorio, archivo))
+            except OSError:
+                pass
+
+
+def retirar_worker(directorio, pid):
+    """
+    Suma a terminados.json las fotos del worker `pid`, que ya terminó, y las
+    borra. Sólo desde el master (child_exit): es el único que escribe
+    terminados.json. La foto se anota como incluida antes de borrarla, así
+    quien lea a la vez no la cuenta dos veces.
+    """
+    prefijo = f"{pid}-"
+    propias = [a for a in os.listdir(directorio) if a.startswith(prefijo) and a.endswith(".json")]
+    if not propias:
+        return
+    ruta_terminados = os.path.join(directorio, ARCHIVO_TERMINADOS)
+    try:
+        terminados = _leer_json(ruta_terminados)
+    except (OSError, ValueError):
+        terminados = {"ayuda": {}, "contadores": [], "histogramas": [], "incluidos": []}
+    for archivo in propias:
+        try:
+            foto = _leer_json(os.path.join(directorio, archivo))
+        except (OSError, ValueError):
+            continue
+        if foto["id"] not in terminados["incluidos"]:
+            _sumar(terminados, foto)
+            terminados["incluidos"].append(foto["id"])
+    try:
+        _escribir_json(directorio, ARCHIVO_TERMINADOS, terminados)
+        for archivo in propias:
+            os.unlink(os.path.join(directorio, archivo))
+    except OSError as e:
+        logger.warning(f"No se pudieron retirar las métricas del worker {pid}: {e}")
+
+
+def _vivo(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class Metricas:
+    """
+    - incrementar() / observar(): contadores e histogramas del proceso
+    - registrar_request(): todo lo de un request (duración, etapas, tamaños)
+    - agregar_fuente(): estadísticas en vivo (dict de números) que se leen al volcar
+    - volcar() / exponer(): foto en disco del worker / texto para /metrics
+    - iniciar_volcado(): vuelca cada `intervalo` segundos si hubo cambios, y al salir
+    """
+
+    def __init__(self, directorio, prefijo="cancionero"):
+        self.directorio = directorio
+        self.prefijo = prefijo
+        self._lock = threading.Lock()
+        self._contadores = {}    # (nombre, etiquetas) -> valor
+        self._histogramas = {}   # (nombre, etiquetas) -> [cubetas, conteos, suma, cuenta]
+        self._ayuda = {}
+        self._fuentes = {}
+        self._cambios = False
+        self._volcado = None
+        # Distingue a este proceso de otro que reciba el mismo PID más adelante
+        self._pid = self._instancia = None
+        os.makedirs(directorio, exist_ok=True)
+
+    @property
+    def id(self):
+        # Se calcula en el proceso que vuelca: con --preload, cada worker hereda el objeto
+        pid = os.getpid()
+        if pid != self._pid:
+            self._pid = pid
+            self._instancia = uuid.uuid4().hex[:12]
+        return f"{pid}-{self._instancia}"
+
+    def incrementar(self, nombre, ayuda, valor=1, **etiquetas):
+        clave = (nombre, _etiquetas(etiquetas))
+        with self._lock:
+            self._ayuda.setdefault(nombre, ayuda)
+            self._contadores[clave] = self._contadores.get(clave, 0) + valor
+            self._cambios = True
+
+    def observar(self, nombre, ayuda, valor, cubetas=CUBETAS_SEGUNDOS, **etiquetas):
+        clave = (nombre, _etiquetas(etiquetas))
+        with self._lock:
+            self._ayuda.setdefault(nombre, ayuda)
+            histograma = self._histogramas.get(clave)
+            if histograma is None:
+                histograma = self._histogramas[clave] = [list(cubetas), [0] * len(cubetas), 0.0, 0]
+            for i, limite in enumerate(histograma[0]):
+                if valor <= limite:
+                    histograma[1][i] += 1
+            histograma[2] += valor
+            histograma[3] += 1
+            self._cambios = True
+
+    def agregar_fuente(self, nombre, funcion):
+        """`funcion()` -> dict de números; cada clave sale como <prefijo>_<nombre>_<clave>."""
+        self._fuentes[nombre] = funcion
+
+    def registrar_etapas(self, etapas, ruta):
+        for nombre, segundos in etapas.tiempos.items():
+            self.observar("etapa_segundos", "Duración de cada etapa", segundos, ruta=ruta, etapa=nombre)
+        if "bytes_entrada" in etapas.datos:
+            self.observar("entrada_bytes", "Tamaño del texto recibido",
+                          etapas.datos["bytes_entrada"], CUBETAS_BYTES, ruta=ruta)
+        if "canciones" in etapas.datos:
+            self.observar("canciones", "Canciones por cancionero",
+                          etapas.datos["canciones"], CUBETAS_CANCIONES, ruta=ruta)
+        if "bytes_pdf" in etapas.datos:
+            self.observar("pdf_bytes", "Tamaño del PDF entregado",
+                          etapas.datos["bytes_pdf"], CUBETAS_BYTES, ruta=ruta)
+
+    def registrar_request(self, ruta, metodo, estado, duracion, etapas):
+        self.incrementar("requests_total", "Requests atendidos", ruta=ruta, metodo=metodo, estado=estado)
+        self.observar("request_segundos", "Duración total del request", duracion, ruta=ruta)
+        self.registrar_etapas(etapas, ruta)
+
+    # ----- foto del worker -----
+    def _foto(self):
+        fuentes = {}
+        for nombre, funcion in self._fuentes.items():
+            try:
+                fuentes[nombre] = {
+                    k: float(v) for k, v in funcion().items()
+                    if isinstance(v, (int, float))
+                }
+            except Exception as e:
+                logger.warning(f"No se pudo leer la fuente de métricas {nombre}: {e}")
+        with self._lock:
+            self._cambios = False
+            return {
+                "id": self.id,
+                "pid": os.getpid(),
+                "ayuda": dict(self._ayuda),
+                "contadores": [[n, list(map(list, e)), v] for (n, e), v in self._contadores.items()],
+                "histogramas": [
+                    [n, list(map(list, e)), [h[0], list(h[1]), h[2], h[3]]]
+                    for (n, e), h in self._histogramas.items()
+                ],
+                "fuentes": fuentes,
+            }
+
+    def volcar(self):
+        foto = self._foto()
+        try:
+            _escribir_json(self.directorio, f"{foto['id']}.json", foto)
+        except OSError as e:
+            logger.warning(f"No se pudieron volcar las métricas: {e}")
+        return foto
+
+    def iniciar_volcado(self, intervalo):
+        """Hilo que vuelca cada `intervalo` segundos si algo cambió; vuelca también al salir."""
+        if self._volcado is not None:
+            return
+
+        def volcar_periodicamente():
+            while True:
+                time.sleep(intervalo)
+                if self._cambios:
+                    self.volcar()
+
+        self._volcado = threading.Thread(target=volcar_periodicamente, name="volcado_metricas", daemon=True)
+        self._volcado.start()
+        atexit.register(self.volcar)
+
+    def _fotos(self):
+        fotos = {}
+        # Primero las de los workers y al final terminados.json: si el master
+        # retiró una foto entremedio, ya figura como incluida y no se cuenta dos veces
+        for archivo in os.listdir(self.directorio):
+            if not archivo.endswith(".json") or archivo == ARCHIVO_TERMINADOS:
+                continue
+            try:
+                foto = _leer_json(os.path.join(self.directorio, archivo))
+                fotos[foto["id"]] = foto
+            except (OSError, ValueError, KeyError):
+                # Otro worker lo está reemplazando; se verá en el próximo scrape
+                continue
+        try:
+            terminados = _leer_json(os.path.join(self.directorio, ARCHIVO_TERMINADOS))
+        except (OSError, ValueError):
+            terminados = None
+        if terminados is not None:
+            for id_foto in terminados["incluidos"]:
+                fotos.pop(id_foto, None)
+            # Sin pid: ya no tiene estadísticas en vivo
+            fotos[ARCHIVO_TERMINADOS] = dict(terminados, pid=None, fuentes={})
+        # La de este proceso, al día y en disco (el scrape también vuelca)
+        foto = self.volcar()
+        fotos[foto["id"]] = foto
+        return fotos.values()
+
+    # ----- texto para /metrics -----
+    def exponer(self):
+        ayuda, contadores, histogramas, fuentes = {}, {}, {}, []
+        for foto in self._fotos():
+            ayuda.update(foto["ayuda"])
+            # Contadores e histogramas de todos los workers, también los que ya terminaron
+            for nombre, etiquetas, valor in foto["contadores"]:
+                clave = (nombre, tuple(map(tuple, etiquetas)))
+                contadores[clave] = contadores.get(clave, 0) + valor
+            for nombre, etiquetas, (cubetas, conteos, suma, cuenta) in foto["histogramas"]:
+                clave = (nombre, tuple(map(tuple, etiquetas)))
+                acumulado = histogramas.setdefault(clave, [cubetas, [0] * len(cubetas), 0.0, 0])
+                acumulado[1] = [a + b for a, b in zip(acumulado[1], conteos)]
+                acumulado[2] += suma
+                acumulado[3] += cuenta
+            # Una foto vieja con el PID de este proceso no es de este proceso
+            if foto["pid"] is not None and _vivo(foto["pid"]) \
+                    and (foto["pid"] != os.getpid() or foto["id"] == self.id):
+                fuentes.append((foto["pid"], foto["fuentes"]))
+
+        lineas = []
+        for nombre in sorted({n for n, _ in contadores}):
+            completo = f"{self.prefijo}_{nombre}"
+            lineas.append(f"# HELP {completo} {ayuda.get(nombre, nombre)}")
+            lineas.append(f"# TYPE {completo} counter")
+            for (n, etiquetas), valor in sorted(contadores.items()):
+                if n == nombre:
+                    lineas.append(f"{completo}{_formato_etiquetas(etiquetas)} {_numero(valor)}")
+
+        for nombre in sorted({n for n, _ in histogramas}):
+            completo = f"{self.prefijo}_{nombre}"
+            lineas.append(f"# HELP {completo} {ayuda.get(nombre, nombre)}")
+            lineas.append(f"# TYPE {completo} histogram")
+            for (n, etiquetas), (cubetas, conteos, suma, cuenta) in sorted(histogramas.items()):
+                if n != nombre:
+                    continue
+                for limite, conteo in zip(cubetas, conteos):
+                    le = _formato_etiquetas(etiquetas + (("le", f"{limite:g}"),))
+                    lineas.append(f"{completo}_bucket{le} {conteo}")
+                le = _formato_etiquetas(etiquetas + (("le", "+Inf"),))
+                lineas.append(f"{completo}_bucket{le} {cuenta}")
+                lineas.append(f"{completo}_sum{_formato_etiquetas(etiquetas)} {_numero(suma)}")
+                lineas.append(f"{completo}_count{_formato_etiquetas(etiquetas)} {cuenta}")
+
+        por_metrica = {}
+        for pid, estadisticas in sorted(fuentes, key=lambda f: f[0]):
+            for fuente, valores in estadisticas.items():
+                for clave, valor in valores.items():
+                    completo = _nombre_metrica(f"{self.prefijo}_{fuente}_{clave}")
+                    por_metrica.setdefault(completo, []).append((pid, valor))
+        for completo, valores in sorted(por_metrica.items()):
+            lineas.append(f"# TYPE {completo} gauge")
+            for pid, valor in valores:
+                lineas.append(f'{completo}{{worker="{pid}"}} {_numero(valor)}')
+
+        return '\n'.join(lineas) + '\n'
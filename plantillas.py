@@ -0,0 +1,136 @@
+"""
+Registro de plantillas LaTeX del cancionero.
+
+Una plantilla es un .tex con los marcadores '% --- INICIO CANCIONERO ---' y
+'% --- FIN CANCIONERO ---': el documento es cabeza + "\\n" + canciones +
+"\\n" + cola. Cada plantilla se lee y se parte una sola vez; si cambia el
+mtime (o el tamaño) del archivo se vuelve a leer en el request siguiente,
+sin reiniciar el servidor.
+
+- "cancionero" es plantilla.tex, la de siempre
+- cada <nombre>.tex del directorio de plantillas (PLANTILLAS_DIR) es otra,
+  p. ej. plantillas/carta.tex con otro tamaño de página
+
+Cada Plantilla guarda su huella (sha256 del contenido), que entra en la
+clave de la caché de PDFs y en el nombre del formato precompilado.
+"""
+import hashlib
+import os
+import re
+import threading
+
+PLANTILLA_POR_DEFECTO = "cancionero"
+ARCHIVO_PRINCIPAL = "plantilla.tex"
+DIRECTORIO = "plantillas"
+_RE_MARCADORES = re.compile(
+    r"(% --- INICIO CANCIONERO ---)(.*?)(% --- FIN CANCIONERO ---)", flags=re.S
+)
+# También es parte del nombre del formato de pdflatex (-jobname)
+_RE_NOMBRE = re.compile(r"[A-Za-z0-9_-]+")
+
+
+class PlantillaDesconocida(ValueError):
+    def __init__(self, nombre, disponibles):
+        self.nombre = nombre
+        self.disponibles = disponibles
+        super().__init__(f"No existe la plantilla '{nombre}' (disponibles: {', '.join(disponibles)})")
+
+
+def dividir_plantilla(plantilla):
+    """
+    Parte la plantilla en (cabeza, cola) alrededor de los marcadores:
+    el documento es cabeza + "\\n" + canciones + "\\n" + cola.
+    """
+    match = _RE_MARCADORES.search(plantilla)
+    if not match:
+        raise RuntimeError("La plantilla no tiene los marcadores del cancionero")
+    return plantilla[:match.end(1)], plantilla[match.start(3):]
+
+
+def _firma(ruta):
+    st = os.stat(ruta)
+    return st.st_mtime_ns, st.st_size
+
+
+class Plantilla:
+    """Una plantilla ya leída y partida; no se modifica (al recargar se crea otra)."""
+    __slots__ = ("nombre", "ruta", "firma", "texto", "cabeza", "cola", "huella", "lineas_cabeza")
+
+    def __init__(self, nombre, ruta):
+        self.nombre = nombre
+        self.ruta = ruta
+        # La firma se toma antes de leer: si el archivo cambia mientras tanto, se relee
+        self.firma = _firma(ruta)
+        with open(ruta, "r", encoding="utf-8") as f:
+            self.texto = f.read()
+        self.cabeza, self.cola = dividir_plantilla(self.texto)
+        self.huella = hashlib.sha256(self.texto.encode("utf-8")).hexdigest()
+        # Líneas del documento antes de la primera canción (ver mapa_fuente.MapaFuente)
+        self.lineas_cabeza = self.cabeza.count("\n") + 1
+
+    def documento(self, canciones):
+        return self.cabeza + "\n" + canciones + "\n" + self.cola
+
+
+class RegistroPlantillas:
+    """
+    - obtener(nombre): la Plantilla vigente (la relee si el archivo cambió)
+    - nombres(): las plantillas disponibles
+    """
+
+    def __init__(self, archivo_principal, directorio=None, por_defecto=PLANTILLA_POR_DEFECTO):
+        self.archivo_principal = archivo_principal
+        self.directorio = directorio
+        self.por_defecto = por_defecto
+        self._lock = threading.Lock()
+        self._plantillas = {}
+        self.recargas = 0
+
+    def rutas(self):
+        """nombre -> ruta de cada plantilla disponible."""
+        rutas = {}
+        if self.directorio and os.path.isdir(self.directorio):
+            for archivo in sorted(os.listdir(self.directorio)):
+                nombre, extension = os.path.splitext(archivo)
+                if extension == ".tex" and _RE_NOMBRE.fullmatch(nombre):
+                    rutas[nombre] = os.path.join(self.directorio, archivo)
+        rutas[self.por_defecto] = self.archivo_principal
+        return rutas
+
+    def nombres(self):
+        return sorted(self.rutas())
+
+    def _ruta(self, nombre):
+        if nombre == self.por_defecto:
+            return self.archivo_principal
+        ruta = os.path.join(self.directorio or "", nombre + ".tex")
+        if self.directorio and _RE_NOMBRE.fullmatch(nombre) and os.path.isfile(ruta):
+            return ruta
+        raise PlantillaDesconocida(nombre, self.nombres())
+
+    def obtener(self, nombre=None):
+        """Lanza PlantillaDesconocida si no existe y RuntimeError si no tiene los marcadores."""
+        nombre = nombre or self.por_defecto
+        ruta = self._ruta(nombre)
+        with self._lock:
+            plantilla = self._plantillas.get(nombre)
+        try:
+            if plantilla is not None and plantilla.ruta == ruta and plantilla.firma == _firma(ruta):
+                return plantilla
+        except FileNotFoundError:
+            raise PlantillaDesconocida(nombre, self.nombres())
+
+        # Fuera del lock; si dos hilos releen la misma, gana el último
+        nueva = Plantilla(nombre, ruta)
+        with self._lock:
+            if plantilla is not None:
+                self.recargas += 1
+            self._plantillas[nombre] = nueva
+        return nueva
+
+    def estadisticas(self):
+        with self._lock:
+            return {
+                "cargadas": len(self._plantillas),
+                "recargas": self.recargas,
+            }
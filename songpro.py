@@ -0,0 +1,551 @@
+"""
+Representación intermedia de un cancionero SongPro.
+
+    Cancionero -> Seccion -> Cancion -> Bloque / BloqueRaw -> Linea -> Palabra -> AnclaAcorde
+
+- parsear_cancionero(texto): SongPro -> Cancionero (el único paso que lee texto)
+- CacheAST: árboles ya parseados por hash del texto, para volver a renderizar
+  (otra transposición, otra plantilla, otro formato) sin parsear de nuevo
+- TrazaParser: contadores de un request, calculados a partir del árbol
+
+El árbol no sabe nada de LaTeX; el render está en latex_cancionero.py.
+Una vez construido no se modifica, así que se puede compartir entre hilos.
+
+Secciones, canciones y bloques guardan la línea (desde 1) del texto
+parseado donde empiezan, para el mapa de fuente del .tex (mapa_fuente.py).
+En los árboles que arma cache_fragmentos esas líneas son relativas a cada
+segmento, no al texto completo.
+"""
+import gc
+import hashlib
+import re
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import List, Optional, Tuple, Union
+
+from acordes import Acorde, es_linea_acordes, parsear_acorde
+
+# Marcas de bloque -> tipo de bloque
+TIPOS_BLOQUE = {'V': 'verse', 'CH': 'chorus', 'M': 'melody'}
+
+
+# =========================
+# NODOS
+# =========================
+@dataclass(slots=True)
+class AnclaAcorde:
+    """Acorde anclado en un '_' de la letra, seguido del texto hasta el próximo '_'."""
+    acorde: Acorde
+    texto: str
+
+
+@dataclass(slots=True)
+class Palabra:
+    """
+    Palabra de una línea con acordes que lleva '_' o '#'.
+    - inicio: texto antes del primer '_'
+    - anclas: un AnclaAcorde por cada '_'
+    - indice: entrada del índice temático si la palabra venía con '#', si no None
+    """
+    inicio: str
+    anclas: Tuple[AnclaAcorde, ...] = ()
+    indice: Optional[str] = None
+
+
+@dataclass(slots=True)
+class Linea:
+    """
+    Línea de letra. Si la anterior era de acordes, `palabras` tiene la línea
+    parseada: Palabra para las que llevan acordes o índice, y un str con las
+    palabras simples seguidas (separadas por un espacio). Si no, es None y
+    sólo vale `texto` (tal cual, sin los '_').
+    """
+    texto: str
+    palabras: Optional[Tuple[Union[str, Palabra], ...]] = None
+
+
+@dataclass(slots=True)
+class Bloque:
+    """
+    Estrofa (V), coro (CH) o melodía (M). `linea` es la de la marca y `fin`
+    la última línea de letra del bloque.
+    """
+    tipo: str
+    lineas: List[Linea] = field(default_factory=list)
+    linea: int = 0
+    fin: int = 0
+
+
+@dataclass(slots=True)
+class BloqueRaw:
+    """Bloque N: líneas que van tal cual (sólo se escapan)."""
+    lineas: List[str] = field(default_factory=list)
+    linea: int = 0
+    fin: int = 0
+
+
+Elemento = Union[Bloque, BloqueRaw]
+
+
+@dataclass(slots=True)
+class Cancion:
+    titulo: str
+    transposicion: int = 0
+    elementos: List[Elemento] = field(default_factory=list)
+    linea: int = 0
+
+
+@dataclass(slots=True)
+class Seccion:
+    """
+    Sección (S). La primera puede no tener título: guarda lo que viene antes
+    del primer S. `elementos` es lo que aparece antes de la primera canción.
+    """
+    titulo: Optional[str]
+    elementos: List[Elemento] = field(default_factory=list)
+    canciones: List[Cancion] = field(default_factory=list)
+    linea: int = 0
+
+
+@dataclass(slots=True)
+class Cancionero:
+    secciones: List[Seccion] = field(default_factory=list)
+    # Datos del texto fuente, para la traza y los diagnósticos
+    total_lineas: int = 0
+    lineas_acordes: int = 0
+    fuera_de_bloque: List[int] = field(default_factory=list)
+
+    def canciones(self):
+        for seccion in self.secciones:
+            yield from seccion.canciones
+
+
+# =========================
+# PARSER
+# =========================
+def extraer_transposicion(titulo_raw):
+    """
+    Extrae transposición del tipo '=+2' o '=-2' al final del título.
+    Retorna: (titulo_limpio, semitonos)
+    """
+    match = re.search(r'\s*=\s*([+-]?\d+)\s*$', titulo_raw)
+    if match:
+        semitonos = int(match.group(1))
+        titulo_limpio = re.sub(r'\s*=\s*[+-]?\d+\s*$', '', titulo_raw).strip()
+        return titulo_limpio, semitonos
+    return titulo_raw.strip(), 0
+
+
+def parsear_palabra(palabra, acordes, idx_acorde):
+    """
+    Parsea UNA palabra SongPro:
+    - _ ancla el siguiente acorde de la línea de acordes
+    - # marca índice
+    - #u_ni_da=Unidad → visible con sílabas, índice limpio
+    Devuelve (Palabra, índice del próximo acorde).
+    """
+    es_indexada = palabra[0] == "#"
+    if es_indexada:
+        palabra_trabajo = palabra[1:]
+        # --- índice explícito ---
+        if "=" in palabra_trabajo:
+            base_raw, indice_real = palabra_trabajo.split("=", 1)
+        else:
+            base_raw = palabra_trabajo
+            indice_real = base_raw.replace("_", "")
+    else:
+        base_raw, indice_real = palabra, None
+
+    partes = base_raw.split("_")
+    fin = idx_acorde + len(partes) - 1
+    if fin > len(acordes):
+        # Los acordes que sí alcanzan se parsean antes, como siempre: si
+        # alguno es inválido, ese error sale primero
+        for acorde in acordes[idx_acorde:]:
+            parsear_acorde(acorde)
+        raise RuntimeError(
+            f"Error: hay más '_' que acordes en la palabra '{palabra}'"
+        )
+    anclas = tuple(map(AnclaAcorde, map(parsear_acorde, acordes[idx_acorde:fin]), partes[1:]))
+    return Palabra(partes[0], anclas, indice_real), fin
+
+
+def parsear_linea(linea, acordes):
+    """Línea de letra + tokens de la línea de acordes anterior -> Linea."""
+    palabras = []
+    simples = []
+    idx_acorde = 0
+    for palabra in linea.split():
+        # Las palabras sin '_' ni '#' (la mayoría) se juntan en un solo str
+        if '_' not in palabra and palabra[0] != '#':
+            simples.append(palabra)
+            continue
+        if simples:
+            palabras.append(' '.join(simples))
+            simples = []
+        parseada, idx_acorde = parsear_palabra(palabra, acordes, idx_acorde)
+        palabras.append(parseada)
+    if simples:
+        palabras.append(' '.join(simples))
+    return Linea(linea, tuple(palabras))
+
+
+class _Parser:
+    """Estado del recorrido línea a línea; sólo vive dentro de parsear_cancionero."""
+    __slots__ = ("cancionero", "seccion", "cancion", "bloque", "raw")
+
+    def __init__(self, total_lineas):
+        self.cancionero = Cancionero(total_lineas=total_lineas)
+        # Lo que venga antes del primer S queda en una sección sin título
+        self.seccion = Seccion(None)
+        self.cancionero.secciones.append(self.seccion)
+        self.cancion = None
+        self.bloque = None
+        self.raw = None
+
+    def agregar(self, elemento):
+        if self.cancion is not None:
+            self.cancion.elementos.append(elemento)
+        else:
+            self.seccion.elementos.append(elemento)
+
+    def cerrar_raw(self):
+        if self.raw is not None and self.raw.lineas:
+            self.agregar(self.raw)
+        self.raw = None
+
+    def cerrar_bloque(self):
+        # Un bloque sin líneas no se emite
+        if self.bloque is not None and self.bloque.lineas:
+            self.agregar(self.bloque)
+        self.bloque = None
+
+    def cerrar_cancion(self):
+        self.cancion = None
+
+    def abrir_seccion(self, titulo, n):
+        self.seccion = Seccion(titulo, linea=n)
+        self.cancionero.secciones.append(self.seccion)
+
+    def abrir_cancion(self, titulo, transposicion, n):
+        self.cancion = Cancion(titulo, transposicion, linea=n)
+        self.seccion.canciones.append(self.cancion)
+
+
+@contextmanager
+def pausar_gc():
+    """
+    Pausa el recolector cíclico mientras se arma el árbol: son cientos de
+    miles de objetos nuevos sin ciclos y cada pasada del GC los recorre todos.
+    Sólo lo reactiva quien lo apagó, así que con varios hilos nunca queda
+    apagado; quien arma un árbol por partes (cache_fragmentos) lo pausa una
+    sola vez para todas.
+    """
+    estaba_activo = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if estaba_activo:
+            gc.enable()
+
+
+def parsear_cancionero(texto):
+    """
+    SongPro -> Cancionero. Lanza RuntimeError si una línea tiene más '_'
+    que acordes la línea de acordes anterior.
+    """
+    with pausar_gc():
+        return _parsear_cancionero(texto)
+
+
+def _parsear_cancionero(texto):
+    lineas = [l.rstrip() for l in texto.split('\n')]
+    # Cada línea se clasifica una sola vez; la letra reutiliza el resultado de la anterior
+    lineas_acordes = [es_linea_acordes(l) for l in lineas]
+
+    p = _Parser(len(lineas))
+    cancionero = p.cancionero
+    raw_mode = False
+
+    i = 0
+    while i < len(lineas):
+        linea = lineas[i].strip()
+
+        # =========================
+        # MODO RAW
+        # =========================
+        if raw_mode:
+            if linea == 'N':
+                p.cerrar_raw()
+                p.raw = BloqueRaw(linea=i + 1, fin=i + 1)   # sigue en RAW
+                i += 1
+                continue
+
+            if linea in ('V', 'CH', 'M', 'O', 'S'):
+                p.cerrar_raw()
+                raw_mode = False
+                continue   # reprocesar esta línea
+
+            p.raw.lineas.append(linea)
+            p.raw.fin = i + 1
+            i += 1
+            continue
+
+        # =========================
+        # N → abrir RAW
+        # =========================
+        if linea == 'N':
+            p.cerrar_bloque()
+            raw_mode = True
+            p.raw = BloqueRaw(linea=i + 1, fin=i + 1)
+            i += 1
+            continue
+
+        # =========================
+        # SECCIÓN
+        # =========================
+        if linea.startswith('S '):
+            p.cerrar_bloque()
+            p.cerrar_cancion()
+            p.abrir_seccion(linea[2:].strip().title(), i + 1)
+            i += 1
+            continue
+
+        # =========================
+        # CANCIÓN
+        # =========================
+        if linea.startswith('O '):
+            p.cerrar_bloque()
+            p.cerrar_cancion()
+            titulo_limpio, transposicion = extraer_transposicion(linea[2:].strip())
+            p.abrir_cancion(titulo_limpio.title(), transposicion, i + 1)
+            i += 1
+            continue
+
+        # =========================
+        # BLOQUES
+        # =========================
+        tipo = TIPOS_BLOQUE.get(linea)
+        if tipo is not None:
+            p.cerrar_bloque()
+            p.bloque = Bloque(tipo, linea=i + 1, fin=i + 1)
+            # Caso especial: V / CH / _Estrofa   --> CH es el acorde Do
+            if linea == 'V' and i + 2 < len(lineas):
+                siguiente = lineas[i+1].strip()
+                siguiente2 = lineas[i+2].strip()
+                if siguiente == 'CH' and siguiente2.startswith('_'):
+                    p.bloque.lineas.append(parsear_linea(siguiente2, ['C']))
+                    p.bloque.fin = i + 3
+                    # saltar las dos líneas ya consumidas
+                    i += 3
+                    continue
+            i += 1
+            continue
+
+        if lineas_acordes[i]:
+            cancionero.lineas_acordes += 1
+            i += 1
+            continue
+
+        # =========================
+        # TEXTO NORMAL
+        # =========================
+        if p.bloque is not None:
+            if i > 0 and lineas_acordes[i-1]:
+                p.bloque.lineas.append(parsear_linea(linea, lineas[i-1].split()))
+            else:
+                p.bloque.lineas.append(Linea(linea))
+            p.bloque.fin = i + 1
+        elif linea:
+            cancionero.fuera_de_bloque.append(i + 1)
+        i += 1
+
+    # =========================
+    # CIERRES FINALES
+    # =========================
+    p.cerrar_raw()
+    p.cerrar_bloque()
+    return cancionero
+
+
+def dividir_en_segmentos(texto):
+    """
+    Parte el texto en las líneas O y S donde el parser empieza de cero: al
+    abrir una canción o sección cierra el bloque anterior y no arrastra nada
+    más, salvo dentro de un bloque N (ahí 'O ...' es texto). Cada segmento
+    parseado por separado da los mismos nodos que dentro del texto completo.
+
+    Devuelve [(tipo, inicio, lineas)]: tipo 'O', 'S' o None (lo anterior a
+    la primera O/S), inicio es el índice de su primera línea en el texto.
+    """
+    lineas = texto.split('\n')
+    cortes = []
+    raw_mode = False
+    for i, linea in enumerate(lineas):
+        linea = linea.strip()
+        if raw_mode:
+            # Mismas salidas del modo RAW que en _parsear_cancionero
+            if linea not in ('V', 'CH', 'M', 'O', 'S'):
+                continue
+            raw_mode = False
+        if linea == 'N':
+            raw_mode = True
+        elif linea.startswith(('O ', 'S ')):
+            cortes.append(i)
+
+    segmentos = []
+    if not cortes or cortes[0] > 0:
+        segmentos.append((None, 0, lineas[:cortes[0] if cortes else len(lineas)]))
+    for n, inicio in enumerate(cortes):
+        fin = cortes[n + 1] if n + 1 < len(cortes) else len(lineas)
+        segmentos.append((lineas[inicio].strip()[0], inicio, lineas[inicio:fin]))
+    return segmentos
+
+
+# =========================
+# CACHÉ DE ÁRBOLES
+# =========================
+class CacheAST:
+    """
+    LRU en memoria de cancioneros ya parseados, por sha256 del texto.
+    Los árboles no se modifican después de parsear, así que se comparten
+    tal cual entre requests.
+    """
+
+    def __init__(self, maximo, parsear=parsear_cancionero):
+        self.maximo = maximo
+        # Cómo se parsea lo que no está (p. ej. CacheFragmentos.parsear)
+        self._parsear = parsear
+        self._arboles = OrderedDict()
+        self._lock = threading.Lock()
+        self.aciertos = 0
+        self.fallos = 0
+
+    @property
+    def habilitada(self):
+        return self.maximo > 0
+
+    @staticmethod
+    def clave(texto):
+        return hashlib.sha256(texto.encode("utf-8")).hexdigest()
+
+    def parsear(self, texto):
+        """(Cancionero, True si vino de la caché)."""
+        if not self.habilitada:
+            return self._parsear(texto), False
+
+        clave = self.clave(texto)
+        with self._lock:
+            cancionero = self._arboles.get(clave)
+            if cancionero is not None:
+                self._arboles.move_to_end(clave)
+                self.aciertos += 1
+                return cancionero, True
+            self.fallos += 1
+
+        # Se parsea fuera del lock; si dos hilos parsean lo mismo, gana el último
+        cancionero = self._parsear(texto)
+        with self._lock:
+            self._arboles[clave] = cancionero
+            self._arboles.move_to_end(clave)
+            while len(self._arboles) > self.maximo:
+                self._arboles.popitem(last=False)
+        return cancionero, False
+
+    def estadisticas(self):
+        with self._lock:
+            return {
+                "habilitada": self.habilitada,
+                "arboles": len(self._arboles),
+                "maximo": self.maximo,
+                "aciertos": self.aciertos,
+                "fallos": self.fallos,
+            }
+
+
+# =========================
+# TRAZA DEL PARSER
+# =========================
+class TrazaParser:
+    """
+    Contadores del parser para UN request. Sólo se crea si se pidió la traza;
+    se calculan recorriendo el árbol ya parseado, así el parser no paga nada.
+    """
+    __slots__ = (
+        "lineas", "secciones", "canciones", "bloques", "lineas_acordes",
+        "lineas_letra", "lineas_sin_acordes", "lineas_fuera_de_bloque",
+        "primeras_fuera_de_bloque", "ast_cacheado", "tiempo",
+    )
+
+    # Cuántos números de línea fuera de bloque se guardan como muestra
+    MUESTRA_FUERA_DE_BLOQUE = 10
+
+    def __init__(self):
+        self.lineas = 0
+        self.secciones = 0
+        self.canciones = 0
+        self.bloques = 0
+        self.lineas_acordes = 0
+        self.lineas_letra = 0
+        self.lineas_sin_acordes = 0
+        self.lineas_fuera_de_bloque = 0
+        self.primeras_fuera_de_bloque = []
+        self.ast_cacheado = False
+        self.tiempo = 0.0
+
+    def registrar(self, cancionero, desde_cache=False):
+        self.ast_cacheado = desde_cache
+        self.lineas += cancionero.total_lineas
+        self.lineas_acordes += cancionero.lineas_acordes
+        self.lineas_fuera_de_bloque += len(cancionero.fuera_de_bloque)
+        self.primeras_fuera_de_bloque.extend(
+            cancionero.fuera_de_bloque[:self.MUESTRA_FUERA_DE_BLOQUE - len(self.primeras_fuera_de_bloque)]
+        )
+
+        elementos = []
+        for seccion in cancionero.secciones:
+            if seccion.titulo is not None:
+                self.secciones += 1
+            elementos.extend(seccion.elementos)
+            for cancion in seccion.canciones:
+                self.canciones += 1
+                elementos.extend(cancion.elementos)
+
+        for elemento in elementos:
+            if not isinstance(elemento, Bloque):
+                continue
+            self.bloques += 1
+            for linea in elemento.lineas:
+                if linea.texto:
+                    self.lineas_letra += 1
+                    if linea.palabras is None:
+                        self.lineas_sin_acordes += 1
+
+    def cronometrar(self, trozos):
+        """Suma a `tiempo` sólo lo que tarda el parser, no quien consume los trozos."""
+        trozos = iter(trozos)
+        while True:
+            inicio = time.perf_counter()
+            try:
+                trozo = next(trozos)
+            except StopIteration:
+                self.tiempo += time.perf_counter() - inicio
+                return
+            self.tiempo += time.perf_counter() - inicio
+            yield trozo
+
+    def resumen(self):
+        return {nombre: getattr(self, nombre) for nombre in self.__slots__}
+
+    def cabecera(self):
+        """Resumen compacto para el header X-Traza-Parser."""
+        return (
+            f"lineas={self.lineas};secciones={self.secciones};canciones={self.canciones};"
+            f"bloques={self.bloques};acordes={self.lineas_acordes};letra={self.lineas_letra};"
+            f"sin_acordes={self.lineas_sin_acordes};fuera_de_bloque={self.lineas_fuera_de_bloque};"
+            f"ast_cacheado={int(self.ast_cacheado)};ms={self.tiempo * 1000:.1f}"
+        )
@@ -0,0 +1,143 @@
+"""
+Almacén en disco de trabajos asíncronos de generación de PDF.
+
+Cada trabajo es un directorio <id>/ con estado.json (y cancionero.pdf cuando
+termina). Como todo vive en disco, cualquier worker de gunicorn puede responder
+por un trabajo aunque lo esté procesando otro. estado.json se reescribe de
+forma atómica, así nunca se lee a medio escribir.
+"""
+import fcntl
+import json
+import logging
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+EN_COLA = "en_cola"
+EJECUTANDO = "ejecutando"
+LISTO = "listo"
+FALLIDO = "fallido"
+
+_ID_VALIDO = re.compile(r"^[0-9a-f]{32}$")
+
+
+class AlmacenTrabajos:
+    """
+    - crear() / actualizar() / leer(): estado de cada trabajo
+    - guardar_pdf() / ruta_pdf(): resultado
+    - iniciar_limpieza(): borra periódicamente los trabajos vencidos
+    """
+
+    def __init__(self, directorio, ttl):
+        self.directorio = directorio
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._hilo_limpieza = None
+        os.makedirs(directorio, exist_ok=True)
+
+    def _carpeta(self, id_trabajo):
+        if not _ID_VALIDO.match(id_trabajo):
+            raise KeyError(id_trabajo)
+        return os.path.join(self.directorio, id_trabajo)
+
+    def _escribir_estado(self, id_trabajo, estado):
+        carpeta = self._carpeta(id_trabajo)
+        fd, temporal = tempfile.mkstemp(dir=carpeta, suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(estado, f, ensure_ascii=False)
+        os.replace(temporal, os.path.join(carpeta, "estado.json"))
+
+    def crear(self):
+        id_trabajo = uuid.uuid4().hex
+        os.makedirs(self._carpeta(id_trabajo))
+        ahora = time.time()
+        self._escribir_estado(id_trabajo, {
+            "id": id_trabajo,
+            "estado": EN_COLA,
+            "creado": ahora,
+            "actualizado": ahora,
+            "etapas": {},
+        })
+        return id_trabajo
+
+    def leer(self, id_trabajo):
+        """Estado del trabajo, o None si no existe (o ya expiró)."""
+        try:
+            with open(os.path.join(self._carpeta(id_trabajo), "estado.json"), encoding="utf-8") as f:
+                return json.load(f)
+        except (KeyError, FileNotFoundError):
+            return None
+
+    def actualizar(self, id_trabajo, **campos):
+        # Sólo el hilo que procesa el trabajo lo actualiza, el lock basta
+        with self._lock:
+            estado = self.leer(id_trabajo)
+            if estado is None:
+                return None
+            estado.update(campos)
+            estado["actualizado"] = time.time()
+            self._escribir_estado(id_trabajo, estado)
+            return estado
+
+    def eliminar(self, id_trabajo):
+        shutil.rmtree(self._carpeta(id_trabajo), ignore_errors=True)
+
+    def ruta_pdf(self, id_trabajo):
+        return os.path.join(self._carpeta(id_trabajo), "cancionero.pdf")
+
+    def guardar_pdf(self, id_trabajo, archivo):
+        """Copia el PDF desde `archivo` (abierto en modo binario)."""
+        carpeta = self._carpeta(id_trabajo)
+        fd, temporal = tempfile.mkstemp(dir=carpeta, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            shutil.copyfileobj(archivo, f)
+        os.replace(temporal, self.ruta_pdf(id_trabajo))
+
+    def limpiar_expirados(self):
+        """Borra los trabajos sin actividad hace más de `ttl` segundos."""
+        with open(os.path.join(self.directorio, ".lock"), "a") as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                # Otro worker está limpiando
+                return 0
+
+            limite = time.time() - self.ttl
+            borrados = 0
+            for nombre in os.listdir(self.directorio):
+                if not _ID_VALIDO.match(nombre):
+                    continue
+                carpeta = os.path.join(self.directorio, nombre)
+                try:
+                    actividad = os.stat(os.path.join(carpeta, "estado.json")).st_mtime
+                except FileNotFoundError:
+                    actividad = os.stat(carpeta).st_mtime
+                if actividad < limite:
+                    shutil.rmtree(carpeta, ignore_errors=True)
+                    borrados += 1
+            if borrados:
+                logger.info(f"Trabajos expirados eliminados: {borrados}")
+            return borrados
+
+    def iniciar_limpieza(self, intervalo):
+        if self._hilo_limpieza is not None:
+            return
+
+        def ciclo():
+            while True:
+                time.sleep(intervalo)
+                try:
+                    self.limpiar_expirados()
+                except Exception as e:
+                    logger.warning(f"Error limpiando trabajos expirados: {e}")
+
+        self._hilo_limpieza = threading.Thread(
+            target=ciclo, name="limpieza-trabajos", daemon=True
+        )
+        self._hilo_limpieza.start()
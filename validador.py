@@ -0,0 +1,358 @@
+"""
+Validación previa de un texto SongPro, antes de lanzar pdflatex.
+
+El parser se detiene en el primer error y hay cosas que sólo revienta TeX
+(un '&' en la letra, un '#' fuera de una palabra del índice...), cuando ya
+se pagó un proceso entero y el usuario recibe el log completo. validar()
+recorre el texto una vez, con la misma clasificación de líneas que
+songpro._parsear_cancionero, y devuelve TODOS los problemas con su línea y
+columna del texto original (ambas desde 1).
+
+- ERROR: el PDF no se puede generar; la compilación no se intenta
+- ADVERTENCIA: se compila igual, pero probablemente no es lo que se quería
+
+CacheValidacion recuerda las canciones que ya pasaron sin problemas: al
+reenviar un libro con una canción corregida sólo se vuelve a validar esa.
+"""
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+from dataclasses import asdict, dataclass
+
+from acordes import es_linea_acordes, parsear_acorde
+from songpro import TIPOS_BLOQUE, dividir_en_segmentos
+
+ERROR = "error"
+ADVERTENCIA = "advertencia"
+
+# Caracteres que pdflatex no acepta sueltos en la letra, los títulos o los acordes
+# ('#' se trata aparte: al comienzo de una palabra con acordes marca el índice)
+ESPECIALES_LATEX = {
+    '%': "'%' comenta el resto de la línea en LaTeX",
+    '&': "'&' sólo es válido en tablas de LaTeX",
+    '$': "'$' abre el modo matemático de LaTeX",
+    '^': "'^' sólo es válido en el modo matemático de LaTeX",
+    '\\': "'\\' inicia un comando de LaTeX: se pasa tal cual",
+}
+# Un comando puede ser a propósito (\textit{...}): sólo se advierte
+ADVERTENCIAS_LATEX = ('\\',)
+# En un bloque N se escapan # % & _ { }; el resto pasa tal cual
+ESPECIALES_RAW = ('$', '^', '\\')
+
+_RE_PALABRA = re.compile(r'\S+')
+# Búsqueda rápida: la mayoría de las líneas no tiene nada que revisar carácter por carácter
+_RE_ESPECIAL = re.compile(r'[%&$^\\{}#]')
+_RE_ESPECIAL_TITULO = re.compile(r'[%&$^\\{}#_]')
+_RE_REPETICION = re.compile(r'B\d*')
+
+
+@dataclass(slots=True)
+class Problema:
+    linea: int
+    columna: int
+    codigo: str
+    mensaje: str
+    gravedad: str = ERROR
+
+    def como_dict(self):
+        return asdict(self)
+
+    def __str__(self):
+        return f"Línea {self.linea}, columna {self.columna}: {self.mensaje}"
+
+
+class TextoInvalido(Exception):
+    """El texto tiene errores de validación; `problemas` incluye también las advertencias."""
+
+    def __init__(self, problemas):
+        self.problemas = problemas
+        self.errores = [p for p in problemas if p.gravedad == ERROR]
+        cantidad = len(self.errores)
+        super().__init__(f"El texto tiene {cantidad} {'error' if cantidad == 1 else 'errores'}")
+
+    def como_dict(self):
+        return {
+            "error": str(self),
+            "errores": [p.como_dict() for p in self.errores],
+            "advertencias": [p.como_dict() for p in self.problemas if p.gravedad != ERROR],
+        }
+
+
+class _Validador:
+    """Estado del recorrido; sólo vive dentro de validar()."""
+    __slots__ = ("problemas", "repeticion")
+
+    def __init__(self):
+        self.problemas = []
+        # (línea, columna) de la B que abrió una repetición sin cerrar en el bloque actual
+        self.repeticion = None
+
+    def reportar(self, linea, columna, codigo, mensaje, gravedad=ERROR):
+        self.problemas.append(Problema(linea, columna, codigo, mensaje, gravedad))
+
+    def cerrar_bloque(self):
+        if self.repeticion is not None:
+            linea, columna = self.repeticion
+            self.reportar(linea, columna, "repeticion_sin_cerrar",
+                          "Repetición 'B' sin cerrar en el bloque", ADVERTENCIA)
+        self.repeticion = None
+
+    def especiales(self, texto, n, inicio, especiales=ESPECIALES_LATEX):
+        """Caracteres especiales de LaTeX en `texto`, que empieza en la columna `inicio`."""
+        for columna, caracter in enumerate(texto, inicio):
+            if caracter in especiales:
+                gravedad = ADVERTENCIA if caracter in ADVERTENCIAS_LATEX else ERROR
+                self.reportar(n, columna, "caracter_latex", ESPECIALES_LATEX[caracter], gravedad)
+
+    def llaves(self, texto, n, inicio):
+        abiertas = []
+        for columna, caracter in enumerate(texto, inicio):
+            if caracter == '{':
+                abiertas.append(columna)
+            elif caracter == '}':
+                if abiertas:
+                    abiertas.pop()
+                else:
+                    self.reportar(n, columna, "llave_desbalanceada", "'}' sin '{' que la abra")
+        for columna in abiertas:
+            self.reportar(n, columna, "llave_desbalanceada", "'{' sin '}' que la cierre")
+
+    def titulo(self, original, n, marca):
+        sangria = len(original) - len(original.lstrip())
+        texto = original.strip()[len(marca):]
+        if not _RE_ESPECIAL_TITULO.search(texto):
+            return
+        inicio = sangria + len(marca) + 1
+        self.especiales(texto, n, inicio)
+        self.llaves(texto, n, inicio)
+        for columna, caracter in enumerate(texto, inicio):
+            if caracter in '#_':
+                self.reportar(n, columna, "caracter_latex", f"'{caracter}' no puede ir en un título")
+
+    def acordes(self, original, n, usados):
+        """Los `usados` primeros acordes de la línea (los que llevan '_'); los demás no se imprimen."""
+        tokens = original.split()[:usados]
+        try:
+            for token in tokens:
+                parsear_acorde(token)
+            if not _RE_ESPECIAL.search(''.join(tokens).replace('#', '')):
+                return
+        except (ValueError, RuntimeError):
+            pass
+        # Hay algo que informar: otra pasada, ahora con columnas
+        for m in list(_RE_PALABRA.finditer(original))[:usados]:
+            token = m.group()
+            try:
+                parsear_acorde(token)
+            except (ValueError, RuntimeError):
+                self.reportar(n, m.start() + 1, "acorde_invalido", f"Acorde inválido '{token}'")
+                continue
+            for columna, caracter in enumerate(token, m.start() + 1):
+                if caracter in ESPECIALES_LATEX or caracter in '{}':
+                    self.reportar(n, columna, "caracter_latex",
+                                  f"'{caracter}' no puede ir en un acorde ('{token}')")
+
+    def repeticiones(self, original, n):
+        """Marcas B / B<n> (sólo en líneas con más palabras que la marca)."""
+        palabras = list(_RE_PALABRA.finditer(original))
+        if len(palabras) < 2:
+            return
+        for m in palabras:
+            if _RE_REPETICION.fullmatch(m.group()):
+                self.repeticion = None if self.repeticion else (n, m.start() + 1)
+
+    def especiales_letra(self, original, n, con_acordes):
+        self.llaves(original, n, 1)
+        for m in _RE_PALABRA.finditer(original):
+            palabra = m.group()
+            columna = m.start() + 1
+            # '#' al comienzo marca el índice, pero sólo si la línea anterior es de acordes
+            if con_acordes and palabra[0] == '#':
+                if palabra.endswith('='):
+                    self.reportar(n, columna, "indice_vacio",
+                                  f"La palabra '{palabra}' tiene '=' pero no dice qué va en el índice",
+                                  ADVERTENCIA)
+                palabra = palabra[1:]
+                columna += 1
+            self.especiales(palabra, n, columna)
+            for desplazamiento, caracter in enumerate(palabra):
+                if caracter == '#':
+                    self.reportar(
+                        n, columna + desplazamiento, "caracter_latex",
+                        "'#' sólo marca el índice al comienzo de una palabra en una línea con acordes"
+                    )
+
+    def letra(self, original, n, acordes, linea_acordes):
+        """
+        Línea de letra; `acordes` son los tokens de la línea de acordes
+        anterior, o None. Devuelve cuántos de esos acordes usa la línea.
+        """
+        if 'B' in original:
+            self.repeticiones(original, n)
+        if _RE_ESPECIAL.search(original):
+            self.especiales_letra(original, n, acordes is not None)
+        if acordes is None:
+            return 0
+
+        # Sin '#' cada '_' consume un acorde: basta contarlos
+        idx_acorde = original.count('_')
+        if idx_acorde > len(acordes) or (idx_acorde and '#' in original):
+            idx_acorde = 0
+            for m in _RE_PALABRA.finditer(original):
+                palabra = m.group()
+                if '_' not in palabra:
+                    continue
+                # En '#pal_abra=Palabra' sólo cuentan los '_' antes del '='
+                base = palabra[1:].split('=', 1)[0] if palabra[0] == '#' else palabra
+                guiones = base.count('_')
+                if idx_acorde + guiones > len(acordes):
+                    self.reportar(
+                        n, m.start() + 1, "guiones_sin_acorde",
+                        f"Hay más '_' que acordes en la palabra '{palabra}' "
+                        f"(la línea {linea_acordes} tiene {len(acordes)} acordes)"
+                    )
+                idx_acorde = min(idx_acorde + guiones, len(acordes))
+
+        if idx_acorde < len(acordes):
+            self.reportar(
+                n, 1, "acordes_sin_guion",
+                f"{len(acordes) - idx_acorde} de los {len(acordes)} acordes de la línea "
+                f"{linea_acordes} no tienen '_' en esta línea y no se imprimen",
+                ADVERTENCIA
+            )
+        return idx_acorde
+
+
+def validar(texto, desplazamiento=0):
+    """
+    Lista de Problema (errores y advertencias) ordenada por línea y columna.
+    `desplazamiento`: líneas antes de `texto` cuando es un segmento de otro.
+    """
+    originales = [l.rstrip() for l in texto.split('\n')]
+    lineas_acordes = [es_linea_acordes(l) for l in originales]
+    v = _Validador()
+    en_bloque = False
+    raw_mode = False
+
+    i = 0
+    while i < len(originales):
+        original = originales[i]
+        linea = original.strip()
+        n = i + 1 + desplazamiento
+
+        if raw_mode:
+            if linea in ('V', 'CH', 'M', 'O', 'S'):
+                raw_mode = False
+                continue
+            if linea != 'N':
+                sangria = len(original) - len(original.lstrip())
+                v.especiales(linea, n, sangria + 1, ESPECIALES_RAW)
+            i += 1
+            continue
+
+        if linea == 'N':
+            v.cerrar_bloque()
+            en_bloque = False
+            raw_mode = True
+        elif linea.startswith(('S ', 'O ')):
+            v.cerrar_bloque()
+            en_bloque = False
+            v.titulo(original, n, linea[:2])
+        elif linea in TIPOS_BLOQUE:
+            v.cerrar_bloque()
+            en_bloque = True
+            # Caso especial del parser: V / CH / _Estrofa (CH es el acorde Do)
+            if linea == 'V' and i + 2 < len(originales) \
+                    and originales[i + 1].strip() == 'CH' and originales[i + 2].strip().startswith('_'):
+                v.letra(originales[i + 2], n + 2, ['C'], n + 1)
+                i += 3
+                continue
+        elif lineas_acordes[i]:
+            # Se revisa con la letra que la sigue: sólo se imprimen los acordes con '_'
+            pass
+        elif en_bloque:
+            if i > 0 and lineas_acordes[i - 1]:
+                usados = v.letra(original, n, originales[i - 1].split(), n - 1)
+                v.acordes(originales[i - 1], n - 1, usados)
+            else:
+                v.letra(original, n, None, None)
+        elif linea:
+            v.reportar(n, 1, "fuera_de_bloque",
+                       "Texto fuera de un bloque V, CH, M o N: no se imprime", ADVERTENCIA)
+        i += 1
+
+    v.cerrar_bloque()
+    v.problemas.sort(key=lambda p: (p.linea, p.columna))
+    return v.problemas
+
+
+class CacheValidacion:
+    """
+    LRU en memoria de los segmentos del texto (songpro.dividir_en_segmentos)
+    que ya se validaron sin problemas, por sha256 del segmento. Cortan donde
+    el parser empieza de cero, y ahí el validador también: cada segmento
+    validado por separado da los mismos problemas que dentro del texto
+    entero. Sólo se guardan los que no tienen ninguno, porque los mensajes
+    citan números de línea que cambian si el segmento se mueve; los demás
+    se validan de nuevo en su lugar. maximo=0 la desactiva.
+    """
+
+    def __init__(self, maximo):
+        self.maximo = maximo
+        self._validos = OrderedDict()
+        self._lock = threading.Lock()
+        self.aciertos = 0
+        self.fallos = 0
+
+    @property
+    def habilitada(self):
+        return self.maximo > 0
+
+    def validar(self, texto):
+        """Los mismos problemas que validar(texto)."""
+        if not self.habilitada:
+            return validar(texto)
+        problemas = []
+        for _, inicio, lineas in dividir_en_segmentos(texto):
+            segmento = '\n'.join(lineas)
+            clave = hashlib.sha256(segmento.encode("utf-8")).hexdigest()
+            with self._lock:
+                if clave in self._validos:
+                    self._validos.move_to_end(clave)
+                    self.aciertos += 1
+                    continue
+                self.fallos += 1
+
+            # Se valida fuera del lock, como en CacheAST
+            propios = validar(segmento, inicio)
+            if propios:
+                problemas.extend(propios)
+                continue
+            with self._lock:
+                self._validos[clave] = None
+                self._validos.move_to_end(clave)
+                while len(self._validos) > self.maximo:
+                    self._validos.popitem(last=False)
+        return problemas
+
+    def estadisticas(self):
+        with self._lock:
+            return {
+                "habilitada": self.habilitada,
+                "segmentos": len(self._validos),
+                "maximo": self.maximo,
+                "aciertos": self.aciertos,
+                "fallos": self.fallos,
+            }
+
+
+def validar_o_lanzar(texto, cache=None):
+    """
+    Lanza TextoInvalido si hay errores; devuelve las advertencias.
+    Con `cache` (CacheValidacion) sólo se validan los segmentos nuevos.
+    """
+    problemas = cache.validar(texto) if cache is not None else validar(texto)
+    if any(p.gravedad == ERROR for p in problemas):
+        raise TextoInvalido(problemas)
+    return problemas
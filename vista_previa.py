@@ -0,0 +1,255 @@
+"""
+Vista previa de un Cancionero (songpro.py) sin pasar por pdflatex.
+
+- renderizar_html(cancionero): página HTML con los acordes sobre las sílabas
+- renderizar_texto(cancionero): texto plano, línea de acordes sobre la letra
+
+Muestra lo mismo que el PDF: transposición del título (=+N), estrofas y
+coros, palabras del índice en negrita y bloques N tal cual. Además marca
+las repeticiones (B ... B<n>), que el PDF imprime como texto.
+"""
+import re
+from dataclasses import dataclass
+from functools import lru_cache
+from html import escape
+from typing import Optional
+
+from songpro import Bloque, Palabra
+
+TITULOS_BLOQUE = {'verse': 'Estrofa', 'chorus': 'Coro', 'melody': 'Melodía'}
+
+ESTILO_HTML = """
+body{font-family:Georgia,serif;max-width:48em;margin:1em auto;padding:0 1em;color:#222}
+h2{border-bottom:2px solid #444;margin-top:2em}
+h3{margin:1.5em 0 .5em}
+.bloque{margin:.6em 0}
+.chorus{margin-left:2em;font-style:italic}
+.linea{line-height:1.2;margin-top:1.25em;white-space:pre-wrap}
+.linea.sin-acordes{margin-top:.2em}
+.a{display:inline-block;position:relative}
+.c{position:absolute;bottom:1.1em;left:0;font:bold .85em sans-serif;color:#b03;font-style:normal;white-space:nowrap}
+.raw{font-family:inherit;margin:.6em 0}
+.rep{font:bold .9em sans-serif;color:#555;font-style:normal}
+""".strip()
+
+# Marca de repetición en la letra: B abre, la siguiente B o B<n> cierra
+_RE_REPETICION = re.compile(r'B\d*')
+# (abre, cierra) de una repetición B ... B<n>
+REPETICION_HTML = ('<span class="rep">‖:</span>', '<span class="rep">:‖ ×{}</span>')
+REPETICION_TEXTO = ('|:', ':| x{}')
+
+
+_ESPECIALES_HTML = re.compile(r'[&<>"\']')
+
+
+def _escapar(texto):
+    return escape(texto) if _ESPECIALES_HTML.search(texto) else texto
+
+
+def _tal_cual(texto):
+    return texto
+
+
+@dataclass(slots=True)
+class Repeticion:
+    """Marca B / B<n>: la que abre lleva veces None; B<n> cierra n veces, B sola 2."""
+    veces: Optional[int] = None
+
+
+def marcar_repeticiones(linea, abierta):
+    """
+    (partes, abierta): las partes de `linea` con las marcas B / B<n> como
+    Repeticion, y si el bloque queda con una repetición abierta. Sin marcas,
+    partes es linea.palabras. Como en el validador, sólo cuentan en líneas
+    de más de una palabra; una línea sin acordes se parte sin los '_'.
+    """
+    if 'B' not in linea.texto:
+        return linea.palabras, abierta
+    if linea.palabras is None:
+        partes = (linea.texto.replace('_', ''),)
+    else:
+        partes = linea.palabras
+    if sum(len(p.split()) if p.__class__ is str else 1 for p in partes) < 2:
+        return linea.palabras, abierta
+
+    palabras = []
+    hubo_marca = False
+    for parte in partes:
+        if parte.__class__ is not str:
+            palabras.append(parte)
+            continue
+        simples = []
+        for palabra in parte.split():
+            if not _RE_REPETICION.fullmatch(palabra):
+                simples.append(palabra)
+                continue
+            if simples:
+                palabras.append(' '.join(simples))
+                simples = []
+            palabras.append(Repeticion(int(palabra[1:] or 2)) if abierta else Repeticion())
+            abierta = not abierta
+            hubo_marca = True
+        if simples:
+            palabras.append(' '.join(simples))
+    if not hubo_marca:
+        return linea.palabras, abierta
+    return tuple(palabras), abierta
+
+
+def _partes_bloque(bloque):
+    """(línea, partes) de cada línea del bloque, y si quedó una repetición sin cerrar."""
+    abierta = False
+    lineas = []
+    for linea in bloque.lineas:
+        partes, abierta = marcar_repeticiones(linea, abierta)
+        lineas.append((linea, partes))
+    return lineas, abierta
+
+
+@lru_cache(maxsize=1024)
+def _acorde_html(acorde):
+    return f'<span class="a"><span class="c">{escape(acorde)}</span>'
+
+
+def _recorrer(cancionero):
+    """
+    (nivel, nodo, transposición) en orden del documento; nivel es
+    'seccion', 'cancion' o 'elemento'. Los elementos fuera de una canción
+    usan la transposición de la anterior, igual que en el PDF.
+    """
+    transposicion = 0
+    for seccion in cancionero.secciones:
+        if seccion.titulo is not None:
+            yield 'seccion', seccion, transposicion
+        for elemento in seccion.elementos:
+            yield 'elemento', elemento, transposicion
+        for cancion in seccion.canciones:
+            transposicion = cancion.transposicion
+            yield 'cancion', cancion, transposicion
+            for elemento in cancion.elementos:
+                yield 'elemento', elemento, transposicion
+
+
+# =========================
+# HTML
+# =========================
+def _palabra_html(palabra, semitonos, acordes, escapar):
+    """`acordes`: HTML de cada acorde ya transportado, por su texto original."""
+    html = escapar(palabra.inicio)
+    for ancla in palabra.anclas:
+        original = ancla.acorde.original
+        acorde = acordes.get(original)
+        if acorde is None:
+            acorde = acordes[original] = _acorde_html(ancla.acorde.transportar(semitonos))
+        html += acorde + (escapar(ancla.texto) or "&nbsp;") + '</span>'
+    if palabra.indice is not None:
+        return f'<b title="{escape(palabra.indice)}">{html}</b>'
+    return html
+
+
+def _repeticion(repeticion, marcas):
+    """`marcas`: REPETICION_HTML o REPETICION_TEXTO."""
+    if repeticion.veces is None:
+        return marcas[0]
+    return marcas[1].format(repeticion.veces)
+
+
+def _linea_html(linea, partes, semitonos, acordes):
+    """`partes`: las de marcar_repeticiones()."""
+    # La letra casi nunca trae caracteres especiales: se buscan una vez en la
+    # línea entera y, si no hay, ninguna de sus partes se revisa
+    escapar = _escapar if _ESPECIALES_HTML.search(linea.texto) else _tal_cual
+    if partes is None:
+        return f'<div class="linea sin-acordes">{escapar(linea.texto.replace("_", "")) or "&nbsp;"}</div>'
+    contenido = ' '.join(
+        escapar(p) if p.__class__ is str
+        else _palabra_html(p, semitonos, acordes, escapar) if p.__class__ is Palabra
+        else _repeticion(p, REPETICION_HTML)
+        for p in partes
+    )
+    clase = "linea" if linea.palabras is not None else "linea sin-acordes"
+    return f'<div class="{clase}">{contenido or "&nbsp;"}</div>'
+
+
+def renderizar_html(cancionero, titulo="Vista previa"):
+    partes = [
+        '<!DOCTYPE html><html lang="es"><head><meta charset="utf-8">',
+        f'<title>{escape(titulo)}</title><style>{ESTILO_HTML}</style></head><body>',
+    ]
+    # Por transposición, el HTML de cada acorde: se transporta una vez por render
+    por_transposicion = {}
+    for nivel, nodo, semitonos in _recorrer(cancionero):
+        if nivel == 'seccion':
+            partes.append(f'<h2>{escape(nodo.titulo)}</h2>')
+        elif nivel == 'cancion':
+            partes.append(f'<h3>{escape(nodo.titulo)}</h3>')
+        elif isinstance(nodo, Bloque):
+            acordes = por_transposicion.setdefault(semitonos, {})
+            partes.append(f'<div class="bloque {nodo.tipo}" title="{TITULOS_BLOQUE[nodo.tipo]}">')
+            lineas, abierta = _partes_bloque(nodo)
+            partes.extend(_linea_html(l, p, semitonos, acordes) for l, p in lineas)
+            if abierta:
+                partes.append(f'<div class="linea sin-acordes">{REPETICION_HTML[1].format(2)}</div>')
+            partes.append('</div>')
+        else:
+            partes.append(f'<pre class="raw">{escape(chr(10).join(nodo.lineas))}</pre>')
+    partes.append('</body></html>')
+    return ''.join(partes)
+
+
+# =========================
+# TEXTO
+# =========================
+def _linea_texto(linea, partes, semitonos):
+    """
+    (línea de acordes, letra); la de acordes es '' si no hay acordes.
+    `partes`: las de marcar_repeticiones().
+    """
+    if partes is None:
+        return '', linea.texto.replace('_', '')
+
+    acordes = ''
+    letra = ''
+    for n, palabra in enumerate(partes):
+        if n:
+            letra += ' '
+        if palabra.__class__ is str:
+            letra += palabra
+            continue
+        if palabra.__class__ is not Palabra:
+            letra += _repeticion(palabra, REPETICION_TEXTO)
+            continue
+        letra += palabra.inicio
+        for ancla in palabra.anclas:
+            # Cada acorde empieza sobre su sílaba, o justo después del anterior
+            if len(acordes) < len(letra):
+                acordes += ' ' * (len(letra) - len(acordes))
+            elif acordes:
+                acordes += ' '
+            acordes += ancla.acorde.transportar(semitonos)
+            letra += ancla.texto
+    return acordes, letra
+
+
+def renderizar_texto(cancionero):
+    salida = []
+    for nivel, nodo, semitonos in _recorrer(cancionero):
+        if nivel == 'seccion':
+            salida.extend(['', nodo.titulo.upper(), '=' * len(nodo.titulo)])
+        elif nivel == 'cancion':
+            salida.extend(['', nodo.titulo, '-' * len(nodo.titulo)])
+        elif isinstance(nodo, Bloque):
+            sangria = '    ' if nodo.tipo == 'chorus' else ''
+            salida.append('')
+            lineas, abierta = _partes_bloque(nodo)
+            for linea, partes in lineas:
+                acordes, letra = _linea_texto(linea, partes, semitonos)
+                if acordes:
+                    salida.append(sangria + acordes)
+                salida.append((sangria + letra).rstrip())
+            if abierta:
+                salida.append(sangria + REPETICION_TEXTO[1].format(2))
+        else:
+            salida.append('')
+            salida.extend(nodo.lineas)
+    return '\n'.join(salida).strip('\n') + '\n'